@@ -0,0 +1,201 @@
+"""
+Boolean queries over the actbl.js rows, evaluated with NumPy over every
+song at once:
+
+    index = ActblIndex(get_textage_version_data())
+    index.select("current & ~infinitas")
+    index.select("infinitas & (SP_ANOTHER >= 12 | SP_LEGGENDARIA)")
+
+Names are the version flag bits (current, infinitas, bit<n>),
+difficulty names for that chart's level (on its own, "has a level") and
+<difficulty>_FLAG for that chart's flag column. Combine them with
+&, |, ~ and parentheses, and compare with ==, !=, <, <=, >, >=.
+"""
+
+import re
+import logging
+import operator
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from local_dataclasses import Difficulty
+
+log = logging.getLogger(__name__)
+
+# version flag, 0, then a (flag, level) pair per Difficulty.value
+ACTBL_COLUMNS = 22
+VERSION_FLAG_BITS = {"current": 0, "infinitas": 1}
+# queries are written by hand, a few hundred distinct ones is plenty
+COMPILED_QUERY_CACHE_SIZE = 256
+QUERY_TOKEN_REGEX = re.compile(r"\s*(?:(\d+)|(\w+)|(==|!=|<=|>=|<|>|[&|~()]))")
+QUERY_COMPARATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+ActblMask = NDArray[np.bool_]
+CompiledQuery = Callable[[NDArray[np.int32]], ActblMask]
+
+
+class ActblQueryError(ValueError):
+    pass
+
+
+def _tokenize(query: str) -> List[Tuple[str, str]]:
+    tokens: List[Tuple[str, str]] = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        token_match = QUERY_TOKEN_REGEX.match(query, position)
+        if not token_match:
+            raise ActblQueryError(f"cannot read {query[position:]!r} in {query!r}")
+        number, name, symbol = token_match.groups()
+        if number is not None:
+            tokens.append(("number", number))
+        elif name is not None:
+            tokens.append(("name", name))
+        else:
+            tokens.append(("symbol", symbol))
+        position = token_match.end()
+    return tokens
+
+
+def _column(name: str) -> Callable[[NDArray[np.int32]], NDArray[np.int32]]:
+    if name in VERSION_FLAG_BITS or re.fullmatch(r"bit\d+", name):
+        bit = VERSION_FLAG_BITS.get(name)
+        if bit is None:
+            bit = int(name[3:])
+        return lambda matrix: (matrix[:, 0] >> bit) & 1
+    chart_flag = name.endswith("_FLAG")
+    difficulty_name = name[: -len("_FLAG")] if chart_flag else name
+    if difficulty_name not in Difficulty.__members__ or difficulty_name == "UNKNOWN":
+        raise ActblQueryError(f"unknown name {name}")
+    column = Difficulty[difficulty_name].value * 2 + (0 if chart_flag else 1)
+    return lambda matrix: matrix[:, column]
+
+
+def _combine(
+    combine: Callable[[Any, Any], Any], left: CompiledQuery, right: CompiledQuery
+) -> CompiledQuery:
+    return lambda matrix: combine(left(matrix), right(matrix))
+
+
+class _QueryParser:
+    """
+    or := and ("|" and)*
+    and := not ("&" not)*
+    not := "~" not | atom
+    atom := "(" or ")" | name [comparator number]
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.tokens = _tokenize(query)
+        self.position = 0
+
+    def _peek(self) -> Tuple[str, str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return ("end", "")
+
+    def _take(self) -> Tuple[str, str]:
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def parse(self) -> CompiledQuery:
+        compiled = self._or()
+        if self._peek()[0] != "end":
+            raise ActblQueryError(f"unexpected {self._peek()[1]!r} in {self.query!r}")
+        return compiled
+
+    def _or(self) -> CompiledQuery:
+        compiled = self._and()
+        while self._peek() == ("symbol", "|"):
+            self._take()
+            compiled = _combine(operator.or_, compiled, self._and())
+        return compiled
+
+    def _and(self) -> CompiledQuery:
+        compiled = self._not()
+        while self._peek() == ("symbol", "&"):
+            self._take()
+            compiled = _combine(operator.and_, compiled, self._not())
+        return compiled
+
+    def _not(self) -> CompiledQuery:
+        if self._peek() == ("symbol", "~"):
+            self._take()
+            inner = self._not()
+            return lambda matrix: ~inner(matrix)
+        return self._atom()
+
+    def _atom(self) -> CompiledQuery:
+        kind, value = self._take()
+        if (kind, value) == ("symbol", "("):
+            compiled = self._or()
+            if self._take() != ("symbol", ")"):
+                raise ActblQueryError(f"missing ) in {self.query!r}")
+            return compiled
+        if kind != "name":
+            raise ActblQueryError(f"unexpected {value!r} in {self.query!r}")
+        column = _column(value)
+        next_kind, comparator = self._peek()
+        if next_kind == "symbol" and comparator in QUERY_COMPARATORS:
+            self._take()
+            number_kind, number = self._take()
+            if number_kind != "number":
+                raise ActblQueryError(f"{value} {comparator} needs a number")
+            compare = QUERY_COMPARATORS[comparator]
+            return lambda matrix: compare(column(matrix), int(number))
+        return lambda matrix: column(matrix) != 0
+
+
+@lru_cache(maxsize=COMPILED_QUERY_CACHE_SIZE)
+def compile_actbl_query(query: str) -> CompiledQuery:
+    return _QueryParser(query).parse()
+
+
+class ActblIndex:
+    """
+    The actbl rows as one (songs x ACTBL_COLUMNS) int32 matrix, in
+    actbl's order.
+    """
+
+    def __init__(self, version_data: Mapping[str, List[int]]):
+        self.textage_ids: List[str] = list(version_data.keys())
+        self.row_by_textage_id: Dict[str, int] = {
+            textage_id: row for row, textage_id in enumerate(self.textage_ids)
+        }
+        self.matrix: NDArray[np.int32] = np.array(
+            [row[:ACTBL_COLUMNS] for row in version_data.values()], dtype=np.int32
+        ).reshape(len(self.textage_ids), ACTBL_COLUMNS)
+
+    def mask(self, query: str) -> ActblMask:
+        return compile_actbl_query(query)(self.matrix)
+
+    def select(self, query: str) -> List[str]:
+        return [self.textage_ids[row] for row in np.flatnonzero(self.mask(query))]
+
+    def filter_titles(
+        self, query: str, song_titles: Mapping[str, List[str]]
+    ) -> Dict[str, List[str]]:
+        """
+        The song_titles rows whose actbl row matches query, in
+        song_titles' order. Titles missing from actbl are left out.
+        """
+        matches = self.mask(query).tolist()
+        row_by_textage_id = self.row_by_textage_id
+        return {
+            textage_id: title
+            for textage_id, title in song_titles.items()
+            if textage_id in row_by_textage_id
+            and matches[row_by_textage_id[textage_id]]
+        }
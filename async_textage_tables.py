@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+asyncio counterparts of the getters in download_textage_tables.
+
+Downloads are run on the default executor concurrently so the event
+loop never waits on requests.get. Converting and parsing is CPU bound,
+so it also goes to an executor: the default thread pool unless a
+ProcessPoolExecutor (or anything else) is passed in.
+
+Run as a script, this refreshes the cached catalog twice, on the thread
+pool and on a process pool, and checks that every snapshot has the same
+version as its SongReference.
+"""
+
+import os
+import asyncio
+import logging
+import argparse
+import functools
+import dataclasses
+from pathlib import Path
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from compressed_cache import migrate_cache_directory
+from local_dataclasses import SongMetadata
+from refresh_daemon import CatalogSnapshot, build_catalog_snapshot
+from download_textage_tables import (
+    TEXTAGE_JAVASCRIPT_FILES,
+    get_all_song_metadata,
+    get_textage_song_titles,
+    get_textage_version_data,
+    get_textage_version_list,
+    get_infinitas_song_metadata,
+    get_textage_javascript_digest,
+    _get_textage_metadata_path,
+    _download_textage_javascript,
+    get_current_version_song_metadata_not_in_infinitas,
+)
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+async def _run_in_executor(
+    executor: Optional[Executor], function: Callable[..., T], *args: Any, **kwargs: Any
+) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(function, *args, **kwargs)
+    )
+
+
+async def download_textage_javascript_files_async(
+    javascript_files: List[str] = TEXTAGE_JAVASCRIPT_FILES,
+) -> Dict[str, Path]:
+    textage_metadata_path = _get_textage_metadata_path()
+    os.makedirs(textage_metadata_path, exist_ok=True)
+    # like the sync download, so plain files don't stay next to .gz ones
+    await _run_in_executor(None, migrate_cache_directory, textage_metadata_path)
+    downloads = [
+        _run_in_executor(
+            None, _download_textage_javascript, javascript_file, textage_metadata_path
+        )
+        for javascript_file in javascript_files
+    ]
+    paths = await asyncio.gather(*downloads)
+    return dict(zip(javascript_files, paths))
+
+
+async def get_textage_version_data_async(
+    download: bool = True, executor: Optional[Executor] = None
+) -> Dict[str, Any]:
+    if download:
+        await download_textage_javascript_files_async(["actbl.js"])
+    return await _run_in_executor(executor, get_textage_version_data, download=False)
+
+
+async def get_textage_song_titles_async(
+    download: bool = True, executor: Optional[Executor] = None
+) -> Dict[str, Any]:
+    if download:
+        await download_textage_javascript_files_async(["titletbl.js"])
+    return await _run_in_executor(executor, get_textage_song_titles, download=False)
+
+
+async def get_textage_version_list_async(
+    download: bool = True, executor: Optional[Executor] = None
+) -> Any:
+    if download:
+        await download_textage_javascript_files_async(["scrlist.js"])
+    return await _run_in_executor(executor, get_textage_version_list, download=False)
+
+
+async def get_infinitas_song_metadata_async(
+    download: bool = True, executor: Optional[Executor] = None
+) -> Dict[str, SongMetadata]:
+    if download:
+        await download_textage_javascript_files_async()
+    return await _run_in_executor(executor, get_infinitas_song_metadata, download=False)
+
+
+async def get_current_version_song_metadata_not_in_infinitas_async(
+    download: bool = True, executor: Optional[Executor] = None
+) -> Dict[str, SongMetadata]:
+    if download:
+        await download_textage_javascript_files_async()
+    return await _run_in_executor(
+        executor, get_current_version_song_metadata_not_in_infinitas, download=False
+    )
+
+
+async def get_all_song_metadata_async(
+    download: bool = True, executor: Optional[Executor] = None
+) -> Dict[str, SongMetadata]:
+    if download:
+        await download_textage_javascript_files_async()
+    return await _run_in_executor(executor, get_all_song_metadata, download=False)
+
+
+async def refresh_catalog_async(
+    previous: Optional[CatalogSnapshot] = None,
+    download: bool = True,
+    executor: Optional[Executor] = None,
+) -> CatalogSnapshot:
+    """
+    Revalidates the textage files and returns a new CatalogSnapshot,
+    or previous itself if nothing changed. Nothing is modified in place,
+    so the caller swaps the result in whenever it likes.
+    """
+    if download:
+        await download_textage_javascript_files_async()
+    digest = await _run_in_executor(None, get_textage_javascript_digest)
+    if previous is not None and previous.digest == digest:
+        log.info(f"textage data unchanged ({digest[:12]}), keeping catalog")
+        return previous
+    if previous is None:
+        return await _run_in_executor(executor, build_catalog_snapshot)
+    version = previous.version + 1
+    if not isinstance(executor, ProcessPoolExecutor):
+        return await _run_in_executor(
+            executor, build_catalog_snapshot, previous, version=version
+        )
+    # another process only gets what the statistics update needs, not the
+    # whole previous catalog with its SongReference
+    return await _run_in_executor(
+        executor,
+        build_catalog_snapshot,
+        version=version,
+        previous_statistics=previous.statistics,
+        previous_songs=dict(previous.songs),
+    )
+
+
+async def _check_refresh_versions(executor: Optional[Executor], label: str):
+    first = await refresh_catalog_async(download=False, executor=executor)
+    # a different digest makes the second refresh rebuild
+    second = await refresh_catalog_async(
+        dataclasses.replace(first, digest=""), download=False, executor=executor
+    )
+    for snapshot in (first, second):
+        if snapshot.song_reference.version != snapshot.version:
+            raise RuntimeError(
+                f"{label}: snapshot version {snapshot.version} has song "
+                f"reference version {snapshot.song_reference.version}"
+            )
+    if second.version != first.version + 1:
+        raise RuntimeError(f"{label}: refreshed {first.version} to {second.version}")
+    print(f"{label}: refreshed catalog versions {first.version} and {second.version}")
+
+
+async def _check_refreshes():
+    await _check_refresh_versions(None, "thread pool")
+    # the snapshot has to survive pickling back from the worker
+    with ProcessPoolExecutor(1) as executor:
+        await _check_refresh_versions(executor, "process pool")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Refresh the cached catalog twice through the async API, "
+        "on threads and on a process pool, and check the snapshot and "
+        "SongReference versions agree"
+    )
+    parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_check_refreshes())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Times each stage of the catalog/page build against synthetic textage
+corpora of increasing size, and saves the results as JSON so runs can be
+compared:
+
+    python3 benchmark_pipeline.py --output before.json
+    python3 benchmark_pipeline.py --output after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+import download_textage_tables as textage
+from local_dataclasses import SongMetadata
+from compressed_cache import open_cache_file
+from generate_textage_corpus import write_textage_corpus
+from write_html import build_table, generate_all_sorted_tables
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SCALES = "1,10,100"
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+# stages faster than this are too noisy to flag as regressions
+MINIMUM_COMPARED_SECONDS = 0.005
+
+
+def _best_time(function: Callable[[], Any], repeats: int) -> Tuple[float, Any]:
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def benchmark_scale(scale: float, repeats: int) -> Dict[str, Any]:
+    """
+    download_textage_tables reads .textage-metadata through
+    TEXTAGE_METADATA_PATH, so the synthetic corpus is pointed at
+    with that before anything is run.
+    """
+    stages: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as corpus_directory:
+        metadata_path = Path(corpus_directory) / Path(".textage-metadata")
+        write_textage_corpus(metadata_path, scale)
+        os.environ["TEXTAGE_METADATA_PATH"] = str(metadata_path)
+        try:
+            parsed: Dict[str, Any] = {}
+            for javascript_file, (
+                start_regex,
+                end_regex,
+                line_parser,
+            ) in textage.TEXTAGE_JAVASCRIPT_PARSERS.items():
+                stages[f"convert {javascript_file}"], parsed_file = _best_time(
+                    lambda: textage._convert_javascript_and_write_to_json(
+                        metadata_path / Path(javascript_file),
+                        start_regex,
+                        end_regex,
+                        line_parser,
+                        textage.TEXTAGE_JAVASCRIPT_TRAILING_PARSERS.get(
+                            javascript_file
+                        ),
+                    ),
+                    repeats,
+                )
+
+                def _load() -> Any:
+                    with open_cache_file(parsed_file) as reader:
+                        return json.load(reader)
+
+                stages[f"json.load {javascript_file}"], parsed[javascript_file] = (
+                    _best_time(_load, repeats)
+                )
+            version_data = parsed["actbl.js"]
+            song_titles = parsed["titletbl.js"]
+            validated_songs = {
+                textage_id: title
+                for textage_id, title in song_titles.items()
+                if textage_id in version_data
+            }
+            stages["_read_difficulty"], _ = _best_time(
+                lambda: textage._read_difficulty(version_data), repeats
+            )
+            stages["read_notes_and_bpm"], (bpm_by_textage_id, _) = _best_time(
+                lambda: textage.read_notes_and_bpm(download=False), repeats
+            )
+            bpm_rules = textage._get_variable_bpm_rules(download=False)
+            stages["compile_bpm_table"], _ = _best_time(
+                lambda: textage.compile_bpm_table(bpm_by_textage_id, bpm_rules),
+                repeats,
+            )
+            stages["_build_song_metadata_dict"], songs_by_id = _best_time(
+                lambda: textage._build_song_metadata_dict(
+                    version_data, song_titles, validated_songs, download=False
+                ),
+                repeats,
+            )
+            songs: List[SongMetadata] = list(songs_by_id.values())
+            stages["sort by alphanumeric"], sorted_songs = _best_time(
+                lambda: sorted(songs, key=SongMetadata.sort_by_alphanumeric), repeats
+            )
+            stages["sort by version"], _ = _best_time(
+                lambda: sorted(songs, key=SongMetadata.sort_by_version), repeats
+            )
+            stages["sort by spa"], _ = _best_time(
+                lambda: sorted(songs, key=SongMetadata.sort_by_spa), repeats
+            )
+            stages["build_table"], _ = _best_time(
+                lambda: build_table(("alphanumeric", "By Title"), sorted_songs),
+                repeats,
+            )
+            stages["generate_all_sorted_tables"], _ = _best_time(
+                lambda: generate_all_sorted_tables(songs), repeats
+            )
+        finally:
+            del os.environ["TEXTAGE_METADATA_PATH"]
+    return {"songs": len(songs), "stages": stages}
+
+
+def compare_results(
+    previous: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> List[str]:
+    regressions = []
+    for scale, scale_results in current["scales"].items():
+        if scale not in previous["scales"]:
+            continue
+        previous_stages = previous["scales"][scale]["stages"]
+        for stage, seconds in scale_results["stages"].items():
+            if stage not in previous_stages:
+                continue
+            before = previous_stages[stage]
+            if max(before, seconds) < MINIMUM_COMPARED_SECONDS:
+                continue
+            if seconds > before * (1 + threshold):
+                regressions.append(
+                    f"{scale}x {stage}: {before * 1000:.1f}ms -> {seconds * 1000:.1f}ms"
+                    f" (+{(seconds / before - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def print_results(results: Dict[str, Any]):
+    for scale, scale_results in results["scales"].items():
+        print(f"{scale}x ({scale_results['songs']} songs)")
+        for stage, seconds in scale_results["stages"].items():
+            print(f"  {stage:32s} {seconds * 1000:10.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--scales", default=DEFAULT_SCALES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="earlier results JSON")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_REGRESSION_THRESHOLD,
+        help="flag stages this much slower than --compare (0.2 = 20%%)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results: Dict[str, Any] = {
+        "created_at": datetime.now(tz=timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": args.repeats,
+        "scales": {},
+    }
+    for scale in args.scales.split(","):
+        results["scales"][scale] = benchmark_scale(float(scale), args.repeats)
+    print_results(results)
+    with open(args.output, "wt") as writer:
+        json.dump(results, writer, indent=2)
+    print(f"wrote {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, "rt") as reader:
+            previous = json.load(reader)
+        regressions = compare_results(previous, results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
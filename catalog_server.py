@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+import sys
+import gzip
+import json
+import zlib
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Optional, Any
+
+from catalog_statistics import statistics_dashboard
+from local_dataclasses import Alphanumeric, Difficulty, OCRSongTitles
+from refresh_daemon import CatalogRefresher, CatalogSnapshot
+
+log = logging.getLogger(__name__)
+
+GZIP_MINIMUM_BYTES = 1024
+RESPONSE_CACHE_SIZE = 4096
+# textage can be slow, but a server with nothing to serve shouldn't wait forever
+DEFAULT_STARTUP_TIMEOUT_SECONDS = 120.0
+
+
+class CatalogRequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _single_param(params: Dict[str, List[str]], name: str) -> Optional[str]:
+    values = params.get(name)
+    if not values:
+        return None
+    return values[0]
+
+
+def _required_param(params: Dict[str, List[str]], name: str) -> str:
+    value = _single_param(params, name)
+    if value is None:
+        raise CatalogRequestError(400, f"missing query parameter {name}")
+    return value
+
+
+def _int_param(params: Dict[str, List[str]], name: str) -> Optional[int]:
+    value = _single_param(params, name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise CatalogRequestError(400, f"{name} must be an integer, got {value}")
+
+
+def _required_int_param(params: Dict[str, List[str]], name: str) -> int:
+    value = _int_param(params, name)
+    if value is None:
+        raise CatalogRequestError(400, f"missing query parameter {name}")
+    return value
+
+
+def _difficulty_param(params: Dict[str, List[str]]) -> Optional[Difficulty]:
+    value = _single_param(params, "difficulty")
+    if value is None:
+        return None
+    if value not in Difficulty.__members__:
+        raise CatalogRequestError(400, f"unknown difficulty {value}")
+    return Difficulty[value]
+
+
+def get_song(snapshot: CatalogSnapshot, textage_id: str) -> Dict[str, Any]:
+    if textage_id not in snapshot.songs:
+        raise CatalogRequestError(404, f"unknown textage id {textage_id}")
+    return snapshot.songs[textage_id].to_dict()
+
+
+def list_songs(
+    snapshot: CatalogSnapshot, params: Dict[str, List[str]]
+) -> List[Dict[str, Any]]:
+    """
+    Filters: version, alphanumeric, difficulty, level, soflan.
+    level and soflan apply to the given difficulty, or to any
+    difficulty if none is given.
+    """
+    version = _single_param(params, "version")
+    alphanumeric = _single_param(params, "alphanumeric")
+    if alphanumeric is not None and alphanumeric not in Alphanumeric.__members__:
+        raise CatalogRequestError(400, f"unknown alphanumeric folder {alphanumeric}")
+    difficulty = _difficulty_param(params)
+    level = _int_param(params, "level")
+    soflan_param = _single_param(params, "soflan")
+    soflan = None if soflan_param is None else soflan_param.lower() == "true"
+    found = []
+    for textage_id in sorted(snapshot.songs.keys()):
+        song = snapshot.songs[textage_id]
+        if version is not None and song.version != version:
+            continue
+        if alphanumeric is not None and song.alphanumeric.name != alphanumeric:
+            continue
+        charts = [
+            metadata
+            for chart_difficulty, metadata in song.difficulty_metadata.items()
+            if difficulty is None or chart_difficulty == difficulty
+        ]
+        if difficulty is not None and not charts:
+            continue
+        if level is not None or soflan is not None:
+            charts = [
+                metadata
+                for metadata in charts
+                if (level is None or metadata.level == level)
+                and (soflan is None or metadata.soflan == soflan)
+            ]
+            if not charts:
+                continue
+        found.append(song.to_dict())
+    return found
+
+
+def resolve_play_metadata(
+    snapshot: CatalogSnapshot, params: Dict[str, List[str]]
+) -> List[str]:
+    difficulty_tuple: Tuple[str, int] = (
+        _required_param(params, "difficulty"),
+        _required_int_param(params, "level"),
+    )
+    bpm_tuple: Tuple[int, int] = (
+        _required_int_param(params, "min_bpm"),
+        _required_int_param(params, "max_bpm"),
+    )
+    note_count = _int_param(params, "notes")
+    try:
+        found = snapshot.song_reference.resolve_by_play_metadata(
+            difficulty_tuple, bpm_tuple, note_count
+        )
+    except KeyError:
+        # resolve_by_play_metadata indexes directly, a missing key means no match
+        return []
+    return sorted(found)
+
+
+def resolve_ocr(snapshot: CatalogSnapshot, params: Dict[str, List[str]]) -> Any:
+    song_title = OCRSongTitles(
+        en_title=_single_param(params, "en_title") or "",
+        en_artist=_single_param(params, "en_artist") or "",
+        jp_title=_single_param(params, "jp_title") or "",
+        jp_artist=_single_param(params, "jp_artist") or "",
+    )
+    textage_id = snapshot.song_reference.resolve_ocr(
+        song_title,
+        _required_param(params, "difficulty"),
+        _required_int_param(params, "level"),
+    )
+    return {"textage_id": textage_id}
+
+
+def catalog_status(snapshot: CatalogSnapshot) -> Dict[str, Any]:
+    return {
+        "version": snapshot.version,
+        "digest": snapshot.digest,
+        "built_at": snapshot.built_at.isoformat(),
+        "songs": len(snapshot.songs),
+    }
+
+
+def route_request(snapshot: CatalogSnapshot, path: str) -> Any:
+    """
+    GET /status
+    GET /statistics
+    GET /songs?version=&alphanumeric=&difficulty=&level=&soflan=
+    GET /songs/<textage_id>
+    GET /resolve/play?difficulty=&level=&min_bpm=&max_bpm=[&notes=]
+    GET /resolve/ocr?difficulty=&level=&en_title=&en_artist=&jp_title=&jp_artist=
+    """
+    url = urlsplit(path)
+    params = parse_qs(url.query)
+    parts = [unquote(part) for part in url.path.split("/") if part != ""]
+    if parts == ["status"]:
+        return catalog_status(snapshot)
+    if parts == ["statistics"]:
+        return statistics_dashboard(snapshot.statistics)
+    if parts == ["songs"]:
+        return list_songs(snapshot, params)
+    if len(parts) == 2 and parts[0] == "songs":
+        return get_song(snapshot, parts[1])
+    if parts == ["resolve", "play"]:
+        return resolve_play_metadata(snapshot, params)
+    if parts == ["resolve", "ocr"]:
+        return resolve_ocr(snapshot, params)
+    raise CatalogRequestError(404, f"unknown path {url.path}")
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Whether an If-None-Match header lists etag (or is *). Tags are
+    compared whole, and weakly, so W/"x" matches "x".
+    """
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags:
+        return True
+    return any(tag == etag or tag == f"W/{etag}" for tag in tags)
+
+
+class EncodedResponseCache:
+    """
+    LRU of encoded response bodies for the current catalog version.
+    Every response is a pure function of (catalog, path), so this is
+    emptied whenever a new catalog is published.
+    """
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._catalog_version = 0
+        self._lock = threading.Lock()
+        self._responses: "OrderedDict[Tuple[str, bool], Tuple[bytes, bool]]" = (
+            OrderedDict()
+        )
+
+    def get(
+        self, catalog_version: int, key: Tuple[str, bool]
+    ) -> Optional[Tuple[bytes, bool]]:
+        with self._lock:
+            if catalog_version != self._catalog_version:
+                return None
+            response = self._responses.get(key)
+            if response is not None:
+                self._responses.move_to_end(key)
+            return response
+
+    def put(
+        self, catalog_version: int, key: Tuple[str, bool], response: Tuple[bytes, bool]
+    ):
+        with self._lock:
+            if catalog_version != self._catalog_version:
+                self._responses.clear()
+                self._catalog_version = catalog_version
+            self._responses[key] = response
+            if len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+
+class CatalogRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, don't let them wait on delayed acks
+    disable_nagle_algorithm = True
+    server: "CatalogServer"
+
+    def log_message(self, format: str, *args: Any):
+        log.debug(format % args)
+
+    def _send(self, status: int, body: bytes, headers: Dict[str, str]):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        snapshot = self.server.refresher.snapshot
+        if snapshot is None:
+            self._send(503, b'{"error": "catalog not loaded yet"}', {})
+            return
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        cache = self.server.response_cache
+        headers = {
+            "Content-Type": "application/json; charset=utf-8",
+            "Vary": "Accept-Encoding",
+        }
+        response = cache.get(snapshot.version, (self.path, use_gzip))
+        if response is None:
+            try:
+                payload = route_request(snapshot, self.path)
+            except CatalogRequestError as error:
+                error_body = json.dumps({"error": error.message}).encode()
+                error_headers = {"Content-Type": headers["Content-Type"]}
+                self._send(error.status, error_body, error_headers)
+                return
+            body = json.dumps(payload, ensure_ascii=False).encode()
+            gzipped = use_gzip and len(body) >= GZIP_MINIMUM_BYTES
+            if gzipped:
+                body = gzip.compress(body, compresslevel=6)
+            response = (body, gzipped)
+            cache.put(snapshot.version, (self.path, use_gzip), response)
+        body, gzipped = response
+        # the gzip and identity bodies are different representations,
+        # so they get different strong tags
+        etag = (
+            f'"{snapshot.digest[:16]}-{zlib.crc32(self.path.encode()):08x}'
+            f'{"-gz" if gzipped else ""}"'
+        )
+        headers["ETag"] = etag
+        if etag_matches(self.headers.get("If-None-Match", ""), etag):
+            self._send(304, b"", {"ETag": etag, "Vary": "Accept-Encoding"})
+            return
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+        self._send(200, body, headers)
+
+
+class CatalogServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], refresher: CatalogRefresher):
+        super().__init__(address, CatalogRequestHandler)
+        self.refresher = refresher
+        self.response_cache = EncodedResponseCache()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve one in-memory textage catalog over HTTP"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--refresh-hours", type=float, default=6.0)
+    parser.add_argument(
+        "--no-download",
+        action="store_true",
+        help="only use the files already in .textage-metadata",
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=DEFAULT_STARTUP_TIMEOUT_SECONDS,
+        help="seconds to wait for the first catalog before giving up",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    refresher = CatalogRefresher(
+        refresh_seconds=args.refresh_hours * 60 * 60, download=not args.no_download
+    )
+    refresher.start()
+    try:
+        refresher.wait_for_snapshot(args.startup_timeout)
+    except TimeoutError:
+        log.error(
+            f"no catalog after {args.startup_timeout:.0f}s, is textage reachable "
+            "or .textage-metadata populated?"
+        )
+        refresher.stop(timeout=1)
+        sys.exit(1)
+    server = CatalogServer((args.host, args.port), refresher)
+    log.info(f"serving catalog on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        refresher.stop()
+
+
+if __name__ == "__main__":
+    main()
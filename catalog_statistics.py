@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Catalog statistics for the dashboard, computed once per catalog instead
+of once per query:
+
+    statistics = compute_catalog_statistics(songs, digest)
+    statistics = update_catalog_statistics(statistics, old_songs, songs, digest)
+    write_catalog_statistics(textage_metadata_path, statistics)
+    statistics_dashboard(read_catalog_statistics(textage_metadata_path))
+
+Every statistic is a count (or a sum of notes) over charts or songs, in
+small integer arrays (see CatalogStatistics):
+- charts and soflan_charts by (difficulty, level): the level histogram
+  of every difficulty, and its soflan share
+- notes by (level, note count // NOTE_BIN_WIDTH) and notes_total by
+  level: the note count distribution and mean of every level
+- songs by (version, alphanumeric folder)
+
+Counts add up, so when a refresh only changes a few songs, the previous
+statistics are updated by taking out the old versions of those songs
+and adding the new ones, instead of going over the whole catalog again.
+
+CatalogRefresher keeps them in every CatalogSnapshot and writes them
+next to the textage files as catalog-statistics.json, where they are
+read back on start if the textage files haven't changed.
+
+Run as a script, this compares building the dashboard from the
+statistics with walking the SongMetadata dicts, and checks that an
+incremental update over a few changed songs matches recomputing.
+"""
+
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import dataclasses
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Set, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from chart_aggregation import ChartIndex
+from compressed_cache import cache_file_exists, open_cache_file, write_cache_file
+from download_textage_tables import (
+    get_all_song_metadata,
+    get_textage_javascript_digest,
+)
+from local_dataclasses import (
+    BPM_TABLE_COLUMNS,
+    Alphanumeric,
+    CatalogStatistics,
+    Difficulty,
+    DifficultyMetadata,
+    SongMetadata,
+)
+
+log = logging.getLogger(__name__)
+
+STATISTICS_FILE = "catalog-statistics.json"
+NOTE_BIN_WIDTH = 100
+# 0-99 notes up to 3900-3999, and 4000 or more
+NOTE_BINS = 41
+# substream is textage version id -1
+VERSION_OFFSET = 1
+# count field -> (the axis that grows with the catalog, what it's indexed by)
+GROWING_AXES = {
+    "charts": (1, "level"),
+    "soflan_charts": (1, "level"),
+    "notes": (0, "level"),
+    "notes_total": (0, "level"),
+    "songs": (0, "version"),
+}
+# past this share of changed songs, recomputing is as cheap as updating
+FULL_RECOMPUTE_SHARE = 0.25
+
+
+def _count(songs: Mapping[str, SongMetadata]) -> Dict[str, NDArray[np.int64]]:
+    """
+    Every count field over songs, sized to the highest level and
+    version in them.
+    """
+    charts = ChartIndex(songs)
+    difficulties = charts.columns["difficulty"].astype(np.intp)
+    levels = charts.columns["level"].astype(np.intp)
+    level_slots = int(levels.max()) + 1 if len(levels) else 0
+    cells = difficulties * level_slots + levels
+    note_bins = np.minimum(charts.notes // NOTE_BIN_WIDTH, NOTE_BINS - 1)
+    versions = np.fromiter(
+        (song.textage_version_id + VERSION_OFFSET for song in songs.values()),
+        np.intp,
+        len(songs),
+    )
+    folders = np.fromiter(
+        (song.alphanumeric.value for song in songs.values()), np.intp, len(songs)
+    )
+    version_slots = int(versions.max()) + 1 if len(versions) else 0
+    return {
+        "charts": np.bincount(cells, minlength=BPM_TABLE_COLUMNS * level_slots).reshape(
+            BPM_TABLE_COLUMNS, level_slots
+        ),
+        "soflan_charts": np.bincount(
+            cells, weights=charts.soflan, minlength=BPM_TABLE_COLUMNS * level_slots
+        )
+        .astype(np.int64)
+        .reshape(BPM_TABLE_COLUMNS, level_slots),
+        "notes": np.bincount(
+            levels * NOTE_BINS + note_bins, minlength=level_slots * NOTE_BINS
+        ).reshape(level_slots, NOTE_BINS),
+        "notes_total": np.bincount(
+            levels, weights=charts.notes, minlength=level_slots
+        ).astype(np.int64),
+        "songs": np.bincount(
+            versions * len(Alphanumeric) + folders,
+            minlength=version_slots * len(Alphanumeric),
+        ).reshape(version_slots, len(Alphanumeric)),
+    }
+
+
+def _resize(counts: NDArray[np.int64], axis: int, size: int) -> NDArray[np.int64]:
+    if counts.shape[axis] >= size:
+        return np.take(counts, np.arange(size), axis=axis)
+    padding = [(0, 0)] * counts.ndim
+    padding[axis] = (0, size - counts.shape[axis])
+    return np.pad(counts, padding)
+
+
+def _used_slots(counts: NDArray[np.int64]) -> int:
+    used = np.flatnonzero(counts)
+    return int(used[-1]) + 1 if len(used) else 0
+
+
+def _combine(
+    *signed_counts: Tuple[int, Dict[str, NDArray[np.int64]]]
+) -> Dict[str, NDArray[np.int64]]:
+    """
+    The sum of (sign, counts) pairs, trimmed to the highest level and
+    version that still has a chart or song, so the result is the same
+    shape as counting from scratch.
+    """
+    combined = {}
+    for field, (axis, _) in GROWING_AXES.items():
+        size = max(counts[field].shape[axis] for _, counts in signed_counts)
+        combined[field] = np.sum(
+            [
+                sign * _resize(counts[field], axis, size)
+                for sign, counts in signed_counts
+            ],
+            axis=0,
+        )
+    slots = {
+        "level": _used_slots(combined["notes"].sum(axis=1)),
+        "version": _used_slots(combined["songs"].sum(axis=1)),
+    }
+    return {
+        field: _resize(combined[field], axis, slots[indexed_by])
+        for field, (axis, indexed_by) in GROWING_AXES.items()
+    }
+
+
+def _is_current(statistics: CatalogStatistics) -> bool:
+    return (
+        statistics.note_bin_width == NOTE_BIN_WIDTH
+        and statistics.notes.shape[1] == NOTE_BINS
+    )
+
+
+def compute_catalog_statistics(
+    songs: Mapping[str, SongMetadata], digest: str
+) -> CatalogStatistics:
+    return CatalogStatistics(
+        digest=digest, note_bin_width=NOTE_BIN_WIDTH, **_combine((1, _count(songs)))
+    )
+
+
+def diff_catalogs(
+    old_songs: Mapping[str, SongMetadata], new_songs: Mapping[str, SongMetadata]
+) -> Tuple[Dict[str, SongMetadata], Dict[str, SongMetadata]]:
+    """
+    The songs to take out of statistics over old_songs (removed or
+    changed) and to put in (added or changed) to get the statistics over
+    new_songs.
+    """
+    changed: Set[str] = {
+        textage_id
+        for textage_id, song in new_songs.items()
+        if old_songs.get(textage_id) != song
+    }
+    removed = {
+        textage_id: old_songs[textage_id]
+        for textage_id in (old_songs.keys() - new_songs.keys())
+        | (changed & old_songs.keys())
+    }
+    added = {textage_id: new_songs[textage_id] for textage_id in changed}
+    return removed, added
+
+
+def update_catalog_statistics(
+    statistics: CatalogStatistics,
+    old_songs: Mapping[str, SongMetadata],
+    new_songs: Mapping[str, SongMetadata],
+    digest: str,
+) -> CatalogStatistics:
+    """
+    statistics (over old_songs) updated to new_songs from the songs that
+    changed between them, or recomputed when too many did.
+    """
+    removed, added = diff_catalogs(old_songs, new_songs)
+    if not _is_current(statistics) or len(removed) + len(added) > (
+        FULL_RECOMPUTE_SHARE * len(new_songs)
+    ):
+        return compute_catalog_statistics(new_songs, digest)
+    log.info(
+        f"updating catalog statistics for {len(removed)} old and {len(added)} new songs"
+    )
+    counts = {field: getattr(statistics, field) for field in GROWING_AXES}
+    return CatalogStatistics(
+        digest=digest,
+        note_bin_width=NOTE_BIN_WIDTH,
+        **_combine((1, counts), (-1, _count(removed)), (1, _count(added))),
+    )
+
+
+def _get_statistics_file(textage_metadata_path: Path) -> Path:
+    return textage_metadata_path / Path(STATISTICS_FILE)
+
+
+def write_catalog_statistics(
+    textage_metadata_path: Path, statistics: CatalogStatistics
+):
+    counts = {field: getattr(statistics, field) for field in GROWING_AXES}
+    with write_cache_file(_get_statistics_file(textage_metadata_path)) as writer:
+        json.dump(
+            {
+                "digest": statistics.digest,
+                "note_bin_width": statistics.note_bin_width,
+                "shapes": {field: list(array.shape) for field, array in counts.items()},
+                **{field: array.tolist() for field, array in counts.items()},
+            },
+            writer,
+            separators=(",", ":"),
+        )
+
+
+def read_catalog_statistics(textage_metadata_path: Path) -> Optional[CatalogStatistics]:
+    """
+    The statistics last written to textage_metadata_path, or None if
+    there are none.
+    """
+    statistics_file = _get_statistics_file(textage_metadata_path)
+    if not cache_file_exists(statistics_file):
+        return None
+    with open_cache_file(statistics_file) as reader:
+        stored = json.load(reader)
+    return CatalogStatistics(
+        digest=stored["digest"],
+        note_bin_width=stored["note_bin_width"],
+        **{
+            field: np.array(stored[field], np.int64).reshape(stored["shapes"][field])
+            for field in GROWING_AXES
+        },
+    )
+
+
+def refresh_catalog_statistics(
+    textage_metadata_path: Path,
+    songs: Mapping[str, SongMetadata],
+    digest: str,
+    previous_statistics: Optional[CatalogStatistics] = None,
+    previous_songs: Optional[Mapping[str, SongMetadata]] = None,
+) -> CatalogStatistics:
+    """
+    Statistics for a newly built catalog: updated from the previous
+    catalog's when there is one, read back if they were already written
+    for these textage files, computed otherwise. New statistics are
+    written to textage_metadata_path.
+    """
+    if previous_statistics is not None and previous_songs is not None:
+        statistics = update_catalog_statistics(
+            previous_statistics, previous_songs, songs, digest
+        )
+    else:
+        stored = read_catalog_statistics(textage_metadata_path)
+        if stored is not None and stored.digest == digest and _is_current(stored):
+            return stored
+        statistics = compute_catalog_statistics(songs, digest)
+    write_catalog_statistics(textage_metadata_path, statistics)
+    return statistics
+
+
+def _share(part: int, whole: int) -> float:
+    return part / whole if whole else 0.0
+
+
+def statistics_dashboard(statistics: CatalogStatistics) -> Dict[str, Any]:
+    """
+    The statistics as the dashboard shows them, only listing levels,
+    versions and folders that have charts or songs.
+    """
+    difficulties = [
+        difficulty
+        for difficulty in Difficulty
+        if difficulty.value < BPM_TABLE_COLUMNS
+        and statistics.charts[difficulty.value].any()
+    ]
+    notes_by_level = {}
+    for level, note_bins in enumerate(statistics.notes.tolist()):
+        charts = sum(note_bins)
+        if charts == 0:
+            continue
+        notes_by_level[level] = {
+            "charts": charts,
+            "mean_notes": _share(int(statistics.notes_total[level]), charts),
+            "histogram": {
+                note_bin * statistics.note_bin_width: count
+                for note_bin, count in enumerate(note_bins)
+                if count
+            },
+        }
+    return {
+        "digest": statistics.digest,
+        "level_histograms": {
+            difficulty.name: {
+                level: count
+                for level, count in enumerate(
+                    statistics.charts[difficulty.value].tolist()
+                )
+                if count
+            }
+            for difficulty in difficulties
+        },
+        "soflan_share": {
+            difficulty.name: {
+                level: _share(soflan, charts)
+                for level, (charts, soflan) in enumerate(
+                    zip(
+                        statistics.charts[difficulty.value].tolist(),
+                        statistics.soflan_charts[difficulty.value].tolist(),
+                    )
+                )
+                if charts
+            }
+            for difficulty in difficulties
+        },
+        "notes_by_level": notes_by_level,
+        "songs_by_version": {
+            row
+            - VERSION_OFFSET: {
+                Alphanumeric(folder).name: count
+                for folder, count in enumerate(folder_counts)
+                if count
+            }
+            for row, folder_counts in enumerate(statistics.songs.tolist())
+            if any(folder_counts)
+        },
+    }
+
+
+def _dashboard_by_walking(
+    songs: Mapping[str, SongMetadata], digest: str
+) -> Dict[str, Any]:
+    """
+    The dashboard the way it was built before, walking every song and
+    chart per query, for comparison.
+    """
+    histograms: Dict[str, Dict[int, int]] = {}
+    soflan: Dict[str, Dict[int, int]] = {}
+    notes_by_level: Dict[int, Dict[str, Any]] = {}
+    songs_by_version: Dict[int, Dict[str, int]] = {}
+    for song in songs.values():
+        folders = songs_by_version.setdefault(song.textage_version_id, {})
+        folders[song.alphanumeric.name] = folders.get(song.alphanumeric.name, 0) + 1
+        for difficulty, metadata in song.difficulty_metadata.items():
+            if metadata.level == 0 or metadata.notes == 0:
+                continue
+            levels = histograms.setdefault(difficulty.name, {})
+            levels[metadata.level] = levels.get(metadata.level, 0) + 1
+            soflan_levels = soflan.setdefault(difficulty.name, {})
+            soflan_levels[metadata.level] = (
+                soflan_levels.get(metadata.level, 0) + metadata.soflan
+            )
+            level = notes_by_level.setdefault(
+                metadata.level, {"charts": 0, "notes": 0, "histogram": {}}
+            )
+            level["charts"] += 1
+            level["notes"] += metadata.notes
+            note_bin = min(metadata.notes // NOTE_BIN_WIDTH, NOTE_BINS - 1)
+            start = note_bin * NOTE_BIN_WIDTH
+            level["histogram"][start] = level["histogram"].get(start, 0) + 1
+    for level in notes_by_level.values():
+        level["mean_notes"] = _share(level.pop("notes"), level["charts"])
+    return {
+        "digest": digest,
+        "level_histograms": histograms,
+        "soflan_share": {
+            difficulty: {
+                level: _share(soflan[difficulty][level], charts)
+                for level, charts in levels.items()
+            }
+            for difficulty, levels in histograms.items()
+        },
+        "notes_by_level": notes_by_level,
+        "songs_by_version": songs_by_version,
+    }
+
+
+def _changed_catalog(
+    songs: Mapping[str, SongMetadata], changes: int
+) -> Dict[str, SongMetadata]:
+    """
+    songs with a few charts releveled and soflan flipped, one song
+    removed and one added in a new version, like a textage update.
+    """
+    random.seed(0)
+    changed = dict(songs)
+    textage_ids = random.sample(sorted(songs), changes + 1)
+    del changed[textage_ids[0]]
+    for textage_id in textage_ids[1:]:
+        song = songs[textage_id]
+        changed[textage_id] = dataclasses.replace(
+            song,
+            difficulty_metadata={
+                difficulty: dataclasses.replace(
+                    metadata,
+                    level=metadata.level % 12 + 1 if metadata.level else 0,
+                    soflan=not metadata.soflan,
+                )
+                for difficulty, metadata in song.difficulty_metadata.items()
+            },
+        )
+    new_version = max(song.textage_version_id for song in songs.values()) + 1
+    changed["_new_song"] = SongMetadata(
+        textage_id="_new_song",
+        title="new song",
+        artist="artist",
+        genre="genre",
+        textage_version_id=new_version,
+        alphanumeric=Alphanumeric.MNOP,
+        difficulty_metadata={
+            Difficulty.SP_ANOTHER: DifficultyMetadata(12, 4500, 150, 300, True)
+        },
+    )
+    return changed
+
+
+def _check_equal(found: CatalogStatistics, expected: CatalogStatistics, label: str):
+    for field in GROWING_AXES:
+        if not np.array_equal(getattr(found, field), getattr(expected, field)):
+            raise RuntimeError(f"{label}: {field} differs from recomputing")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--changes", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    songs = get_all_song_metadata(download=False)
+    digest = get_textage_javascript_digest()
+
+    def timed(function):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            result = function()
+        return result, (time.perf_counter() - started) / args.repeat
+
+    by_walking, walking_seconds = timed(lambda: _dashboard_by_walking(songs, digest))
+    statistics, compute_seconds = timed(
+        lambda: compute_catalog_statistics(songs, digest)
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        write_catalog_statistics(Path(directory), statistics)
+        dashboard, read_seconds = timed(
+            lambda: statistics_dashboard(read_catalog_statistics(Path(directory)))
+        )
+    if json.loads(json.dumps(dashboard)) != json.loads(json.dumps(by_walking)):
+        raise RuntimeError("the statistics and walking the catalog disagree")
+
+    changed = _changed_catalog(songs, args.changes)
+    updated, update_seconds = timed(
+        lambda: update_catalog_statistics(statistics, songs, changed, "changed")
+    )
+    _check_equal(updated, compute_catalog_statistics(changed, "changed"), "update")
+    _check_equal(
+        update_catalog_statistics(updated, changed, songs, digest),
+        statistics,
+        "update back",
+    )
+
+    print(f"{len(songs)} songs, {args.changes} changed")
+    for label, seconds in (
+        ("walk the catalog", walking_seconds),
+        ("compute statistics", compute_seconds),
+        ("update statistics", update_seconds),
+        ("read file + dashboard", read_seconds),
+    ):
+        print(f"  {label:24s} {seconds * 1000:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Clear lamp and EX score tables over the score log, joined to the
+catalog by a dense chart index instead of a SongMetadata lookup per play:
+
+    charts = ChartIndex(songs)
+    aggregator = ScoreAggregator(charts)
+    aggregator.add(score_log.scan())
+    aggregator.group_by("difficulty", "level").to_dicts()
+    ...
+    aggregator.add(encode_scores([new_play]))   # only touches one chart
+
+ChartIndex numbers every chart (a song and difficulty with a level and
+notes) and keeps its difficulty, level, notes, soflan, version and
+alphanumeric folder in parallel arrays. ScoreAggregator keeps the best
+lamp and best EX score of every chart, and group_by() counts them over
+any of those columns. Everything after the join is array operations over
+charts, so a table can be recomputed after every new score.
+
+Lamps are ordered by ClearType value (FAILED < ASSIST < ... <
+FULL_COMBO). UNKNOWN clear types still count for EX score but never
+set a lamp. The DJ level of a chart comes from its best EX score out of
+2 * notes, in ninths, like the game.
+
+Run as a script, this aggregates random plays over the cached catalog
+and compares it with looping over the plays.
+"""
+
+import time
+import random
+import logging
+import argparse
+from typing import Dict, List, Mapping, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from download_textage_tables import get_all_song_metadata
+from score_log import GRADES, SCORE_DTYPE, TEXTAGE_ID_BYTES, encode_scores
+from local_dataclasses import (
+    BPM_TABLE_COLUMNS,
+    ClearType,
+    Difficulty,
+    LampTable,
+    Score,
+    SongMetadata,
+)
+
+log = logging.getLogger(__name__)
+
+# ClearType values that are lamps, in order; UNKNOWN isn't one
+LAMPS = tuple(clear_type for clear_type in ClearType if clear_type.value < 99)
+LAMP_COLUMNS = ("NO_PLAY", *[lamp.name for lamp in LAMPS])
+NO_PLAY = -1
+GROUP_COLUMNS = ("difficulty", "level", "version", "alphanumeric")
+
+
+class ChartIndex:
+    """
+    Chart i is the song textage_ids[song_rows[i]] at Difficulty value
+    difficulty[i]. Songs are sorted by textage id, so a score's textage
+    id is found with one searchsorted.
+    """
+
+    def __init__(self, songs: Mapping[str, SongMetadata]):
+        textage_ids = sorted(songs)
+        self.textage_ids: NDArray = np.array(
+            [textage_id.encode("ascii") for textage_id in textage_ids],
+            f"S{TEXTAGE_ID_BYTES}",
+        )
+        song_rows: List[int] = []
+        columns: Dict[str, List[int]] = {column: [] for column in GROUP_COLUMNS}
+        notes: List[int] = []
+        soflan: List[bool] = []
+        for song_row, textage_id in enumerate(textage_ids):
+            song = songs[textage_id]
+            for difficulty, metadata in sorted(
+                song.difficulty_metadata.items(), key=lambda item: item[0].value
+            ):
+                if metadata.level == 0 or metadata.notes == 0:
+                    continue
+                song_rows.append(song_row)
+                columns["difficulty"].append(difficulty.value)
+                columns["level"].append(metadata.level)
+                columns["version"].append(song.textage_version_id)
+                columns["alphanumeric"].append(song.alphanumeric.value)
+                notes.append(metadata.notes)
+                soflan.append(metadata.soflan)
+        self.song_rows: NDArray[np.int32] = np.array(song_rows, np.int32)
+        self.columns: Dict[str, NDArray[np.int16]] = {
+            column: np.array(values, np.int16) for column, values in columns.items()
+        }
+        self.notes: NDArray[np.int32] = np.array(notes, np.int32)
+        self.soflan: NDArray[np.bool_] = np.array(soflan, np.bool_)
+        # chart number of every (song row, difficulty) cell, laid out like
+        # BpmTable, NO_PLAY where the song doesn't have that chart
+        self.chart_by_cell: NDArray[np.int32] = np.full(
+            len(textage_ids) * BPM_TABLE_COLUMNS, NO_PLAY, np.int32
+        )
+        self.chart_by_cell[
+            self.song_rows * BPM_TABLE_COLUMNS + self.columns["difficulty"]
+        ] = np.arange(len(song_rows), dtype=np.int32)
+
+        # by -> (keys, group of every chart), only depends on the catalog
+        self._groups: Dict[Tuple[str, ...], Tuple[NDArray, NDArray[np.intp]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.song_rows)
+
+    def groups(self, by: Tuple[str, ...]) -> Tuple[NDArray, NDArray[np.intp]]:
+        """
+        The distinct (by) keys, and which of them each chart is in.
+        """
+        if not by:
+            raise ValueError("grouping needs at least one column")
+        for column in by:
+            if column not in GROUP_COLUMNS:
+                raise ValueError(f"can't group by {column}, only {GROUP_COLUMNS}")
+        if by not in self._groups:
+            chart_keys = np.stack([self.columns[column] for column in by], axis=1)
+            keys, groups = np.unique(chart_keys, axis=0, return_inverse=True)
+            self._groups[by] = (keys, groups.reshape(-1))
+        return self._groups[by]
+
+    def chart(self, chart: int) -> Tuple[str, Difficulty]:
+        return (
+            self.textage_ids[self.song_rows[chart]].decode("ascii"),
+            Difficulty(int(self.columns["difficulty"][chart])),
+        )
+
+    def join(self, records: NDArray) -> NDArray[np.int32]:
+        """
+        The chart number of every SCORE_DTYPE record, NO_PLAY for
+        records whose chart isn't in the catalog.
+        """
+        if len(self.textage_ids) == 0:
+            return np.full(len(records), NO_PLAY, np.int32)
+        song_rows = np.searchsorted(self.textage_ids, records["textage_id"])
+        song_rows = np.minimum(song_rows, len(self.textage_ids) - 1)
+        found = self.textage_ids[song_rows] == records["textage_id"]
+        difficulties = records["difficulty"].astype(np.intp)
+        found &= (difficulties >= 0) & (difficulties < BPM_TABLE_COLUMNS)
+        cells = song_rows * BPM_TABLE_COLUMNS + np.where(found, difficulties, 0)
+        return np.where(found, self.chart_by_cell[cells], NO_PLAY).astype(np.int32)
+
+
+def dj_levels(ex_scores: NDArray, notes: NDArray) -> NDArray[np.uint8]:
+    """
+    Index into GRADES of each EX score: F under 2/9 of the max EX
+    score, then a grade per ninth up to AAA at 8/9. NO_PLAY scores are X.
+    """
+    ninths = (ex_scores.astype(np.int64) * 9) // np.maximum(2 * notes, 1)
+    grades = np.clip(ninths, 1, len(GRADES) - 1)
+    return np.where(ex_scores == NO_PLAY, 0, grades).astype(np.uint8)
+
+
+class ScoreAggregator:
+    """
+    The best lamp and EX score of every chart in a ChartIndex, NO_PLAY
+    for charts that haven't been played. add() can be called with any
+    number of records, as often as scores come in.
+    """
+
+    def __init__(self, charts: ChartIndex):
+        self.charts = charts
+        self.best_lamp: NDArray[np.int16] = np.full(len(charts), NO_PLAY, np.int16)
+        self.best_ex_score: NDArray[np.int32] = np.full(len(charts), NO_PLAY, np.int32)
+        self.unmatched = 0
+
+    def add(self, records: NDArray):
+        if records.dtype != SCORE_DTYPE:
+            raise TypeError(f"expected SCORE_DTYPE records, got {records.dtype}")
+        chart_numbers = self.charts.join(records)
+        matched = chart_numbers != NO_PLAY
+        self.unmatched += int(np.count_nonzero(~matched))
+        chart_numbers = chart_numbers[matched]
+        records = records[matched]
+        ex_scores = 2 * records["fgreat"].astype(np.int32) + records["great"]
+        np.maximum.at(self.best_ex_score, chart_numbers, ex_scores)
+        lamps = records["clear_type"].astype(np.int16)
+        is_lamp = lamps <= LAMPS[-1].value
+        np.maximum.at(self.best_lamp, chart_numbers[is_lamp], lamps[is_lamp])
+
+    def best_ex_ratio(self) -> NDArray[np.float64]:
+        """
+        Best EX score over the max EX score of every chart, NaN for
+        unplayed charts.
+        """
+        ratios = self.best_ex_score / (2.0 * self.charts.notes)
+        return np.where(self.best_ex_score == NO_PLAY, np.nan, ratios)
+
+    def group_by(self, *by: str) -> LampTable:
+        """
+        Lamp and grade counts and EX score totals for every combination
+        of the given GROUP_COLUMNS that has at least one chart.
+        """
+        keys, groups = self.charts.groups(by)
+        group_count = len(keys)
+        played = self.best_ex_score != NO_PLAY
+        lamp_counts = np.bincount(
+            groups * len(LAMP_COLUMNS) + (self.best_lamp + 1),
+            minlength=group_count * len(LAMP_COLUMNS),
+        ).reshape(group_count, len(LAMP_COLUMNS))
+        grade_counts = np.bincount(
+            groups * len(GRADES) + dj_levels(self.best_ex_score, self.charts.notes),
+            minlength=group_count * len(GRADES),
+        ).reshape(group_count, len(GRADES))
+        return LampTable(
+            by=by,
+            keys=keys,
+            lamp_columns=LAMP_COLUMNS,
+            grades=GRADES,
+            charts=np.bincount(groups, minlength=group_count),
+            lamp_counts=lamp_counts,
+            grade_counts=grade_counts,
+            ex_score=np.bincount(
+                groups,
+                weights=np.where(played, self.best_ex_score, 0),
+                minlength=group_count,
+            ).astype(np.int64),
+            max_ex_score=np.bincount(
+                groups, weights=2 * self.charts.notes, minlength=group_count
+            ).astype(np.int64),
+        )
+
+
+def _lamp_table_by_loop(
+    songs: Mapping[str, SongMetadata], plays: List[Tuple[str, Difficulty, Score]]
+) -> Dict[Tuple[int, int], Dict[str, int]]:
+    """
+    The lamp counts by (difficulty, level) the way they were done
+    before: a catalog lookup per play, then a count per chart.
+    """
+    best: Dict[Tuple[str, Difficulty], int] = {}
+    for textage_id, difficulty, score in plays:
+        song = songs.get(textage_id)
+        if song is None or difficulty not in song.difficulty_metadata:
+            continue
+        lamp = ClearType[score.clear_type].value
+        if lamp > LAMPS[-1].value:
+            continue
+        best[(textage_id, difficulty)] = max(
+            best.get((textage_id, difficulty), NO_PLAY), lamp
+        )
+    table: Dict[Tuple[int, int], Dict[str, int]] = {}
+    for textage_id, song in songs.items():
+        for difficulty, metadata in song.difficulty_metadata.items():
+            if metadata.level == 0 or metadata.notes == 0:
+                continue
+            counts = table.setdefault(
+                (difficulty.value, metadata.level),
+                {lamp: 0 for lamp in LAMP_COLUMNS},
+            )
+            counts[LAMP_COLUMNS[best.get((textage_id, difficulty), NO_PLAY) + 1]] += 1
+    return table
+
+
+def _random_plays(
+    songs: Mapping[str, SongMetadata], plays: int
+) -> List[Tuple[str, Difficulty, Score]]:
+    random.seed(0)
+    charts = [
+        (textage_id, difficulty, metadata.notes)
+        for textage_id, song in songs.items()
+        for difficulty, metadata in song.difficulty_metadata.items()
+        if metadata.level and metadata.notes
+    ]
+    random_plays = []
+    for _ in range(plays):
+        textage_id, difficulty, notes = random.choice(charts)
+        fgreat = random.randrange(notes // 2, notes + 1)
+        great = random.randrange(0, notes - fgreat + 1)
+        score = Score(
+            fgreat,
+            great,
+            notes - fgreat - great,
+            clear_type=random.choice(LAMPS + (ClearType.UNKNOWN,)).name,
+        )
+        random_plays.append((textage_id, difficulty, score))
+    return random_plays
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--plays", type=int, default=200000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    songs = get_all_song_metadata(download=False)
+    plays = _random_plays(songs, args.plays)
+    records = encode_scores(
+        [
+            (textage_id, difficulty, score, 0.0)
+            for textage_id, difficulty, score in plays
+        ]
+    )
+
+    started = time.perf_counter()
+    by_loop = _lamp_table_by_loop(songs, plays)
+    loop_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    charts = ChartIndex(songs)
+    index_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    aggregator = ScoreAggregator(charts)
+    aggregator.add(records)
+    table = aggregator.group_by("difficulty", "level")
+    aggregate_seconds = time.perf_counter() - started
+
+    by_array = {
+        (row["difficulty"], row["level"]): row["lamps"] for row in table.to_dicts()
+    }
+    if by_loop != by_array:
+        raise RuntimeError("the aggregator and the loop disagree")
+
+    started = time.perf_counter()
+    for play in range(100):
+        aggregator.add(records[play : play + 1])
+        aggregator.group_by("difficulty", "level")
+        aggregator.group_by("version", "alphanumeric")
+    per_score_seconds = (time.perf_counter() - started) / 100
+
+    print(f"{args.plays} plays over {len(charts)} charts, lamps by (difficulty, level)")
+    for label, seconds in (
+        ("loop over plays", loop_seconds),
+        ("ChartIndex (per catalog)", index_seconds),
+        ("add + group_by", aggregate_seconds),
+        ("one new score, 2 tables", per_score_seconds),
+    ):
+        print(f"  {label:26s} {seconds * 1000:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
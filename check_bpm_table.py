@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Checks the compiled BPM table against textage's own get_bpm function by
+running datatbl.js in node and calling get_bpm(tag, type) for every song
+and difficulty. Exits 1 if any cell disagrees.
+
+    python3 check_bpm_table.py
+"""
+
+import sys
+import json
+import shutil
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+from local_dataclasses import Difficulty
+from compressed_cache import open_cache_file
+from download_textage_tables import (
+    _get_textage_metadata_path,
+    _read_bpm_string,
+    get_bpm_table,
+)
+
+log = logging.getLogger(__name__)
+
+# datatbl.js only defines datatbl and get_bpm, so it can be evaluated as is.
+# it's passed on stdin, since the cached copy may be compressed
+GET_BPM_HARNESS = """
+const fs = require("fs");
+eval(fs.readFileSync(0, "utf8"));
+const types = JSON.parse(process.argv[1]);
+const bpms = {};
+for (const tag in datatbl) {
+    bpms[tag] = types.map((type) => String(get_bpm(tag, type)));
+}
+process.stdout.write(JSON.stringify(bpms));
+"""
+
+
+def read_javascript_bpms(
+    data_table_file: Path, difficulties: List[Difficulty]
+) -> Dict[str, List[str]]:
+    node = shutil.which("node")
+    if node is None:
+        raise RuntimeError("node is needed to run textage's get_bpm")
+    types = json.dumps([difficulty.value for difficulty in difficulties])
+    with open_cache_file(data_table_file) as reader:
+        data_table = reader.read()
+    result = subprocess.run(
+        [node, "-e", GET_BPM_HARNESS, types],
+        input=data_table,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(result.stdout)
+
+
+def check_bpm_table(download: bool = False) -> List[str]:
+    difficulties: List[Difficulty] = [
+        difficulty for difficulty in Difficulty if difficulty != Difficulty.UNKNOWN
+    ]
+    bpm_table = get_bpm_table(download)
+    javascript_bpms = read_javascript_bpms(
+        _get_textage_metadata_path() / Path("datatbl.js"), difficulties
+    )
+    mismatches = []
+    if set(javascript_bpms) != set(bpm_table.row_by_textage_id):
+        mismatches.append("the compiled table and datatbl have different songs")
+    for textage_id, bpms in sorted(javascript_bpms.items()):
+        if textage_id not in bpm_table.row_by_textage_id:
+            continue
+        for difficulty, bpm in zip(difficulties, bpms):
+            expected = _read_bpm_string(bpm)
+            compiled = bpm_table.lookup(textage_id, difficulty)
+            if compiled != expected:
+                mismatches.append(
+                    f"{textage_id} {difficulty.name}: get_bpm {expected}, "
+                    f"table {compiled}"
+                )
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--download", action="store_true", help="fetch datatbl.js first"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    mismatches = check_bpm_table(args.download)
+    for mismatch in mismatches:
+        print(mismatch)
+    if mismatches:
+        sys.exit(1)
+    print("compiled BPM table matches get_bpm")
+
+
+if __name__ == "__main__":
+    main()
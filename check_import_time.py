@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Fails (exits 1) if the offline entry points got slower to import, or
+import requests, urllib3 or numpy. Each module is imported in a fresh
+interpreter under -X importtime, and its cumulative import time (best
+of --repeats) is compared with the time it takes to import requests and
+numpy in the same run. Milliseconds depend on the machine and how busy
+it is, the ratio much less so, and a module fails if it takes more than
+--max-ratio of the baseline.
+
+With --load it also loads the cached catalog through offline_catalog
+and checks that still didn't import them, so .textage-metadata needs to
+have been downloaded already.
+
+    python3 check_import_time.py
+    python3 check_import_time.py --load --max-ratio 0.6
+"""
+
+import os
+import sys
+import logging
+import importlib.util
+import argparse
+import subprocess
+from typing import Dict, List, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+OFFLINE_MODULES = ["offline_catalog", "lazy_catalog", "download_textage_tables"]
+FORBIDDEN_MODULES = ["requests", "urllib3", "numpy"]
+# what the offline modules avoid importing, timed in the same run as them
+# (urllib3 comes with requests)
+BASELINE_MODULES = ["requests", "numpy"]
+# the offline modules take ~0.4 of the baseline, importing requests or
+# numpy along the way would put them over 1
+DEFAULT_MAX_RATIO = 0.5
+DEFAULT_REPEATS = 5
+OFFLINE_LOAD = (
+    "import sys, offline_catalog\n"
+    "offline_catalog.load_offline_song_metadata()\n"
+    "offline_catalog.load_offline_lazy_song_metadata()\n"
+    "print(' '.join(sys.modules))\n"
+)
+
+
+def _run_python(arguments: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *arguments],
+        cwd=os.path.dirname(os.path.realpath(__file__)),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+
+def read_import_times(module: str) -> Tuple[float, Dict[str, float]]:
+    """
+    (cumulative ms for module, {imported module: self ms}) from one
+    -X importtime run.
+    """
+    stderr = _run_python(["-X", "importtime", "-c", f"import {module}"]).stderr
+    self_ms: Dict[str, float] = {}
+    cumulative_ms = 0.0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # the header line
+            continue
+        self_ms[name.strip()] = int(self_us) / 1000
+        if name.strip() == module:
+            cumulative_ms = int(cumulative_us) / 1000
+    return cumulative_ms, self_ms
+
+
+def _forbidden(imported: Set[str]) -> List[str]:
+    return sorted(
+        {name.split(".", 1)[0] for name in imported}.intersection(FORBIDDEN_MODULES)
+    )
+
+
+def _best_import_time(module: str, repeats: int) -> Tuple[float, Dict[str, float]]:
+    runs = [read_import_times(module) for _ in range(repeats)]
+    return min(runs, key=lambda run: run[0])
+
+
+def read_baseline_ms(repeats: int) -> float:
+    """
+    How long importing the installed BASELINE_MODULES takes on this
+    machine right now, each in its own interpreter.
+    """
+    return sum(
+        _best_import_time(module, repeats)[0]
+        for module in BASELINE_MODULES
+        if importlib.util.find_spec(module) is not None
+    )
+
+
+def check_import_time(
+    modules: List[str],
+    repeats: int,
+    load: bool = False,
+    max_ratio: Optional[float] = DEFAULT_MAX_RATIO,
+) -> List[str]:
+    failures = []
+    baseline_ms = read_baseline_ms(repeats)
+    print(f"baseline, importing {' and '.join(BASELINE_MODULES)}: {baseline_ms:.1f}ms")
+    for module in modules:
+        best_ms, self_ms = _best_import_time(module, repeats)
+        ratio = best_ms / baseline_ms if baseline_ms else 0.0
+        print(f"{module}: {best_ms:.1f}ms ({ratio:.2f} of the baseline)")
+        forbidden = _forbidden(set(self_ms))
+        if forbidden:
+            failures.append(f"importing {module} imports {forbidden}")
+        if max_ratio is not None and baseline_ms and ratio > max_ratio:
+            slowest = sorted(self_ms.items(), key=lambda item: -item[1])[:10]
+            failures.append(
+                f"importing {module} took {ratio:.2f} of the baseline, over "
+                f"{max_ratio:.2f}. "
+                f"slowest: {', '.join(f'{name} {ms:.1f}ms' for name, ms in slowest)}"
+            )
+    if load:
+        loaded = set(_run_python(["-c", OFFLINE_LOAD]).stdout.split())
+        forbidden = _forbidden(loaded)
+        if forbidden:
+            failures.append(f"loading the offline catalog imports {forbidden}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("modules", nargs="*", default=OFFLINE_MODULES)
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=DEFAULT_MAX_RATIO,
+        help="fail modules slower than this share of the baseline",
+    )
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument(
+        "--load", action="store_true", help="also load the cached catalog"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    failures = check_import_time(args.modules, args.repeats, args.load, args.max_ratio)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+    print("import times are within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Compressed files in .textage-metadata. Callers use the uncompressed
+name (actbl.js, parsed_actbl.js.json) and the file on disk gets a .gz or
+.xz suffix, depending on TEXTAGE_CACHE_COMPRESSION (gzip, lzma or
+none, gzip by default). Reads decompress while streaming, whichever way
+the file was stored.
+
+Run as a script, this prints the size and read time of each cached file
+at each compression level:
+
+    python3 compressed_cache.py --report
+"""
+
+import os
+import gzip
+import lzma
+import time
+import logging
+import argparse
+from pathlib import Path
+from contextlib import contextmanager
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple, cast
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_COMPRESSION = "gzip"
+CACHE_COMPRESSION_SUFFIXES = {"gzip": ".gz", "lzma": ".xz", "none": ""}
+CACHE_COMPRESSION_LEVELS = {"gzip": 6, "lzma": 6, "none": 0}
+CACHE_COMPRESSION_MARKER = ".compression"
+# everything else in .textage-metadata (.last_modified, history/) is left as is
+CACHED_FILE_SUFFIXES = (".js", ".json")
+
+
+def get_cache_compression() -> str:
+    compression = os.environ.get("TEXTAGE_CACHE_COMPRESSION", DEFAULT_CACHE_COMPRESSION)
+    if compression not in CACHE_COMPRESSION_SUFFIXES:
+        raise RuntimeError(
+            f"TEXTAGE_CACHE_COMPRESSION must be one of "
+            f"{list(CACHE_COMPRESSION_SUFFIXES)}, not {compression}"
+        )
+    return compression
+
+
+def _open_compressed(
+    path: Path, mode: str, compression: str, level: Optional[int] = None
+) -> IO[Any]:
+    encoding = None if "b" in mode else "utf-8"
+    writing = "w" in mode
+    if level is None:
+        level = CACHE_COMPRESSION_LEVELS[compression]
+    if compression == "gzip":
+        # GzipFile isn't an IO[bytes] to typeshed, though it is one
+        if writing:
+            return cast(
+                IO[Any], gzip.open(path, mode, compresslevel=level, encoding=encoding)
+            )
+        return cast(IO[Any], gzip.open(path, mode, encoding=encoding))
+    if compression == "lzma":
+        if writing:
+            return lzma.open(path, mode, preset=level, encoding=encoding)
+        return lzma.open(path, mode, encoding=encoding)
+    return open(path, mode, encoding=encoding)
+
+
+def _cache_file_variants(path: Path) -> List[Tuple[str, Path]]:
+    """
+    Every name path could be stored under, the configured one first.
+    """
+    preferred = get_cache_compression()
+    compressions = [preferred] + [
+        compression
+        for compression in CACHE_COMPRESSION_SUFFIXES
+        if compression != preferred
+    ]
+    return [
+        (compression, Path(f"{path}{CACHE_COMPRESSION_SUFFIXES[compression]}"))
+        for compression in compressions
+    ]
+
+
+def find_cache_file(path: Path) -> Optional[Tuple[str, Path]]:
+    for compression, stored_path in _cache_file_variants(path):
+        if os.path.exists(stored_path):
+            return compression, stored_path
+    return None
+
+
+def cache_file_exists(path: Path) -> bool:
+    return find_cache_file(path) is not None
+
+
+def _get_stored_path(path: Path) -> Path:
+    stored = find_cache_file(path)
+    if stored is None:
+        raise FileNotFoundError(f"{path} is not cached")
+    return stored[1]
+
+
+def get_cache_file_mtime(path: Path) -> float:
+    return os.path.getmtime(_get_stored_path(path))
+
+
+def get_cache_file_size(path: Path) -> int:
+    """
+    Size on disk, compressed.
+    """
+    return os.path.getsize(_get_stored_path(path))
+
+
+def open_cache_file(path: Path, mode: str = "rt") -> IO[Any]:
+    stored = find_cache_file(path)
+    if stored is None:
+        raise FileNotFoundError(f"{path} is not cached")
+    compression, stored_path = stored
+    return _open_compressed(stored_path, mode, compression)
+
+
+@contextmanager
+def write_cache_file(path: Path, mode: str = "wt") -> Iterator[IO[Any]]:
+    """
+    Written to a .partial file and moved into place when the with
+    block finishes, then any other stored copy of path is removed.
+    """
+    compression = get_cache_compression()
+    stored_path = Path(f"{path}{CACHE_COMPRESSION_SUFFIXES[compression]}")
+    partial_path = Path(f"{stored_path}.partial")
+    try:
+        with _open_compressed(partial_path, mode, compression) as writer:
+            yield writer
+        os.replace(partial_path, stored_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    for _, other_path in _cache_file_variants(path):
+        if other_path != stored_path and os.path.exists(other_path):
+            os.remove(other_path)
+
+
+def _cached_file_names(cache_path: Path) -> Dict[str, str]:
+    """
+    {uncompressed name: stored name} for the cached files in cache_path.
+    """
+    names: Dict[str, str] = {}
+    for stored_name in sorted(os.listdir(cache_path)):
+        name = stored_name
+        for suffix in CACHE_COMPRESSION_SUFFIXES.values():
+            if suffix and stored_name.endswith(suffix):
+                name = stored_name[: -len(suffix)]
+        if name.endswith(CACHED_FILE_SUFFIXES) and os.path.isfile(
+            cache_path / Path(stored_name)
+        ):
+            names[name] = stored_name
+    return names
+
+
+def migrate_cache_directory(cache_path: Path) -> int:
+    """
+    Rewrites every cached file in cache_path with the configured
+    compression, keeping modification times so parsed files stay
+    current. A marker file records the compression, so this only does
+    any work once. Returns how many files were rewritten.
+    """
+    compression = get_cache_compression()
+    marker_file = cache_path / Path(CACHE_COMPRESSION_MARKER)
+    if os.path.exists(marker_file):
+        with open(marker_file, "rt") as marker_reader:
+            if marker_reader.read().strip() == compression:
+                return 0
+    suffix = CACHE_COMPRESSION_SUFFIXES[compression]
+    migrated = 0
+    for name, stored_name in _cached_file_names(cache_path).items():
+        if stored_name == f"{name}{suffix}":
+            continue
+        path = cache_path / Path(name)
+        modified = get_cache_file_mtime(path)
+        with open_cache_file(path, "rb") as reader, write_cache_file(
+            path, "wb"
+        ) as writer:
+            writer.write(reader.read())
+        os.utime(Path(f"{path}{suffix}"), (modified, modified))
+        migrated += 1
+    with open(marker_file, "wt") as marker_writer:
+        marker_writer.write(compression)
+    if migrated:
+        log.info(f"migrated {migrated} files in {cache_path} to {compression}")
+    return migrated
+
+
+def _time_best_of(function: Callable[[], Any], repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def report_compression_levels(cache_path: Path, repeats: int = 3):
+    """
+    For every cached file: size and best-of-`repeats` read time (read,
+    decompress and decode) at a few gzip and lzma levels.
+    """
+    levels = [("none", 0)] + [("gzip", level) for level in (1, 6, 9)]
+    levels += [("lzma", level) for level in (0, 6, 9)]
+    totals = {level: [0, 0.0] for level in levels}
+    for name in _cached_file_names(cache_path):
+        with open_cache_file(cache_path / Path(name), "rb") as reader:
+            contents = reader.read()
+        print(name)
+        for compression, level in levels:
+            if compression == "none":
+                stored = contents
+            elif compression == "gzip":
+                stored = gzip.compress(contents, compresslevel=level)
+            else:
+                stored = lzma.compress(contents, preset=level)
+            if compression == "gzip":
+                decompress: Callable[[bytes], bytes] = gzip.decompress
+            elif compression == "lzma":
+                decompress = lzma.decompress
+            else:
+                decompress = bytes
+            read_seconds = _time_best_of(
+                lambda: decompress(stored).decode("utf-8"), repeats
+            )
+            totals[(compression, level)][0] += len(stored)
+            totals[(compression, level)][1] += read_seconds
+            print(
+                f"  {compression:4s} {level}  {len(stored):10d}B "
+                f"{len(stored) / max(1, len(contents)):6.1%} "
+                f"{read_seconds * 1000:8.2f}ms"
+            )
+    print("total")
+    for (compression, level), (size, read_seconds) in totals.items():
+        print(f"  {compression:4s} {level}  {size:10d}B {read_seconds * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--path", default=os.environ.get("TEXTAGE_METADATA_PATH", ".textage-metadata")
+    )
+    parser.add_argument("--report", action="store_true")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    cache_path = Path(args.path)
+    if args.report:
+        report_compression_levels(cache_path, args.repeats)
+    else:
+        print(f"migrated {migrate_cache_directory(cache_path)} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,33 +3,92 @@ import os
 import re
 import sys
 import json
+import hashlib
+import argparse
+import operator
+from array import array
+from types import MappingProxyType
 import logging
 from pathlib import Path
-from datetime import datetime
-from typing import List, Callable, Dict, Any, Union, Tuple
+from datetime import date, datetime
+from contextvars import ContextVar
+from typing import (
+    TYPE_CHECKING,
+    List,
+    Callable,
+    Dict,
+    Any,
+    Union,
+    Tuple,
+    Optional,
+    Iterable,
+    Iterator,
+    Mapping,
+    FrozenSet,
+    Set,
+)
 
-import requests  # type: ignore
+from compressed_cache import (
+    cache_file_exists,
+    get_cache_file_mtime,
+    get_cache_file_size,
+    migrate_cache_directory,
+    open_cache_file,
+    write_cache_file,
+)
+from instrumentation import (
+    span,
+    add_instrumentation_arguments,
+    configure_instrumentation,
+)
+from textage_history import record_textage_javascript, unpack_textage_snapshot
+from title_normalization import build_key_index, folder_initial
 from local_dataclasses import (
     Difficulty,
+    BpmTable,
     SongMetadata,
     Alphanumeric,
+    SongReference,
+    BPM_TABLE_COLUMNS,
     DifficultyMetadata,
 )
 
+# textage_fetcher (requests) and actbl_query (numpy) are imported where
+# they're used, so reading the cached catalog doesn't pay for them
+if TYPE_CHECKING:
+    from actbl_query import ActblIndex
+    from textage_fetcher import TextageFetcher
+
 log = logging.getLogger(__name__)
 
+ALPHANUMERIC_FOLDERS = {
+    letter: folder
+    for folder in Alphanumeric
+    if folder != Alphanumeric.OTHERS
+    for letter in folder.name
+}
+
+TEXTAGE_JAVASCRIPT_FILES = ["actbl.js", "titletbl.js", "datatbl.js", "scrlist.js"]
 
-def _download_textage_javascript(javascript_file: str, output_path: Path) -> Path:
+
+def _download_textage_javascript(
+    javascript_file: str, output_path: Path, fetcher: Optional["TextageFetcher"] = None
+) -> Path:
     update = False
-    textage_base_url = "https://textage.cc/score/"
     textage_last_modified_format = "%a, %d %b %Y %H:%M:%S %Z"
+    if fetcher is None:
+        from textage_fetcher import get_default_fetcher
+
+        fetcher = get_default_fetcher()
     # we used enumerate because we wanted the files in a specific
     # order mentioned in the html
-    url = f"{textage_base_url}{javascript_file}"
+    url = f"{fetcher.base_url}{javascript_file}"
     log.info(f"downloading {url}")
     last_modified_file = output_path / Path(f"{javascript_file}.last_modified")
     output_filename = output_path / Path(f"{javascript_file}")
-    response = requests.get(url)
+    with span(f"download {javascript_file}") as stage:
+        response = fetcher.get(javascript_file)
+        stage.add(records=1, bytes_read=len(response.content))
     # make sure to write about this as well, that its chinese w/o it
     response.encoding = "shift_jis"
 
@@ -39,6 +98,12 @@ def _download_textage_javascript(javascript_file: str, output_path: Path) -> Pat
         raise RuntimeError(
             f"server no longer returning last modified: {response.headers}"
         )
+    record_textage_javascript(
+        _get_textage_history_path(output_path),
+        javascript_file,
+        response.text,
+        response.headers["Last-Modified"],
+    )
     if not os.path.exists(last_modified_file):
         update = True
     else:
@@ -56,7 +121,7 @@ def _download_textage_javascript(javascript_file: str, output_path: Path) -> Pat
         log.info(f"updating {output_path}")
         with open(last_modified_file, "wt") as last_modified_writer:
             last_modified_writer.write(response.headers["Last-Modified"])
-        with open(output_filename, "wt") as file_writer:
+        with write_cache_file(output_filename) as file_writer:
             file_writer.write(response.text)
     else:
         log.info(
@@ -65,52 +130,105 @@ def _download_textage_javascript(javascript_file: str, output_path: Path) -> Pat
     return output_filename
 
 
+def _get_parsed_file_path(file: Path, trailing_name: Optional[str] = None) -> Path:
+    source_file_name = os.path.basename(file)
+    source_file_path = os.path.dirname(file)
+    if trailing_name is None:
+        return source_file_path / Path(f"parsed_{source_file_name}.json")
+    return source_file_path / Path(f"parsed_{source_file_name}.{trailing_name}.json")
+
+
+def _convert_javascript_lines(
+    javascript_lines: Iterator[str],
+    block_start_regex: str,
+    block_end_regex: str,
+    specialized_parser: Callable,
+    write: Callable[[str], Any],
+) -> int:
+    """
+    Writes the JSON for the block in javascript_lines, and returns the
+    number of lines read. Stops right after the block, so whatever
+    follows can still be read from javascript_lines.
+    """
+    open_close_char_mapping = {"{": "}", "[": "]"}
+    start_char = ""
+    capture_output = False
+    line_count = 0
+    for line in javascript_lines:
+        line_count += 1
+        line_match = re.match(block_start_regex, line)
+        if line_match:
+            if not line_match.groups() or len(line_match.groups()) < 1:
+                raise RuntimeError("start_regex needs match '()' for struct char { [ ")
+            start_char = line_match.groups()[0]
+            start_line_extras = ""
+            if len(line_match.groups()) > 1:
+                start_line_extras = "".join(line_match.groups()[1:])
+            write(f"{start_char}\n{start_line_extras}\n")
+            capture_output = True
+            continue
+        if capture_output:
+            if re.match(block_end_regex, line):
+                end_char = open_close_char_mapping[start_char]
+                write(end_char)
+                break
+            else:
+                # remove comments
+                line = re.sub(r"^//.*", "", line.strip())
+                # skip blanks
+                if re.match(r"^\s*$", line):
+                    continue
+                parsed_line = specialized_parser(line)
+                write(parsed_line)
+    return line_count
+
+
 def _convert_javascript_and_write_to_json(
     file: Path,
     block_start_regex: str,
     block_end_regex: str,
     specialized_parser: Callable,
+    trailing_parser: Optional[Tuple[str, Callable[[Iterable[str]], Any]]] = None,
 ):
+    """
+    trailing_parser is (name, parser) for javascript after the block.
+    The parser is handed the rest of the open file, so the file is still
+    only read once, and what it returns is written to
+    parsed_<file>.<name>.json.
+    """
     log.info(f"converting {file} to json")
-    open_close_char_mapping = {"{": "}", "[": "]"}
-    start_char = ""
     source_file_name = os.path.basename(file)
-    source_file_path = os.path.dirname(file)
-    parsed_file = source_file_path / Path(f"parsed_{source_file_name}.json")
-    with open(file, "rt") as js_file_reader, open(parsed_file, "wt") as parsed_writer:
-        capture_output = False
-        line_count = 0
-        for line in js_file_reader:
-            line_count += 1
-            line_match = re.match(block_start_regex, line)
-            if line_match:
-                if not line_match.groups() or len(line_match.groups()) < 1:
-                    raise RuntimeError(
-                        "start_regex needs match '()' for struct char { [ "
-                    )
-                start_char = line_match.groups()[0]
-                start_line_extras = ""
-                if len(line_match.groups()) > 1:
-                    start_line_extras = "".join(line_match.groups()[1:])
-                parsed_writer.write(f"{start_char}\n{start_line_extras}\n")
-                capture_output = True
-                continue
-            if capture_output:
-                if re.match(block_end_regex, line):
-                    end_char = open_close_char_mapping[start_char]
-                    parsed_writer.write(end_char)
-                    break
-                else:
-                    # remove comments
-                    line = re.sub(r"^//.*", "", line.strip())
-                    # skip blanks
-                    if re.match(r"^\s*$", line):
-                        continue
-                    parsed_line = specialized_parser(line)
-                    parsed_writer.write(parsed_line)
+    parsed_file = _get_parsed_file_path(file)
+    with span(f"convert {source_file_name}") as stage:
+        with open_cache_file(file) as js_file_reader, write_cache_file(
+            parsed_file
+        ) as parsed_writer:
+            line_count = _convert_javascript_lines(
+                js_file_reader,
+                block_start_regex,
+                block_end_regex,
+                specialized_parser,
+                parsed_writer.write,
+            )
+            if trailing_parser is not None:
+                trailing_name, trailing_callback = trailing_parser
+                trailing_file = _get_parsed_file_path(file, trailing_name)
+                with write_cache_file(trailing_file) as trailing_writer:
+                    json.dump(trailing_callback(js_file_reader), trailing_writer)
+        stage.add(
+            records=line_count,
+            bytes_read=get_cache_file_size(file),
+            bytes_written=get_cache_file_size(parsed_file),
+        )
     return parsed_file
 
 
+def _get_actbl_index(version_data: Dict[str, List[int]]) -> "ActblIndex":
+    from actbl_query import ActblIndex
+
+    return ActblIndex(version_data)
+
+
 def filter_infinitas_only_songs(
     version_data: Dict[str, List[int]], song_titles: Dict[str, List[str]]
 ) -> Dict[str, List[str]]:
@@ -128,407 +246,531 @@ def filter_infinitas_only_songs(
     """
     # https://textage.cc/score/scrlist.js
     # function push_check1
-    infinitas_only_songs: Dict[str, List[str]] = {}
-    for key, value in song_titles.items():
-        if key not in version_data:
-            continue
-        version_flag = version_data[key][0]
-        is_in_infinitas = version_flag & 2
-        if is_in_infinitas != 0:
-            infinitas_only_songs[key] = value
-    return infinitas_only_songs
+    return _get_actbl_index(version_data).filter_titles("infinitas", song_titles)
 
 
-def _read_difficulty(version_data: Dict[str, Any]) -> Dict[str, Dict[Difficulty, int]]:
+def _read_song_difficulty(version_row: List[Any]) -> Dict[Difficulty, int]:
     # https://textage.cc/score/scrlist.js get_level
-    difficulties_by_textage_id: Dict[str, Dict[Difficulty, int]] = {}
-    for key in version_data.keys():
-        difficulties_by_textage_id[key] = {}
-        spl = version_data[key][Difficulty.SP_LEGGENDARIA.value * 2 + 1]
-        spa = version_data[key][Difficulty.SP_ANOTHER.value * 2 + 1]
-        sph = version_data[key][Difficulty.SP_HYPER.value * 2 + 1]
-        spn = version_data[key][Difficulty.SP_NORMAL.value * 2 + 1]
-        dpl = version_data[key][Difficulty.DP_LEGGENDARIA.value * 2 + 1]
-        dpa = version_data[key][Difficulty.DP_ANOTHER.value * 2 + 1]
-        dph = version_data[key][Difficulty.DP_HYPER.value * 2 + 1]
-        dpn = version_data[key][Difficulty.DP_NORMAL.value * 2 + 1]
-        difficulties_by_textage_id[key][Difficulty.SP_LEGGENDARIA] = spl
-        difficulties_by_textage_id[key][Difficulty.SP_ANOTHER] = spa
-        difficulties_by_textage_id[key][Difficulty.SP_HYPER] = sph
-        difficulties_by_textage_id[key][Difficulty.SP_NORMAL] = spn
-        difficulties_by_textage_id[key][Difficulty.DP_LEGGENDARIA] = dpl
-        difficulties_by_textage_id[key][Difficulty.DP_ANOTHER] = dpa
-        difficulties_by_textage_id[key][Difficulty.DP_HYPER] = dph
-        difficulties_by_textage_id[key][Difficulty.DP_NORMAL] = dpn
-    return difficulties_by_textage_id
-
-
-def read_notes_and_bpm() -> Tuple[
-    Dict[str, Tuple[bool, int, int]], Dict[str, Dict[Difficulty, int]]
-]:
+    return {
+        Difficulty.SP_LEGGENDARIA: version_row[Difficulty.SP_LEGGENDARIA.value * 2 + 1],
+        Difficulty.SP_ANOTHER: version_row[Difficulty.SP_ANOTHER.value * 2 + 1],
+        Difficulty.SP_HYPER: version_row[Difficulty.SP_HYPER.value * 2 + 1],
+        Difficulty.SP_NORMAL: version_row[Difficulty.SP_NORMAL.value * 2 + 1],
+        Difficulty.DP_LEGGENDARIA: version_row[Difficulty.DP_LEGGENDARIA.value * 2 + 1],
+        Difficulty.DP_ANOTHER: version_row[Difficulty.DP_ANOTHER.value * 2 + 1],
+        Difficulty.DP_HYPER: version_row[Difficulty.DP_HYPER.value * 2 + 1],
+        Difficulty.DP_NORMAL: version_row[Difficulty.DP_NORMAL.value * 2 + 1],
+    }
+
+
+def _read_difficulty(version_data: Dict[str, Any]) -> Dict[str, Dict[Difficulty, int]]:
+    return {key: _read_song_difficulty(row) for key, row in version_data.items()}
+
+
+def _read_song_notes_and_bpm(
+    notes_and_bpm_row: List[Union[int, str]],
+) -> Tuple[Tuple[bool, int, int], Dict[Difficulty, int]]:
+    notes = {
+        difficulty: int(notes_and_bpm_row[difficulty.value])
+        for difficulty in (
+            Difficulty.SP_NORMAL,
+            Difficulty.SP_HYPER,
+            Difficulty.SP_ANOTHER,
+            Difficulty.SP_LEGGENDARIA,
+            Difficulty.DP_NORMAL,
+            Difficulty.DP_HYPER,
+            Difficulty.DP_ANOTHER,
+            Difficulty.DP_LEGGENDARIA,
+        )
+    }
+    bpm = str(notes_and_bpm_row[11])
+    if re.match(r"\d+〜\d+", bpm):
+        min_bpm, max_bpm = bpm.split("〜", maxsplit=1)
+        soflan = True
+    else:
+        min_bpm = bpm
+        max_bpm = bpm
+        soflan = False
+    return (soflan, int(min_bpm), int(max_bpm)), notes
+
+
+def read_notes_and_bpm(
+    download: bool = True,
+) -> Tuple[Dict[str, Tuple[bool, int, int]], Dict[str, Dict[Difficulty, int]]]:
     bpm_by_textage_id: Dict[str, Tuple[bool, int, int]] = {}
     notes_by_textage_id: Dict[str, Dict[Difficulty, int]] = {}
-    notes_and_bpm = _get_textage_note_counts_and_bpm()
-    for key in notes_and_bpm.keys():
-        notes_by_textage_id[key] = {}
-        spn = int(notes_and_bpm[key][Difficulty.SP_NORMAL.value])
-        sph = int(notes_and_bpm[key][Difficulty.SP_HYPER.value])
-        spa = int(notes_and_bpm[key][Difficulty.SP_ANOTHER.value])
-        spl = int(notes_and_bpm[key][Difficulty.SP_LEGGENDARIA.value])
-        dpn = int(notes_and_bpm[key][Difficulty.DP_NORMAL.value])
-        dph = int(notes_and_bpm[key][Difficulty.DP_HYPER.value])
-        dpa = int(notes_and_bpm[key][Difficulty.DP_ANOTHER.value])
-        dpl = int(notes_and_bpm[key][Difficulty.DP_LEGGENDARIA.value])
-        notes_by_textage_id[key][Difficulty.SP_NORMAL] = spn
-        notes_by_textage_id[key][Difficulty.SP_HYPER] = sph
-        notes_by_textage_id[key][Difficulty.SP_ANOTHER] = spa
-        notes_by_textage_id[key][Difficulty.SP_LEGGENDARIA] = spl
-        notes_by_textage_id[key][Difficulty.DP_NORMAL] = dpn
-        notes_by_textage_id[key][Difficulty.DP_HYPER] = dph
-        notes_by_textage_id[key][Difficulty.DP_ANOTHER] = dpa
-        notes_by_textage_id[key][Difficulty.DP_LEGGENDARIA] = dpl
-        bpm = str(notes_and_bpm[key][11])
-        if re.match(r"\d+〜\d+", bpm):
-            min_bpm, max_bpm = bpm.split("〜", maxsplit=1)
-            soflan = True
-        else:
-            min_bpm = bpm
-            max_bpm = bpm
-            soflan = False
-        bpm_by_textage_id[key] = (soflan, int(min_bpm), int(max_bpm))
+    notes_and_bpm = _get_textage_note_counts_and_bpm(download)
+    for key, row in notes_and_bpm.items():
+        bpm_by_textage_id[key], notes_by_textage_id[key] = _read_song_notes_and_bpm(row)
     return bpm_by_textage_id, notes_by_textage_id
 
 
+# set while a historical catalog is being built from a history snapshot
+_textage_metadata_path_override: ContextVar[Optional[Path]] = ContextVar(
+    "textage_metadata_path_override", default=None
+)
+
+
 def _get_textage_metadata_path() -> Path:
+    """
+    .textage-metadata next to the running script, unless
+    TEXTAGE_METADATA_PATH points somewhere else.
+    """
+    override = _textage_metadata_path_override.get()
+    if override is not None:
+        return override
+    if "TEXTAGE_METADATA_PATH" in os.environ:
+        return Path(os.environ["TEXTAGE_METADATA_PATH"])
     script_path = Path(os.path.dirname(os.path.realpath(sys.argv[0])))
     textage_metadata_path = script_path / Path(".textage-metadata")
     return textage_metadata_path
 
 
+def _get_textage_history_path(textage_metadata_path: Path) -> Path:
+    return textage_metadata_path / Path("history")
+
+
+def _parsed_files_are_current(javascript: Path, parsed_files: List[Path]) -> bool:
+    """
+    Parsed files older than the javascript or than this module's parsers
+    are converted again.
+    """
+    newest_source = max(get_cache_file_mtime(javascript), os.path.getmtime(__file__))
+    return all(
+        cache_file_exists(parsed_file)
+        and get_cache_file_mtime(parsed_file) >= newest_source
+        for parsed_file in parsed_files
+    )
+
+
 def _check_textage_metadata_files(
     textage_javascript_file: str,
     parser_start_regex: str,
     parser_end_regex: str,
     parser_callback: Callable,
-) -> Dict[str, Any]:
+    download: bool = True,
+    trailing_parser: Optional[Tuple[str, Callable[[Iterable[str]], Any]]] = None,
+) -> Path:
     textage_metadata_path = _get_textage_metadata_path()
     os.makedirs(textage_metadata_path, exist_ok=True)
-    javascript = _download_textage_javascript(
-        textage_javascript_file, textage_metadata_path
-    )
-    textage_data_file = _convert_javascript_and_write_to_json(
-        javascript, parser_start_regex, parser_end_regex, parser_callback
-    )
-    log.info(f"reading {textage_data_file}")
-    with open(textage_data_file, "rt") as reader:
+    migrate_cache_directory(textage_metadata_path)
+    if download:
+        javascript = _download_textage_javascript(
+            textage_javascript_file, textage_metadata_path
+        )
+    else:
+        javascript = textage_metadata_path / Path(textage_javascript_file)
+        if not cache_file_exists(javascript):
+            raise RuntimeError(f"{javascript} has not been downloaded yet")
+    parsed_files = [_get_parsed_file_path(javascript)]
+    if trailing_parser is not None:
+        parsed_files.append(_get_parsed_file_path(javascript, trailing_parser[0]))
+    if _parsed_files_are_current(javascript, parsed_files):
+        log.info(f"{parsed_files[0]} is up to date with {javascript}")
+    else:
+        _convert_javascript_and_write_to_json(
+            javascript,
+            parser_start_regex,
+            parser_end_regex,
+            parser_callback,
+            trailing_parser,
+        )
+    return javascript
+
+
+def _load_parsed_file(parsed_file: Path) -> Any:
+    log.info(f"reading {parsed_file}")
+    with span(f"load {os.path.basename(parsed_file)}") as stage, open_cache_file(
+        parsed_file
+    ) as reader:
         textage_data = json.load(reader)
+        stage.add(
+            records=len(textage_data), bytes_read=get_cache_file_size(parsed_file)
+        )
     return textage_data
 
 
 def filter_current_version_songs(
     version_data: Dict[str, List[int]], song_titles: Dict[str, List[str]]
 ) -> Dict[str, List[str]]:
-    current_version_songs: Dict[str, List[str]] = {}
-    for tag, title in song_titles.items():
-        if tag not in version_data:
-            log.warning(f"could not find {tag}:{title}")
-            continue
-        # scrlist.js line 682
-        current_version_flag = version_data[tag][0]
-        is_in_current_version = current_version_flag & 1
-        if is_in_current_version == 0:
-            log.warning(f"skipping {tag}:{title}")
-            continue
-        current_version_songs[tag] = title
+    _warn_missing_version_data(version_data, song_titles)
+    # scrlist.js line 682
+    current_version_songs = _get_actbl_index(version_data).filter_titles(
+        "current", song_titles
+    )
+    log.info(
+        f"skipping {len(song_titles) - len(current_version_songs)} songs"
+        " not in the current version"
+    )
     return current_version_songs
 
 
+def _warn_missing_version_data(
+    version_data: Dict[str, List[int]], song_titles: Dict[str, List[str]]
+):
+    for tag in song_titles.keys() - version_data.keys():
+        log.warning(f"could not find {tag}:{song_titles[tag]}")
+
+
 def get_current_version_songs_not_in_infinitas(
     version_data: Dict[str, List[int]], song_titles: Dict[str, List[str]]
 ) -> List[str]:
-    current_version_songs = filter_current_version_songs(version_data, song_titles)
-    infinitas_only_songs = filter_infinitas_only_songs(version_data, song_titles)
-    inf_keys = set(list(infinitas_only_songs.keys()))
-    cur_ver_keys = set(list(current_version_songs.keys()))
-    not_in_inf_keys = cur_ver_keys.difference(inf_keys)
-    not_in_inf_song_titles = []
-    for key in not_in_inf_keys:
-        not_in_inf_song_titles.append("".join(song_titles[key][5:]))
-    return sorted(not_in_inf_song_titles)
-
-
-def get_textage_version_data() -> Dict[str, Any]:
-    def __convert_version_bitfield_to_json(bitfield: str) -> str:
-        key, values = bitfield.split(":", maxsplit=1)
-        if key == "'__dmy__'":
-            return ""
-        values = re.sub("A", "10", values)
-        values = re.sub("B", "11", values)
-        values = re.sub("C", "12", values)
-        values = re.sub("D", "13", values)
-        values = re.sub("E", "14", values)
-        values = re.sub("F", "15", values)
-        values = re.sub(r"//\d+", "", values)
-        values = re.sub(',"<span.*span>"', "", values)
-        key = re.sub("'", '"', key)
-        return f"{key}:{values}\n"
-
+    not_in_inf_songs = _get_actbl_index(version_data).filter_titles(
+        "current & ~infinitas", song_titles
+    )
+    return sorted("".join(title[5:]) for title in not_in_inf_songs.values())
+
+
+def _convert_version_bitfield_to_json(bitfield: str) -> str:
+    key, values = bitfield.split(":", maxsplit=1)
+    if key == "'__dmy__'":
+        return ""
+    values = re.sub("A", "10", values)
+    values = re.sub("B", "11", values)
+    values = re.sub("C", "12", values)
+    values = re.sub("D", "13", values)
+    values = re.sub("E", "14", values)
+    values = re.sub("F", "15", values)
+    values = re.sub(r"//\d+", "", values)
+    values = re.sub(',"<span.*span>"', "", values)
+    key = re.sub("'", '"', key)
+    return f"{key}:{values}\n"
+
+
+def _remove_title_table_html(title_values: str) -> str:
+    key, values = title_values.split(":", maxsplit=1)
+    if key == "'__dmy__'":
+        return ""
+    values = re.sub(r".fontcolor\(.*?\)", "", values)
+    values = re.sub("<span style='.*?'>", "", values)
+    values = re.sub(r"<\\/span>", "", values)
+    values = re.sub(r"<div class=.*?>", "", values)
+    values = re.sub(r"<\\/div>", "", values)
+    values = re.sub(r"<br>", "", values)
+    values = re.sub(r"<b>", "", values)
+    values = re.sub(r"<\\/b>", "", values)
+    values = re.sub(r"^\[SS", "[-1", values)
+    values = re.sub(r"\t", "", values)
+    key = re.sub("'", '"', key)
+    return f"{key}:{values}\n"
+
+
+def _read_notes_and_bpm(notes_and_bpm_line: str) -> str:
+    line = re.sub("'", '"', notes_and_bpm_line)
+    return f"{line}\n"
+
+
+def _read_vertbl(line: str) -> Any:
+    line = re.sub(";", "", line)
+    line = re.sub("]$", "", line)
+    line = re.sub(r"vertbl\[35\]=", ",", line)
+    return line
+
+
+GET_BPM_FUNCTION_REGEX = re.compile(r"^\s*function\s*get_bpm\s*\(.*$")
+GET_BPM_SWITCH_REGEX = re.compile(r"^\s*switch\s*\(\s*tag\s*\)\s*{.*$")
+GET_BPM_CASE_REGEX = re.compile(r'^\s*case\s*"(.*?)"\s*:(.*)$')
+GET_BPM_IF_REGEX = re.compile(r"if\s*\((.*)\)\s*return\s*\"(.*)\"")
+GET_BPM_BREAK_REGEX = re.compile(r"^\s*break\s*$")
+
+
+def _read_get_bpm_rules(data_table_lines: Iterable[str]) -> Dict[str, List[List[str]]]:
+    """
+    This parses the javascript logic in datatbl.js specifically
+    to extract songs with BPM changes across difficulties, as
+    {textage id: [[if condition, bpm], ...]} in the order the ifs appear.
+    Like javascript, a case without a break falls through into the ifs
+    of the cases after it.
+    """
+    rules: Dict[str, List[List[str]]] = {}
+    open_ids: List[str] = []
+    inside_bpm_function = False
+    inside_bpm_switch = False
+    for raw_line in data_table_lines:
+        line = raw_line.strip()
+        if not inside_bpm_switch:
+            if GET_BPM_FUNCTION_REGEX.match(line):
+                inside_bpm_function = True
+            elif inside_bpm_function and GET_BPM_SWITCH_REGEX.match(line):
+                inside_bpm_switch = True
+            continue
+        if "}" in line:
+            break
+        for block in line.split(";"):
+            block = block.strip()
+            case_match = GET_BPM_CASE_REGEX.match(block)
+            while case_match:
+                textage_id, block = case_match.groups()
+                rules[textage_id] = []
+                open_ids.append(textage_id)
+                case_match = GET_BPM_CASE_REGEX.match(block)
+            if GET_BPM_BREAK_REGEX.match(block):
+                open_ids = []
+                continue
+            if_match = GET_BPM_IF_REGEX.search(block)
+            if if_match:
+                for textage_id in open_ids:
+                    rules[textage_id].append(list(if_match.groups()))
+    return rules
+
+
+# javascript file -> (block start regex, block end regex, line parser)
+# for _convert_javascript_and_write_to_json
+TEXTAGE_JAVASCRIPT_PARSERS: Dict[str, Tuple[str, str, Callable[[str], str]]] = {
+    "actbl.js": (
+        r"^\s*actbl=({).*$",
+        r"\s*}\s*;\s*",
+        _convert_version_bitfield_to_json,
+    ),
+    "titletbl.js": (
+        r"^\s*titletbl=({).*$",
+        r"\s*}\s*;\s*",
+        _remove_title_table_html,
+    ),
+    "datatbl.js": (
+        r"^datatbl\s*=\s*({).*$",
+        r"\s*}\s*;\s*",
+        _read_notes_and_bpm,
+    ),
+    "scrlist.js": (
+        r"^vertbl\s*=\s*(\[)(.*)$",
+        r"^\s*$",
+        _read_vertbl,
+    ),
+}
+
+
+# javascript file -> (name, parser) for javascript after the parsed block
+TEXTAGE_JAVASCRIPT_TRAILING_PARSERS: Dict[
+    str, Tuple[str, Callable[[Iterable[str]], Any]]
+] = {
+    "datatbl.js": ("get_bpm", _read_get_bpm_rules),
+}
+
+
+def _update_textage_parsed_files(javascript_file: str, download: bool) -> Path:
+    start_regex, end_regex, line_parser = TEXTAGE_JAVASCRIPT_PARSERS[javascript_file]
     return _check_textage_metadata_files(
-        textage_javascript_file="actbl.js",
-        parser_start_regex=r"^\s*actbl=({).*$",
-        parser_end_regex=r"\s*}\s*;\s*",
-        parser_callback=__convert_version_bitfield_to_json,
+        textage_javascript_file=javascript_file,
+        parser_start_regex=start_regex,
+        parser_end_regex=end_regex,
+        parser_callback=line_parser,
+        download=download,
+        trailing_parser=TEXTAGE_JAVASCRIPT_TRAILING_PARSERS.get(javascript_file),
     )
 
 
-def get_textage_song_titles() -> Dict[str, Any]:
-    def __remove_title_table_html(title_values: str) -> str:
-        key, values = title_values.split(":", maxsplit=1)
-        if key == "'__dmy__'":
-            return ""
-        values = re.sub(r".fontcolor\(.*?\)", "", values)
-        values = re.sub("<span style='.*?'>", "", values)
-        values = re.sub(r"<\\/span>", "", values)
-        values = re.sub(r"<div class=.*?>", "", values)
-        values = re.sub(r"<\\/div>", "", values)
-        values = re.sub(r"<br>", "", values)
-        values = re.sub(r"<b>", "", values)
-        values = re.sub(r"<\\/b>", "", values)
-        values = re.sub(r"^\[SS", "[-1", values)
-        values = re.sub(r"\t", "", values)
-        key = re.sub("'", '"', key)
-        return f"{key}:{values}\n"
+def _check_textage_parsed_file(javascript_file: str, download: bool) -> Any:
+    javascript = _update_textage_parsed_files(javascript_file, download)
+    return _load_parsed_file(_get_parsed_file_path(javascript))
 
-    return _check_textage_metadata_files(
-        textage_javascript_file="titletbl.js",
-        parser_start_regex=r"^\s*titletbl=({).*$",
-        parser_end_regex=r"\s*}\s*;\s*",
-        parser_callback=__remove_title_table_html,
-    )
 
+def get_textage_version_data(download: bool = True) -> Dict[str, Any]:
+    return _check_textage_parsed_file("actbl.js", download)
 
-def _get_textage_note_counts_and_bpm() -> Dict[str, List[Union[int, str]]]:
-    def __read_notes_and_bpm(notes_and_bpm_line: str) -> str:
-        line = re.sub("'", '"', notes_and_bpm_line)
-        return f"{line}\n"
 
-    return _check_textage_metadata_files(
-        textage_javascript_file="datatbl.js",
-        parser_start_regex=r"^datatbl\s*=\s*({).*$",
-        parser_end_regex=r"\s*}\s*;\s*",
-        parser_callback=__read_notes_and_bpm,
-    )
+def get_textage_song_titles(download: bool = True) -> Dict[str, Any]:
+    return _check_textage_parsed_file("titletbl.js", download)
 
 
-def get_textage_version_list() -> Any:
-    def __read_vertbl(line: str) -> Any:
-        line = re.sub(";", "", line)
-        line = re.sub("]$", "", line)
-        line = re.sub(r"vertbl\[35\]=", ",", line)
-        return line
+def _get_textage_note_counts_and_bpm(
+    download: bool = True,
+) -> Dict[str, List[Union[int, str]]]:
+    return _check_textage_parsed_file("datatbl.js", download)
 
-    return _check_textage_metadata_files(
-        textage_javascript_file="scrlist.js",
-        parser_start_regex=r"^vertbl\s*=\s*(\[)(.*)$",
-        parser_end_regex=r"^\s*$",
-        parser_callback=__read_vertbl,
-    )
 
+def get_textage_version_list(download: bool = True) -> Any:
+    return _check_textage_parsed_file("scrlist.js", download)
 
-def get_variable_bpms() -> Dict[str, Dict[Difficulty, DifficultyMetadata]]:
-    case_regex = r'^\s*case\s*"(.*?)"\s*:(.*)$'
-    if_regex = r"if\s*\((.*)\)\s*return\s*\"(.*)\""
-    break_regex = r"^\s*break\s*$"
-    bpm_cases = _read_get_bpm_javascript()
-    earlier_blocks: List[str] = []
-    variable_bpms: Dict[str, Dict[Difficulty, DifficultyMetadata]] = {}
-    for case in bpm_cases:
-        if re.match(case_regex, case):
-            textage_id, if_block = re.findall(case_regex, case)[0]
-            variable_bpms[textage_id] = {}
-            if_match = re.findall(if_regex, if_block)
-            if not if_match:
-                earlier_blocks.append(textage_id)
-                continue
-            else:
-                difficulties, bpm = if_match[0]
-                variable_bpms[textage_id].update(_read_bpm_if_block(difficulties, bpm))
-        elif re.match(break_regex, case):
-            while len(earlier_blocks) > 0:
-                earlier_textage_id = earlier_blocks.pop()
-                variable_bpms[earlier_textage_id] = variable_bpms[textage_id]
-        elif re.match(if_regex, case):
-            if_block = re.findall(if_regex, case)
-            if not if_block:
-                raise RuntimeError("The formatting on the source has changed.")
-            difficulties, bpm = if_block[0]
-            variable_bpms[textage_id].update(_read_bpm_if_block(difficulties, bpm))
-    return variable_bpms
-
-
-def _read_bpm_if_block(
-    difficulties: str, bpm: str
-) -> Dict[Difficulty, DifficultyMetadata]:
-    type_regex = r"type\s*([=<>]+)\s*(\d+)"
+
+def _get_variable_bpm_rules(download: bool = True) -> Dict[str, List[List[str]]]:
+    javascript = _update_textage_parsed_files("datatbl.js", download)
+    return _load_parsed_file(_get_parsed_file_path(javascript, "get_bpm"))
+
+
+GET_BPM_TYPE_REGEX = re.compile(r"^\s*type\s*([=!<>]+)\s*(\d+)\s*$")
+GET_BPM_COMPARATORS: Dict[str, Callable[[int, int], bool]] = {
+    "==": operator.eq,
+    "===": operator.eq,
+    "!=": operator.ne,
+    "!==": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _read_bpm_string(bpm: str) -> Tuple[int, int, bool]:
     bpm_parts = bpm.split("〜")
     if len(bpm_parts) == 2:
-        bpms = DifficultyMetadata(
-            min_bpm=int(bpm_parts[0]), max_bpm=int(bpm_parts[1]), soflan=True
-        )
+        return int(bpm_parts[0]), int(bpm_parts[1]), True
     elif len(bpm_parts) == 1:
-        bpms = DifficultyMetadata(
-            min_bpm=int(bpm_parts[0]), max_bpm=int(bpm_parts[0]), soflan=False
-        )
+        return int(bpm_parts[0]), int(bpm_parts[0]), False
     else:
         raise RuntimeError(f"Cannot read BPM from {bpm}")
-    if_block_parts = difficulties.split("||")
-    bpm_by_difficulty: Dict[Difficulty, DifficultyMetadata] = {}
-    for part in if_block_parts:
-        if not re.match(type_regex, part):
+
+
+def _read_bpm_condition(condition: str) -> FrozenSet[int]:
+    """
+    The difficulty values `type` makes an if condition like
+    `type==4||type>=9` true for.
+    """
+    matching_types: Set[int] = set()
+    for part in condition.split("||"):
+        type_match = GET_BPM_TYPE_REGEX.match(part)
+        if not type_match:
             raise RuntimeError("The if-statements in get_bpm have changed.")
-        else:
-            comparator, difficulty_str = re.findall(type_regex, part)[0]
-            difficulty_value = int(difficulty_str)
-            if comparator == "==":
-                diff = Difficulty(difficulty_value)
-                bpm_by_difficulty[diff] = bpms
-            elif comparator == ">=":
-                for member in Difficulty:
-                    if (
-                        member.value >= difficulty_value
-                        and member.value != Difficulty.UNKNOWN
-                    ):
-                        bpm_by_difficulty[member] = bpms
-            elif comparator == "<=":
-                for member in Difficulty:
-                    if (
-                        member.value <= difficulty_value
-                        and member.value != Difficulty.UNKNOWN
-                    ):
-                        bpm_by_difficulty[member] = bpms
-            else:
-                raise RuntimeError(f"Cannot handle comparator {comparator} in js")
-    return bpm_by_difficulty
+        comparator, type_value = type_match.groups()
+        if comparator not in GET_BPM_COMPARATORS:
+            raise RuntimeError(f"Cannot handle comparator {comparator} in js")
+        compare = GET_BPM_COMPARATORS[comparator]
+        matching_types.update(
+            difficulty.value
+            for difficulty in Difficulty
+            if difficulty != Difficulty.UNKNOWN
+            and compare(difficulty.value, int(type_value))
+        )
+    return frozenset(matching_types)
 
 
-def _read_get_bpm_javascript() -> List[str]:
+def compile_bpm_table(
+    bpm_by_textage_id: Dict[str, Tuple[bool, int, int]],
+    bpm_rules: Dict[str, List[List[str]]],
+) -> BpmTable:
     """
-    This parses the javascript logic in datatbl.js specifically
-    to extract songs with BPM changes across difficulties
+    Evaluates get_bpm(tag, type) for every song and difficulty up front:
+    the first if that matches wins, otherwise the BPM from datatbl.
     """
-    textage_metadata_path = _get_textage_metadata_path()
-    data_table_file = textage_metadata_path / "datatbl.js"
-    case_lines: List[str] = []
-    with open(data_table_file, "rt") as data_table_reader:
-        inside_bpm_function = False
-        inside_bpm_switch = False
-        bpm_regex = r"^\s*function\s*get_bpm\s*\(.*$"
-        switch_regex = r"^\s*switch\s*\(\s*tag\s*\)\s*{.*$"
-        end_regex = r".*\}.*"
-        for raw_line in data_table_reader:
-            line = raw_line.strip()
-            if inside_bpm_function and inside_bpm_switch:
-                if re.match(end_regex, line):
-                    break
-                blocks = [block.strip() for block in line.split(";") if block != ""]
-                case_lines.extend(blocks)
-                continue
-            elif re.match(bpm_regex, line):
-                inside_bpm_function = True
-                continue
-            elif inside_bpm_function and re.match(switch_regex, line):
-                inside_bpm_switch = True
-                continue
-    return case_lines
+    row_by_textage_id: Dict[str, int] = {}
+    min_bpms = array("I")
+    max_bpms = array("I")
+    soflans = array("B")
+    conditions: Dict[str, FrozenSet[int]] = {}
+    for row, (textage_id, (soflan, min_bpm, max_bpm)) in enumerate(
+        bpm_by_textage_id.items()
+    ):
+        row_by_textage_id[textage_id] = row
+        cells = [(min_bpm, max_bpm, soflan)] * BPM_TABLE_COLUMNS
+        # applied last to first so the first matching if is what's left
+        for condition, bpm in reversed(bpm_rules.get(textage_id, [])):
+            if condition not in conditions:
+                conditions[condition] = _read_bpm_condition(condition)
+            rule_bpm = _read_bpm_string(bpm)
+            for type_value in conditions[condition]:
+                cells[type_value] = rule_bpm
+        for cell_min_bpm, cell_max_bpm, cell_soflan in cells:
+            min_bpms.append(cell_min_bpm)
+            max_bpms.append(cell_max_bpm)
+            soflans.append(cell_soflan)
+    return BpmTable(
+        row_by_textage_id=MappingProxyType(row_by_textage_id),
+        min_bpm=memoryview(min_bpms).toreadonly(),
+        max_bpm=memoryview(max_bpms).toreadonly(),
+        soflan=memoryview(soflans).toreadonly(),
+    )
+
+
+def get_bpm_table(download: bool = True) -> BpmTable:
+    bpm_by_textage_id, _ = read_notes_and_bpm(download)
+    # datatbl.js was just fetched by read_notes_and_bpm
+    return compile_bpm_table(bpm_by_textage_id, _get_variable_bpm_rules(False))
 
 
 def check_alphanumeric_folder(char: str) -> Alphanumeric:
-    if re.match("[ABCD]", char, re.IGNORECASE):
-        return Alphanumeric.ABCD
-    elif re.match("[EFGH]", char, re.IGNORECASE):
-        return Alphanumeric.EFGH
-    elif re.match("[IJKL]", char, re.IGNORECASE):
-        return Alphanumeric.IJKL
-    elif re.match("[MNOP]", char, re.IGNORECASE):
-        return Alphanumeric.MNOP
-    elif re.match("[QRST]", char, re.IGNORECASE):
-        return Alphanumeric.QRST
-    elif re.match("[UVWXYZ]", char, re.IGNORECASE):
-        return Alphanumeric.UVWXYZ
-    else:
-        return Alphanumeric.OTHERS
+    return ALPHANUMERIC_FOLDERS.get(folder_initial(char), Alphanumeric.OTHERS)
+
+
+def _build_song_metadata(
+    textage_id: str,
+    song_title_row: List[Any],
+    song_difficulty: Dict[Difficulty, int],
+    notes: Dict[Difficulty, int],
+    bpm_table: BpmTable,
+    version_list: List[str],
+) -> SongMetadata:
+    difficulty_metadata: Dict[Difficulty, DifficultyMetadata] = {}
+    title = " ".join(song_title_row[5:])
+    version_id = int(song_title_row[0])
+    # substream is last in textage js
+    if version_id == 35:
+        version_id = -1
+    version = version_list[version_id]
+    for diff_id in song_difficulty.keys():
+        if song_difficulty[diff_id] == 0 or notes[diff_id] == 0:
+            continue
+        min_bpm, max_bpm, soflan = bpm_table.lookup(textage_id, diff_id)
+        difficulty_metadata[diff_id] = DifficultyMetadata(
+            level=song_difficulty[diff_id],
+            notes=notes[diff_id],
+            min_bpm=min_bpm,
+            max_bpm=max_bpm,
+            soflan=soflan,
+        )
+    return SongMetadata(
+        textage_id=textage_id,
+        title=title,
+        artist=song_title_row[4],
+        genre=song_title_row[3],
+        textage_version_id=version_id,
+        version=version,
+        alphanumeric=check_alphanumeric_folder(title[0]),
+        difficulty_metadata=difficulty_metadata,
+    )
 
 
 def _build_song_metadata_dict(
     version_data: Dict[str, Any],
     song_titles: Dict[str, Any],
     song_list: Dict[str, List[str]],
+    download: bool = True,
 ) -> Any:
     all_difficulties = _read_difficulty(version_data)
-    all_bpms, all_note_counts = read_notes_and_bpm()
-    variable_bpms = get_variable_bpms()
-    version_list = get_textage_version_list()
+    all_bpms, all_note_counts = read_notes_and_bpm(download)
+    # datatbl.js was just fetched by read_notes_and_bpm
+    bpm_table = compile_bpm_table(all_bpms, _get_variable_bpm_rules(False))
+    version_list = get_textage_version_list(download)
     metadata: Dict[str, SongMetadata] = {}
-    for textage_id in song_list.keys():
-        difficulty_metadata: Dict[Difficulty, DifficultyMetadata] = {}
-        song_difficulty: Dict[Difficulty, int] = all_difficulties[textage_id]
-        notes: Dict[Difficulty, int] = all_note_counts[textage_id]
-        title = " ".join(song_list[textage_id][5:])
-        version_id = int(song_list[textage_id][0])
-        # substream is last in textage js
-        if version_id == 35:
-            version_id = -1
-        version = version_list[version_id]
-        for diff_id in song_difficulty.keys():
-            if song_difficulty[diff_id] == 0 or notes[diff_id] == 0:
-                continue
-            if textage_id in variable_bpms and diff_id in variable_bpms[textage_id]:
-                difficulty_metadata[diff_id] = variable_bpms[textage_id][diff_id]
-            else:
-                difficulty_metadata[diff_id] = DifficultyMetadata(
-                    soflan=all_bpms[textage_id][0],
-                    min_bpm=all_bpms[textage_id][1],
-                    max_bpm=all_bpms[textage_id][2],
-                )
-            difficulty_metadata[diff_id].notes = notes[diff_id]
-            difficulty_metadata[diff_id].level = song_difficulty[diff_id]
-        metadata[textage_id] = SongMetadata(
-            textage_id=textage_id,
-            title=title,
-            artist=song_list[textage_id][4],
-            genre=song_list[textage_id][3],
-            textage_version_id=version_id,
-            version=version,
-            alphanumeric=check_alphanumeric_folder(title[0]),
-            difficulty_metadata=difficulty_metadata,
-        )
+    with span("build song metadata") as stage:
+        for textage_id in song_list.keys():
+            metadata[textage_id] = _build_song_metadata(
+                textage_id,
+                song_list[textage_id],
+                all_difficulties[textage_id],
+                all_note_counts[textage_id],
+                bpm_table,
+                version_list,
+            )
+        stage.add(records=len(metadata))
     return metadata
 
 
-def get_infinitas_song_metadata() -> Dict[str, SongMetadata]:
-    version_data = get_textage_version_data()
-    song_titles = get_textage_song_titles()
+def get_infinitas_song_metadata(download: bool = True) -> Dict[str, SongMetadata]:
+    version_data = get_textage_version_data(download)
+    song_titles = get_textage_song_titles(download)
     infinitas_only_songs = filter_infinitas_only_songs(version_data, song_titles)
-    return _build_song_metadata_dict(version_data, song_titles, infinitas_only_songs)
+    return _build_song_metadata_dict(
+        version_data, song_titles, infinitas_only_songs, download
+    )
 
 
-def get_current_version_song_metadata_not_in_infinitas() -> Dict[str, SongMetadata]:
-    version_data = get_textage_version_data()
-    song_titles = get_textage_song_titles()
-    current_version_songs = filter_current_version_songs(version_data, song_titles)
-    infinitas_only_songs = filter_infinitas_only_songs(version_data, song_titles)
-    inf_keys = set(list(infinitas_only_songs.keys()))
-    cur_ver_keys = set(list(current_version_songs.keys()))
-    not_in_inf_keys = cur_ver_keys.difference(inf_keys)
-    not_in_inf_songs = {
-        textage_id: current_version_songs[textage_id] for textage_id in not_in_inf_keys
-    }
-    return _build_song_metadata_dict(version_data, song_titles, not_in_inf_songs)
+def get_current_version_song_metadata_not_in_infinitas(
+    download: bool = True,
+) -> Dict[str, SongMetadata]:
+    version_data = get_textage_version_data(download)
+    song_titles = get_textage_song_titles(download)
+    _warn_missing_version_data(version_data, song_titles)
+    not_in_inf_songs = _get_actbl_index(version_data).filter_titles(
+        "current & ~infinitas", song_titles
+    )
+    return _build_song_metadata_dict(
+        version_data, song_titles, not_in_inf_songs, download
+    )
 
 
-def get_all_song_metadata() -> Dict[str, SongMetadata]:
-    version_data = get_textage_version_data()
-    song_titles = get_textage_song_titles()
+def get_all_song_metadata(download: bool = True) -> Dict[str, SongMetadata]:
+    version_data = get_textage_version_data(download)
+    song_titles = get_textage_song_titles(download)
     validated_songs = {}
     for textage_id, title_version_metadata in song_titles.items():
         if textage_id not in version_data:
@@ -536,9 +778,128 @@ def get_all_song_metadata() -> Dict[str, SongMetadata]:
             continue
         # scrlist.js line 682
         validated_songs[textage_id] = title_version_metadata
-    return _build_song_metadata_dict(version_data, song_titles, validated_songs)
+    return _build_song_metadata_dict(
+        version_data, song_titles, validated_songs, download
+    )
+
+
+def get_historical_song_metadata(
+    when: Union[date, datetime],
+) -> Dict[str, SongMetadata]:
+    """
+    get_all_song_metadata as of `when` (a date means the end of that
+    day, UTC), built from the versions in .textage-metadata/history.
+    """
+    snapshot_path = unpack_textage_snapshot(
+        _get_textage_history_path(_get_textage_metadata_path()),
+        when,
+        TEXTAGE_JAVASCRIPT_FILES,
+    )
+    token = _textage_metadata_path_override.set(snapshot_path)
+    try:
+        return get_all_song_metadata(download=False)
+    finally:
+        _textage_metadata_path_override.reset(token)
+
+
+def download_textage_javascript_files(
+    fetcher: Optional["TextageFetcher"] = None,
+) -> Dict[str, Path]:
+    """
+    Revalidates every textage file we parse against the server
+    without converting anything, so a catalog can then be built
+    with download=False.
+    """
+    textage_metadata_path = _get_textage_metadata_path()
+    os.makedirs(textage_metadata_path, exist_ok=True)
+    migrate_cache_directory(textage_metadata_path)
+    return {
+        javascript_file: _download_textage_javascript(
+            javascript_file, textage_metadata_path, fetcher
+        )
+        for javascript_file in TEXTAGE_JAVASCRIPT_FILES
+    }
+
+
+def get_textage_javascript_digest() -> str:
+    """
+    sha256 over the locally cached textage files, used to tell
+    whether a catalog needs rebuilding after a revalidation.
+    """
+    textage_metadata_path = _get_textage_metadata_path()
+    digest = hashlib.sha256()
+    for javascript_file in TEXTAGE_JAVASCRIPT_FILES:
+        digest.update(javascript_file.encode())
+        with open_cache_file(
+            textage_metadata_path / Path(javascript_file), "rb"
+        ) as reader:
+            digest.update(reader.read())
+    return digest.hexdigest()
+
+
+def _freeze_textage_ids(
+    textage_ids_by_key: Dict[Any, Set[str]],
+) -> Mapping[Any, FrozenSet[str]]:
+    return MappingProxyType(
+        {key: frozenset(textage_ids) for key, textage_ids in textage_ids_by_key.items()}
+    )
+
+
+def build_song_reference(
+    songs: Dict[str, SongMetadata], version: int = 0
+) -> SongReference:
+    """
+    The lookups are built in plain dicts and sets, then frozen into the
+    SongReference, so nothing can change it once it's shared.
+    """
+    by_title: Dict[str, str] = {}
+    by_artist: Dict[str, Set[str]] = {}
+    by_difficulty: Dict[Tuple[str, int], Set[str]] = {}
+    by_bpm: Dict[Tuple[int, int], Set[str]] = {}
+    by_note_count: Dict[int, Set[str]] = {}
+    for textage_id, song in songs.items():
+        by_title[song.title] = textage_id
+        by_artist.setdefault(song.artist, set()).add(textage_id)
+        for difficulty, metadata in song.difficulty_metadata.items():
+            difficulty_tuple = (difficulty.name, metadata.level)
+            bpm_tuple = (metadata.min_bpm, metadata.max_bpm)
+            by_difficulty.setdefault(difficulty_tuple, set()).add(textage_id)
+            by_bpm.setdefault(bpm_tuple, set()).add(textage_id)
+            by_note_count.setdefault(metadata.notes, set()).add(textage_id)
+    return SongReference(
+        by_artist=_freeze_textage_ids(by_artist),
+        by_normalized_title=_freeze_textage_ids(
+            build_key_index(
+                (textage_id, song.title) for textage_id, song in songs.items()
+            )
+        ),
+        by_normalized_artist=_freeze_textage_ids(
+            build_key_index(
+                (textage_id, song.artist) for textage_id, song in songs.items()
+            )
+        ),
+        by_difficulty=_freeze_textage_ids(by_difficulty),
+        by_title=MappingProxyType(by_title),
+        by_bpm=_freeze_textage_ids(by_bpm),
+        by_note_count=_freeze_textage_ids(by_note_count),
+        version=version,
+    )
 
 
 if __name__ == "__main__":
-    for key, value in sorted(get_all_song_metadata().items()):
+    parser = argparse.ArgumentParser(description="Print every song textage lists")
+    parser.add_argument(
+        "--date",
+        type=date.fromisoformat,
+        default=None,
+        help="YYYY-MM-DD, print the songs as of this date from the download history",
+    )
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
+    if args.date is not None:
+        songs = get_historical_song_metadata(args.date)
+    else:
+        songs = get_all_song_metadata()
+    for key, value in sorted(songs.items()):
         print(value.to_dict())
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+A fixed ring of preallocated capture frames, with MetadataZone crops
+handed out as views into them instead of copies:
+
+    ring = FrameRingBuffer(capacity=3, height=1080, width=1920)
+    zones = ZoneSlices(metadata_zones)
+    frame_number, slot = ring.acquire()     # capture straight into slot
+    ring.publish(frame_number)              # once the capture is done
+    title = zones.view(ring.frame(frame_number), "song_select", "title")
+    ring.commit_score_frame(state, frame_number)  # the only copy
+
+Readers only see a frame once it has been published, so they never get a
+slot that is still being captured into. Frames and views are only valid
+until `capacity` newer frames have been acquired. frame() raises
+FrameOverwrittenError after that, but views handed out earlier silently
+show the newer frame, so copy anything that has to live longer
+(commit_score_frame does).
+
+Run as a script, this compares allocations and time per frame with
+allocating every frame and copying every crop.
+"""
+
+import gc
+import time
+import logging
+import argparse
+import threading
+import tracemalloc
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from local_dataclasses import MetadataZone, VideoProcessingState
+
+log = logging.getLogger(__name__)
+
+# the frame being captured, one being read, and a spare. Every slot is
+# ~6MB at 1080p, and a ring that no longer fits in cache costs more
+# per frame than it saves, so keep it as small as the readers allow
+DEFAULT_CAPACITY = 3
+
+ZoneSlice = Tuple[slice, slice]
+
+
+class FrameOverwrittenError(RuntimeError):
+    pass
+
+
+class ZoneSlices:
+    """
+    The slices for every MetadataZone, by (state, area), computed once.
+    """
+
+    def __init__(self, metadata_zones: Iterable[MetadataZone]):
+        self.slices: Dict[Tuple[str, str], ZoneSlice] = {
+            (zone.state, zone.area): (
+                slice(zone.top_left_y, zone.bottom_right_y),
+                slice(zone.top_left_x, zone.bottom_right_x),
+            )
+            for zone in metadata_zones
+        }
+
+    def view(self, frame: NDArray, state: str, area: str) -> NDArray:
+        """
+        The zone's pixels in frame, without copying them.
+        """
+        return frame[self.slices[(state, area)]]
+
+    def views(self, frame: NDArray, state: str) -> Dict[str, NDArray]:
+        return {
+            area: frame[zone_slice]
+            for (zone_state, area), zone_slice in self.slices.items()
+            if zone_state == state
+        }
+
+
+class FrameRingBuffer:
+    """
+    `capacity` frames of (height, width, channels), allocated once.
+    Frames are numbered from 0 in capture order, and frame n lives in
+    slot n % capacity until frame n + capacity replaces it.
+
+    Meant for one capturing thread; any number of threads can read.
+    """
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CAPACITY,
+        height: int = 1080,
+        width: int = 1920,
+        channels: int = 3,
+        dtype: type = np.uint8,
+    ):
+        if capacity < 1:
+            raise ValueError("a FrameRingBuffer needs at least one slot")
+        self.capacity = capacity
+        self.frames: NDArray = np.zeros((capacity, height, width, channels), dtype)
+        # the number the next frame will get
+        self._next_frame = 0
+        # frames before this one are fully captured and readable
+        self._published_frames = 0
+        self._lock = threading.Lock()
+
+    @property
+    def frame_shape(self) -> Tuple[int, ...]:
+        return self.frames.shape[1:]
+
+    def acquire(self) -> Tuple[int, NDArray]:
+        """
+        The next frame number and the slot to capture it into. Whatever
+        was in the slot (frame_number - capacity) is gone. Readers can't
+        see the frame until it is published.
+        """
+        with self._lock:
+            frame_number = self._next_frame
+            self._next_frame += 1
+        return frame_number, self.frames[frame_number % self.capacity]
+
+    def write(self, frame: NDArray) -> int:
+        """
+        Copies frame into the next slot, for captures that can't write
+        into a given array. Returns its frame number.
+        """
+        frame_number, slot = self.acquire()
+        np.copyto(slot, frame)
+        self.publish(frame_number)
+        return frame_number
+
+    def publish(self, frame_number: int):
+        """
+        Makes an acquired frame readable once its capture has finished.
+        Frames are published in the order they were acquired.
+        """
+        with self._lock:
+            if frame_number != self._published_frames:
+                raise ValueError(
+                    f"frame {frame_number} published out of order, "
+                    f"expected {self._published_frames}"
+                )
+            if frame_number >= self._next_frame:
+                raise ValueError(f"frame {frame_number} hasn't been acquired")
+            self._published_frames = frame_number + 1
+
+    @property
+    def latest_frame_number(self) -> int:
+        """
+        The newest published frame.
+        """
+        if self._published_frames == 0:
+            raise LookupError("no frames have been captured yet")
+        return self._published_frames - 1
+
+    def frame(self, frame_number: int) -> NDArray:
+        """
+        A view of frame_number, while it is still in the ring.
+        """
+        if frame_number >= self._published_frames or frame_number < 0:
+            raise LookupError(f"frame {frame_number} hasn't been captured")
+        if frame_number < self._next_frame - self.capacity:
+            raise FrameOverwrittenError(
+                f"frame {frame_number} was overwritten, the ring holds "
+                f"{self._next_frame - self.capacity} onwards"
+            )
+        return self.frames[frame_number % self.capacity]
+
+    def commit_score_frame(
+        self, state: VideoProcessingState, frame_number: int
+    ) -> NDArray:
+        """
+        Copies frame_number out of the ring into state.score_frame, so it
+        survives the ring moving on.
+        """
+        score_frame = self.frame(frame_number).copy()
+        state.score_frame = score_frame
+        return score_frame
+
+
+def _benchmark_zones(height: int, width: int, count: int) -> List[MetadataZone]:
+    """
+    `count` title/artist/score sized zones spread over the frame.
+    """
+    zones = []
+    for zone_number in range(count):
+        top = (zone_number * 97) % (height - 80)
+        left = (zone_number * 211) % (width - 400)
+        zones.append(
+            MetadataZone(
+                top_left_y=top,
+                bottom_right_y=top + 80,
+                top_left_x=left,
+                bottom_right_x=left + 400,
+                state="score",
+                area=f"zone{zone_number}",
+            )
+        )
+    return zones
+
+
+def _measure(
+    step: Callable[[int], None], frames: int
+) -> Tuple[float, float, int, float]:
+    """
+    (seconds/frame, bytes allocated/frame, gc collections, peak MB).
+    Allocations are the tracemalloc peak over each frame, above what was
+    live when it started.
+    """
+    gc.collect()
+    collections = sum(stats["collections"] for stats in gc.get_stats())
+    tracemalloc.start()
+    allocated = 0
+    started = time.perf_counter()
+    for frame_number in range(frames):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        step(frame_number)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+    elapsed = time.perf_counter() - started
+    _, overall_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    collections = sum(stats["collections"] for stats in gc.get_stats()) - collections
+    return elapsed / frames, allocated / frames, collections, overall_peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--frames", type=int, default=600, help="10s at 60fps")
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--zones", type=int, default=8)
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY)
+    parser.add_argument(
+        "--score-every", type=int, default=120, help="commit a score frame every n"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    shape = (args.height, args.width, 3)
+    source = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    zones = _benchmark_zones(args.height, args.width, args.zones)
+    zone_slices = ZoneSlices(zones)
+    state = VideoProcessingState()
+    checksums: List[int] = []
+
+    def allocate_every_frame(frame_number: int):
+        # a capture that returns a new array, and crops copied before OCR
+        frame = np.add(source, frame_number % 7, dtype=np.uint8)
+        crops = {
+            zone.area: frame[
+                zone.top_left_y : zone.bottom_right_y,
+                zone.top_left_x : zone.bottom_right_x,
+            ].copy()
+            for zone in zones
+        }
+        checksums.append(sum(int(crop[0, 0, 0]) for crop in crops.values()))
+        if frame_number % args.score_every == 0:
+            state.score_frame = frame.copy()
+
+    ring = FrameRingBuffer(args.capacity, args.height, args.width)
+
+    def ring_buffer(frame_number: int):
+        captured, slot = ring.acquire()
+        np.add(source, frame_number % 7, out=slot, dtype=np.uint8)
+        ring.publish(captured)
+        crops = zone_slices.views(slot, "score")
+        checksums.append(sum(int(crop[0, 0, 0]) for crop in crops.values()))
+        if frame_number % args.score_every == 0:
+            ring.commit_score_frame(state, captured)
+
+    print(
+        f"{args.frames} frames of {args.width}x{args.height}, {args.zones} zones, "
+        f"a score frame every {args.score_every}"
+    )
+    results = {}
+    for label, step in (
+        ("allocate every frame", allocate_every_frame),
+        ("ring buffer", ring_buffer),
+    ):
+        checksums.clear()
+        seconds, allocated, collections, peak = _measure(step, args.frames)
+        results[label] = list(checksums)
+        print(
+            f"  {label:22s} {seconds * 1000:6.2f}ms/frame "
+            f"{allocated / 1e6:8.3f}MB allocated/frame "
+            f"{collections:3d} gc collections, peak {peak:6.1f}MB"
+        )
+    if results["allocate every frame"] != results["ring buffer"]:
+        raise RuntimeError("the ring buffer crops differ from the copied ones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Writes synthetic actbl.js, titletbl.js, datatbl.js and scrlist.js in
+the same format textage serves them, so the parsers can be run and
+benchmarked at sizes textage hasn't reached yet.
+
+The files are written as utf-8 text, the same as the cached copies
+that _download_textage_javascript leaves in .textage-metadata.
+"""
+
+import os
+import random
+import logging
+import argparse
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+log = logging.getLogger(__name__)
+
+# roughly the number of titles in titletbl.js at the time of writing
+REAL_SONG_COUNT = 2100
+
+VERSION_NAMES = [
+    "0",
+    "1st style",
+    "2nd style",
+    "3rd style",
+    "4th style",
+    "5th style",
+    "6th style",
+    "7th style",
+    "8th style",
+    "9th style",
+    "10th style",
+    "IIDX RED",
+    "HAPPY SKY",
+    "DistorteD",
+    "GOLD",
+    "DJ TROOPERS",
+    "EMPRESS",
+    "SIRIUS",
+    "Resort Anthem",
+    "Lincle",
+    "tricoro",
+    "SPADA",
+    "PENDUAL",
+    "copula",
+    "SINOBUZ",
+    "CANNON BALLERS",
+    "Rootage",
+    "HEROIC VERSE",
+    "BISTROVER",
+    "CastHour",
+    "RESIDENT",
+    "EPOLIS",
+]
+GENRES = ["TECHNO", "HARDCORE", "TRANCE", "J-POP", "DRUM'N'BASS", "ロック", "ＰＯＰ"]
+SYLLABLES = [
+    "ka", "ze", "ro", "mi", "na", "to", "ri", "su", "ne", "bo",
+    "カ", "ゼ", "ロ", "ミ", "な", "と", "り", "す", "ね", "ぼ",
+    "Ａ", "Ｘ", "Ω", "7", "#", "!",
+]  # fmt: skip
+SP_DIFFICULTIES = [2, 3, 4, 5]
+DP_DIFFICULTIES = [7, 8, 9, 10]
+LEVEL_DIGITS = "0123456789ABC"
+
+
+def _textage_id(song_number: int, rng: random.Random) -> str:
+    prefix = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(4))
+    return f"{prefix}{song_number:05d}"
+
+
+def _title(song_number: int, rng: random.Random) -> str:
+    words = [
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        for _ in range(rng.randint(1, 3))
+    ]
+    return f"{' '.join(words)} {song_number}"
+
+
+def _title_cells(title: str, rng: random.Random) -> str:
+    """
+    Titles are sometimes split into several cells with html and
+    .fontcolor() calls that __remove_title_table_html strips back out.
+    """
+    decoration = rng.random()
+    if decoration < 0.05:
+        head, _, tail = title.partition(" ")
+        return f'"<b>{head}<\\/b>","{tail}".fontcolor(\'red\')'
+    if decoration < 0.10:
+        return f"\"<span style='color:#ff8800'>{title}<\\/span>\""
+    if decoration < 0.12:
+        return f"\"<div class='small'>{title}<br><\\/div>\""
+    return f'"{title}"'
+
+
+def _levels(rng: random.Random) -> Dict[int, int]:
+    levels: Dict[int, int] = {}
+    for difficulties in (SP_DIFFICULTIES, DP_DIFFICULTIES):
+        base = rng.randint(1, 6)
+        for step, difficulty in enumerate(difficulties):
+            if difficulty in (5, 10) and rng.random() > 0.1:
+                continue
+            levels[difficulty] = min(12, base + step * rng.randint(1, 3))
+    return levels
+
+
+def _bpm(rng: random.Random) -> Tuple[int, int]:
+    max_bpm = rng.randint(90, 220)
+    if rng.random() < 0.15:
+        return rng.randint(40, max_bpm - 1), max_bpm
+    return max_bpm, max_bpm
+
+
+def _bpm_string(bpm: Tuple[int, int]) -> str:
+    if bpm[0] == bpm[1]:
+        return str(bpm[0])
+    return f"{bpm[0]}〜{bpm[1]}"
+
+
+def generate_textage_corpus(scale: float = 1.0, seed: int = 0) -> Dict[str, str]:
+    """
+    Returns {javascript file name: contents} for about
+    scale * REAL_SONG_COUNT songs.
+    """
+    rng = random.Random(seed)
+    song_count = max(1, int(REAL_SONG_COUNT * scale))
+    actbl = ["actbl={", "'__dmy__':[" + ",".join(["0"] * 22) + "],"]
+    titletbl = ["titletbl={", '\'__dmy__\':[0,0,0,"","",""],']
+    datatbl = ["datatbl={", "'__dmy__':[" + ",".join(["0"] * 11) + ',"0",0],']
+    bpm_cases: List[str] = []
+    grouped_cases: List[str] = []
+    for song_number in range(song_count):
+        last = song_number == song_count - 1
+        separator = "" if last else ","
+        textage_id = _textage_id(song_number, rng)
+        levels = _levels(rng)
+        flags = rng.choice([0, 1, 2, 3, 3, 3])
+        act_cells = [str(flags), "0"]
+        for difficulty in range(1, 11):
+            level = levels.get(difficulty, 0)
+            act_cells.extend(["1" if level else "0", LEVEL_DIGITS[level]])
+        act_extra = ""
+        if rng.random() < 0.03:
+            act_extra = ",\"<span style='color:red'>†<\\/span>\""
+        act_comment = f"//{rng.randint(0, 999)}" if rng.random() < 0.2 else ""
+        actbl.append(
+            f"'{textage_id}'\t:[{','.join(act_cells)}{act_extra}]{separator}{act_comment}"
+        )
+
+        version = rng.randint(1, len(VERSION_NAMES) - 1)
+        version_cell = "SS" if rng.random() < 0.01 else str(version)
+        title = _title(song_number, rng)
+        artist = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 6)))
+        titletbl.append(
+            f"'{textage_id}'\t:[{version_cell},{song_number},1,"
+            f'"{rng.choice(GENRES)}","{artist}",{_title_cells(title, rng)}]{separator}'
+        )
+
+        notes = [
+            str(rng.randint(100 * level, 180 * level)) if level else "0"
+            for level in (levels.get(difficulty, 0) for difficulty in range(11))
+        ]
+        bpm = _bpm(rng)
+        datatbl.append(
+            f"'{textage_id}'\t:[{','.join(notes)},\"{_bpm_string(bpm)}\",0]{separator}"
+        )
+
+        roll = rng.random()
+        if roll < 0.01:
+            grouped_cases.append(textage_id)
+        elif roll < 0.04 or grouped_cases:
+            if_blocks = [
+                f'if(type{rng.choice(["==", ">=", "<="])}{rng.choice([3, 4, 5, 8, 9])})'
+                f'return "{_bpm_string(_bpm(rng))}"'
+                for _ in range(rng.randint(1, 2))
+            ]
+            for grouped_id in grouped_cases:
+                bpm_cases.append(f'\t\tcase "{grouped_id}":')
+            grouped_cases = []
+            bpm_cases.append(f'\t\tcase "{textage_id}":{";".join(if_blocks)};break;')
+    actbl.append("};")
+    titletbl.append("};")
+    datatbl.append("};")
+    get_bpm = (
+        ["", "function get_bpm(tag,type){", "\tswitch(tag){"]
+        + bpm_cases
+        + ["\t}", "\treturn datatbl[tag][11];", "}"]
+    )
+    vertbl = [
+        "vertbl = [" + ",".join(f'"{name}"' for name in VERSION_NAMES),
+        "];",
+        'vertbl[35]="substream";',
+        "",
+        "function scrlist(){}",
+    ]
+    return {
+        "actbl.js": "\n".join(actbl) + "\n",
+        "titletbl.js": "\n".join(titletbl) + "\n",
+        "datatbl.js": "\n".join(datatbl + get_bpm) + "\n",
+        "scrlist.js": "\n".join(vertbl) + "\n",
+    }
+
+
+def write_textage_corpus(output_path: Path, scale: float = 1.0, seed: int = 0):
+    os.makedirs(output_path, exist_ok=True)
+    for javascript_file, contents in generate_textage_corpus(scale, seed).items():
+        with open(output_path / Path(javascript_file), "wt") as writer:
+            writer.write(contents)
+    log.info(f"wrote a {scale}x synthetic textage corpus to {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output_path")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    write_textage_corpus(Path(args.output_path), args.scale, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import sys
+import json
+import time
+import argparse
+import atexit
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Union
+
+# the profilers are only imported by enable_profiling, they aren't free
+if TYPE_CHECKING:
+    import cProfile
+
+log = logging.getLogger(__name__)
+
+TRACEMALLOC_TOP_N = 25
+
+
+class Span:
+    """
+    Wall and CPU time for one stage, plus whatever counts the stage
+    reports through add(). Recorded when the with block exits.
+    """
+
+    __slots__ = (
+        "name",
+        "records",
+        "bytes_read",
+        "bytes_written",
+        "_wall_started",
+        "_cpu_started",
+    )
+
+    def __init__(self, name: str):
+        self.name = name
+        self.records = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, records: int = 0, bytes_read: int = 0, bytes_written: int = 0):
+        self.records += records
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+    def __enter__(self) -> "Span":
+        self._wall_started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        return self
+
+    def __exit__(self, *args: Any):
+        wall = time.perf_counter() - self._wall_started
+        cpu = time.process_time() - self._cpu_started
+        _recorder.record(self, wall, cpu)
+
+
+class _DisabledSpan:
+    """
+    What span() hands out when instrumentation is off, so the cost of
+    an instrumented stage is one function call and a flag check.
+    """
+
+    __slots__ = ()
+
+    def add(self, records: int = 0, bytes_read: int = 0, bytes_written: int = 0):
+        pass
+
+    def __enter__(self) -> "_DisabledSpan":
+        return self
+
+    def __exit__(self, *args: Any):
+        pass
+
+
+_DISABLED_SPAN = _DisabledSpan()
+
+
+class _SpanRecorder:
+    def __init__(self):
+        self.enabled = False
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, Union[int, float]]] = {}
+
+    def record(self, span: Span, wall: float, cpu: float):
+        with self._lock:
+            totals = self._totals.setdefault(
+                span.name,
+                {
+                    "count": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "records": 0,
+                    "bytes_read": 0,
+                    "bytes_written": 0,
+                },
+            )
+            totals["count"] += 1
+            totals["wall_seconds"] += wall
+            totals["cpu_seconds"] += cpu
+            totals["records"] += span.records
+            totals["bytes_read"] += span.bytes_read
+            totals["bytes_written"] += span.bytes_written
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_wall_seconds": time.perf_counter() - self.started,
+                "spans": {name: dict(totals) for name, totals in self._totals.items()},
+            }
+
+
+_recorder = _SpanRecorder()
+
+
+def span(name: str) -> Union[Span, _DisabledSpan]:
+    """
+    with span("convert actbl.js") as stage:
+        ...
+        stage.add(records=line_count, bytes_written=size)
+    """
+    if not _recorder.enabled:
+        return _DISABLED_SPAN
+    return Span(name)
+
+
+def get_timing_summary() -> Dict[str, Any]:
+    return _recorder.summary()
+
+
+def _write_timing_summary(output_file: str):
+    summary = get_timing_summary()
+    with open(output_file, "wt") as writer:
+        json.dump(summary, writer, indent=2)
+    log.info(f"wrote stage timings to {output_file}")
+
+
+def enable_timings(output_file: str = "timings.json"):
+    """
+    Starts recording spans and writes the JSON summary at exit.
+    """
+    _recorder.enabled = True
+    _recorder.started = time.perf_counter()
+    atexit.register(_write_timing_summary, output_file)
+
+
+def _write_profile(
+    profiler: "cProfile.Profile", profile_file: str, tracemalloc_file: str
+):
+    import pstats
+    import cProfile
+    import tracemalloc
+
+    profiler.disable()
+    profiler.dump_stats(profile_file)
+    # leave out what the profilers themselves allocated
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ]
+    )
+    tracemalloc.stop()
+    with open(tracemalloc_file, "wt") as writer:
+        for statistic in snapshot.statistics("lineno")[:TRACEMALLOC_TOP_N]:
+            writer.write(f"{statistic}\n")
+    stats = pstats.Stats(profile_file, stream=sys.stderr)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TRACEMALLOC_TOP_N)
+    log.info(f"wrote cProfile stats to {profile_file}")
+    log.info(f"wrote tracemalloc top {TRACEMALLOC_TOP_N} to {tracemalloc_file}")
+
+
+def enable_profiling(
+    profile_file: str = "profile.prof",
+    tracemalloc_file: str = "tracemalloc.txt",
+    timings_file: str = "timings.json",
+):
+    """
+    Stage timings, plus cProfile and tracemalloc for the rest of the
+    run. Everything is written out at exit.
+    """
+    import cProfile
+    import tracemalloc
+
+    enable_timings(timings_file)
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    atexit.register(_write_profile, profiler, profile_file, tracemalloc_file)
+
+
+def add_instrumentation_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="write per-stage timings to timings.json at exit",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="--timings, plus cProfile stats and the top tracemalloc allocations",
+    )
+
+
+def configure_instrumentation(args: argparse.Namespace):
+    if args.profile:
+        enable_profiling()
+    elif args.timings:
+        enable_timings()
@@ -0,0 +1,174 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional
+
+from instrumentation import span
+from compressed_cache import open_cache_file
+from local_dataclasses import SongMetadata
+from download_textage_tables import (
+    _build_song_metadata,
+    _get_parsed_file_path,
+    _get_variable_bpm_rules,
+    _update_textage_parsed_files,
+    _read_song_difficulty,
+    _read_song_notes_and_bpm,
+    compile_bpm_table,
+    get_textage_version_list,
+)
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 256
+
+
+class ParsedRows(Mapping[str, Any]):
+    """
+    A parsed_<file>.json table that only json-decodes a row when it is
+    looked up. The parsers write one '"textage id"\t:[row],' per line,
+    so opening it only splits lines instead of a full json.load.
+    """
+
+    def __init__(self, parsed_file: Path):
+        with open_cache_file(parsed_file) as reader:
+            self._lines = reader.read().split("\n")
+        self._line_numbers: Dict[str, int] = {
+            line[1 : line.find('"', 1)]: line_number
+            for line_number, line in enumerate(self._lines)
+            if line.startswith('"')
+        }
+
+    def __getitem__(self, textage_id: str) -> Any:
+        line = self._lines[self._line_numbers[textage_id]]
+        row = line[line.index(":") + 1 :].rstrip().rstrip("}").rstrip(",")
+        return json.loads(row)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._line_numbers)
+
+    def __len__(self) -> int:
+        return len(self._line_numbers)
+
+    def __contains__(self, textage_id: object) -> bool:
+        return textage_id in self._line_numbers
+
+
+class LazySongCatalog(Mapping[str, SongMetadata]):
+    """
+    The same songs as get_all_song_metadata, read straight from the
+    parsed textage tables. A SongMetadata is only built the first time
+    its textage id is looked up, and the last cache_size of them are
+    kept. keys(), len(), `in` and restrict() never build one.
+    """
+
+    def __init__(
+        self,
+        version_data: Mapping[str, Any],
+        song_titles: Mapping[str, Any],
+        notes_and_bpm: Mapping[str, Any],
+        bpm_rules: Dict[str, List[List[str]]],
+        version_list: List[str],
+        textage_ids: Optional[Iterable[str]] = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        self._version_data = version_data
+        self._song_titles = song_titles
+        self._notes_and_bpm = notes_and_bpm
+        self._bpm_rules = bpm_rules
+        self._version_list = version_list
+        if textage_ids is None:
+            textage_ids = (
+                textage_id for textage_id in song_titles if textage_id in version_data
+            )
+        # a dict rather than a set, to keep textage's order
+        self._textage_ids: Dict[str, None] = dict.fromkeys(textage_ids)
+        self._cache_size = cache_size
+        self._cache: "OrderedDict[str, SongMetadata]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, textage_id: str) -> SongMetadata:
+        if textage_id not in self._textage_ids:
+            raise KeyError(textage_id)
+        with self._lock:
+            if textage_id in self._cache:
+                self._cache.move_to_end(textage_id)
+                return self._cache[textage_id]
+        song = self._build(textage_id)
+        with self._lock:
+            self._cache[textage_id] = song
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return song
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._textage_ids)
+
+    def __len__(self) -> int:
+        return len(self._textage_ids)
+
+    def __contains__(self, textage_id: object) -> bool:
+        return textage_id in self._textage_ids
+
+    def _build(self, textage_id: str) -> SongMetadata:
+        bpm, notes = _read_song_notes_and_bpm(self._notes_and_bpm[textage_id])
+        # a one song table, so only this song's get_bpm rules are evaluated
+        bpm_table = compile_bpm_table(
+            {textage_id: bpm}, {textage_id: self._bpm_rules.get(textage_id, [])}
+        )
+        return _build_song_metadata(
+            textage_id,
+            self._song_titles[textage_id],
+            _read_song_difficulty(self._version_data[textage_id]),
+            notes,
+            bpm_table,
+            self._version_list,
+        )
+
+    def restrict(self, textage_ids: Iterable[str]) -> "LazySongCatalog":
+        """
+        A catalog over the given textage ids that are in this one. It
+        shares the raw tables, but has its own cache.
+        """
+        return LazySongCatalog(
+            self._version_data,
+            self._song_titles,
+            self._notes_and_bpm,
+            self._bpm_rules,
+            self._version_list,
+            [textage_id for textage_id in textage_ids if textage_id in self],
+            self._cache_size,
+        )
+
+    def filter_raw(
+        self, song_filter: Callable[..., Dict[str, Any]]
+    ) -> "LazySongCatalog":
+        """
+        Narrows the catalog with one of the filters in
+        download_textage_tables, e.g. filter_infinitas_only_songs, which
+        only look at the raw actbl/titletbl rows.
+        """
+        return self.restrict(song_filter(self._version_data, self._song_titles))
+
+
+def _get_parsed_rows(javascript_file: str, download: bool) -> ParsedRows:
+    javascript = _update_textage_parsed_files(javascript_file, download)
+    return ParsedRows(_get_parsed_file_path(javascript))
+
+
+def get_lazy_song_metadata(
+    download: bool = True, cache_size: int = DEFAULT_CACHE_SIZE
+) -> LazySongCatalog:
+    with span("load lazy catalog") as stage:
+        catalog = LazySongCatalog(
+            version_data=_get_parsed_rows("actbl.js", download),
+            song_titles=_get_parsed_rows("titletbl.js", download),
+            notes_and_bpm=_get_parsed_rows("datatbl.js", download),
+            # datatbl.js was just fetched for the note counts
+            bpm_rules=_get_variable_bpm_rules(False),
+            version_list=get_textage_version_list(download),
+            cache_size=cache_size,
+        )
+        stage.add(records=len(catalog))
+    return catalog
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import time
+import logging
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit, quote
+from typing import List, Optional
+
+from refresh_daemon import CatalogRefresher, CatalogSnapshot
+from catalog_server import CatalogServer
+
+log = logging.getLogger(__name__)
+
+
+def build_request_paths(snapshot: CatalogSnapshot, limit: int = 200) -> List[str]:
+    """
+    A mix of the requests our tools make: single lookups, play metadata
+    and OCR resolution for real charts, and a couple of listings.
+    """
+    paths = ["/status", "/songs?difficulty=SP_ANOTHER&level=12"]
+    for textage_id in sorted(snapshot.songs.keys())[:limit]:
+        song = snapshot.songs[textage_id]
+        paths.append(f"/songs/{quote(textage_id)}")
+        for difficulty, metadata in song.difficulty_metadata.items():
+            paths.append(
+                f"/resolve/play?difficulty={difficulty.name}&level={metadata.level}"
+                f"&min_bpm={metadata.min_bpm}&max_bpm={metadata.max_bpm}"
+                f"&notes={metadata.notes}"
+            )
+            paths.append(
+                f"/resolve/ocr?difficulty={difficulty.name}&level={metadata.level}"
+                f"&en_title={quote(song.title)}&en_artist={quote(song.artist)}"
+            )
+            break
+    return paths
+
+
+def _worker(
+    host: str,
+    port: int,
+    paths: List[str],
+    deadline: float,
+    offset: int,
+    use_gzip: bool,
+    latencies: List[float],
+    errors: List[int],
+):
+    # one keep-alive connection per worker, like a real client would hold
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    headers = {"Accept-Encoding": "gzip"} if use_gzip else {}
+    request_number = offset
+    while time.perf_counter() < deadline:
+        path = paths[request_number % len(paths)]
+        request_number += 1
+        started = time.perf_counter()
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - started)
+        if response.status >= 500:
+            errors.append(1)
+    connection.close()
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percentile))
+    return sorted_values[index]
+
+
+def run_load_test(
+    host: str,
+    port: int,
+    paths: List[str],
+    concurrency: int,
+    seconds: float,
+    use_gzip: bool,
+):
+    latencies: List[float] = []
+    errors: List[int] = []
+    deadline = time.perf_counter() + seconds
+    workers = [
+        threading.Thread(
+            target=_worker,
+            args=(host, port, paths, deadline, n, use_gzip, latencies, errors),
+        )
+        for n in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"requests:    {len(latencies)} ({len(errors)} errors)")
+    print(f"concurrency: {concurrency}, gzip: {use_gzip}")
+    print(f"requests/s:  {len(latencies) / elapsed:.0f}")
+    print(f"p50:         {_percentile(latencies, 0.50) * 1000:.2f}ms")
+    print(f"p99:         {_percentile(latencies, 0.99) * 1000:.2f}ms")
+    print(f"max:         {_percentile(latencies, 1.0) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Load test catalog_server.py. Without --url an in-process server "
+            "is started on the already downloaded .textage-metadata files."
+        )
+    )
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    refresher = CatalogRefresher(download=False)
+    refresher.refresh()
+    snapshot = refresher.wait_for_snapshot()
+    server: Optional[CatalogServer] = None
+    if args.url is None:
+        server = CatalogServer(("127.0.0.1", 0), refresher)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = "127.0.0.1", server.server_address[1]
+    else:
+        url = urlsplit(args.url)
+        host, port = url.hostname or "127.0.0.1", url.port or 80
+    paths = build_request_paths(snapshot)
+    try:
+        run_load_test(host, port, paths, args.concurrency, args.seconds, args.gzip)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,14 @@ import logging
 from enum import Enum
 from concurrent.futures import Future
 from dataclasses import dataclass, field
-from typing import Dict, Set, Tuple, Optional
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Dict, FrozenSet, Set, Tuple, Optional, Mapping
 
-from numpy.typing import NDArray
+from title_normalization import normalize_key
+
+# only for annotations, so importing the dataclasses doesn't import numpy
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
 
 log = logging.getLogger(__name__)
 
@@ -91,6 +96,28 @@ class DifficultyMetadata:
     soflan: bool = False
 
 
+# one column per datatbl.js index, so Difficulty.value is the column
+BPM_TABLE_COLUMNS = 11
+
+
+@dataclass(frozen=True)
+class BpmTable:
+    """
+    min/max BPM and soflan for every (textage id, difficulty), with the
+    get_bpm function in datatbl.js already applied. Cells are flat
+    read-only arrays indexed by row * BPM_TABLE_COLUMNS + difficulty.value.
+    """
+
+    row_by_textage_id: Mapping[str, int]
+    min_bpm: memoryview
+    max_bpm: memoryview
+    soflan: memoryview
+
+    def lookup(self, textage_id: str, difficulty: Difficulty) -> Tuple[int, int, bool]:
+        cell = self.row_by_textage_id[textage_id] * BPM_TABLE_COLUMNS + difficulty.value
+        return self.min_bpm[cell], self.max_bpm[cell], bool(self.soflan[cell])
+
+
 def generate_difficulty_metadata() -> Dict[Difficulty, DifficultyMetadata]:
     return {
         Difficulty.SP_NORMAL: DifficultyMetadata(),
@@ -123,7 +150,7 @@ class SongMetadata:
             "title": self.title,
             "artist": self.artist,
             "genre": self.genre,
-            "textage_version_id": self.version_id,
+            "textage_version_id": self.textage_version_id,
             "version": self.version,
             "alphanumeric": self.alphanumeric.name,
             "difficulty_metadata": {
@@ -180,7 +207,6 @@ class SongMetadata:
 
     def sort_by_spn(self) -> str:
         rate = self.__check_difficulty_rate(Difficulty.SP_NORMAL)
-        print(f"{rate} " + self.sort_by_alphanumeric())
         return f"{rate} " + self.sort_by_alphanumeric()
 
     def sort_by_sph(self) -> str:
@@ -269,20 +295,82 @@ class OCRSongTitles:
     jp_artist: str
 
 
-@dataclass
-class SongReference:
-    by_artist: Dict[str, Set[str]] = field(default_factory=dict)
-    by_difficulty: Dict[Tuple[str, int], Set[str]] = field(default_factory=dict)
-    by_title: Dict[str, str] = field(default_factory=dict)
-    by_bpm: Dict[Tuple[int, int], Set[str]] = field(default_factory=dict)
-    by_note_count: Dict[int, Set[str]] = field(default_factory=dict)
+@dataclass(frozen=True)
+class SongResolution:
+    """
+    What a SongReference resolved, and the version of the reference
+    that resolved it.
+    """
+
+    textage_ids: FrozenSet[str]
+    version: int
+
+    @property
+    def textage_id(self) -> Optional[str]:
+        if len(self.textage_ids) != 1:
+            return None
+        return next(iter(self.textage_ids))
+
+
+class PicklableMappingProxies:
+    """
+    For frozen dataclasses that hand out MappingProxyType fields:
+    mappingproxy can't be pickled, so they travel as dicts and are
+    wrapped again on the other side (a process pool worker, say).
+    """
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            name: dict(value) if isinstance(value, MappingProxyType) else value
+            for name, value in self.__dict__.items()
+        }
+
+    def __setstate__(self, state: Dict[str, Any]):
+        for name, value in state.items():
+            if isinstance(value, dict):
+                value = MappingProxyType(value)
+            # frozen, so __setattr__ is off limits
+            object.__setattr__(self, name, value)
+
+
+@dataclass(frozen=True)
+class SongReference(PicklableMappingProxies):
+    """
+    Read-only lookups from what OCR/play metadata can see to textage ids.
+    Nothing about a SongReference changes once it's built (see
+    build_song_reference), so any number of threads can resolve against
+    one without a lock. A rebuild makes a new one with a higher version.
+    """
+
+    by_artist: Mapping[str, FrozenSet[str]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    by_difficulty: Mapping[Tuple[str, int], FrozenSet[str]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    by_title: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+    by_bpm: Mapping[Tuple[int, int], FrozenSet[str]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    by_note_count: Mapping[int, FrozenSet[str]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    version: int = 0
+    # title_normalization.normalize_key -> textage ids, for OCR output that
+    # only differs from titletbl.js in width, kana or spacing
+    by_normalized_title: Mapping[str, FrozenSet[str]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    by_normalized_artist: Mapping[str, FrozenSet[str]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
 
     def resolve_by_play_metadata(
         self,
         difficulty_tuple: Tuple[str, int],
         bpm_tuple: Tuple[int, int],
         note_count: Optional[int] = None,
-    ) -> Set[str]:
+    ) -> FrozenSet[str]:
         difficulty_set = self.by_difficulty[difficulty_tuple]
         bpm_set = self.by_bpm[bpm_tuple]
         if note_count is not None:
@@ -294,14 +382,22 @@ class SongReference:
         return found_results
 
     def _resolve_artist_ocr(
-        self, song_title: OCRSongTitles, found_difficulty_textage_ids: Set[str]
+        self, song_title: OCRSongTitles, found_difficulty_textage_ids: FrozenSet[str]
     ) -> Optional[str]:
         found_artist_textage_id = None
-        found_en_artist_textage_ids = self.by_artist.get(song_title.en_artist, set([]))
-        found_jp_artist_textage_ids = self.by_artist.get(song_title.jp_artist, set([]))
+        found_en_artist_textage_ids = self.by_artist.get(
+            song_title.en_artist, frozenset()
+        )
+        found_jp_artist_textage_ids = self.by_artist.get(
+            song_title.jp_artist, frozenset()
+        )
         found_artist_textage_ids = found_en_artist_textage_ids.union(
             found_jp_artist_textage_ids
         )
+        if not found_artist_textage_ids:
+            found_artist_textage_ids = self._lookup_normalized(
+                self.by_normalized_artist, song_title.en_artist, song_title.jp_artist
+            )
         if len(found_artist_textage_ids) > 0:
             matching_ids = found_artist_textage_ids.intersection(
                 found_difficulty_textage_ids
@@ -311,12 +407,43 @@ class SongReference:
                 found_artist_textage_id = list(matching_ids)[0]
         return found_artist_textage_id
 
+    def _lookup_normalized(
+        self, by_normalized: Mapping[str, FrozenSet[str]], *texts: str
+    ) -> FrozenSet[str]:
+        found: FrozenSet[str] = frozenset()
+        for text in texts:
+            key = normalize_key(text)
+            if key:
+                found = found.union(by_normalized.get(key, frozenset()))
+        return found
+
+    def _lookup_title(
+        self, title: str, found_difficulty_textage_ids: FrozenSet[str]
+    ) -> Optional[str]:
+        """
+        The exact title, or failing that the one song at this difficulty
+        with the same normalized title.
+        """
+        textage_id = self.by_title.get(title, None)
+        if textage_id is not None:
+            return textage_id
+        normalized_ids = self._lookup_normalized(
+            self.by_normalized_title, title
+        ).intersection(found_difficulty_textage_ids)
+        if len(normalized_ids) == 1:
+            return next(iter(normalized_ids))
+        return None
+
     def _resolve_title_ocr(
-        self, song_title: OCRSongTitles, found_difficulty_textage_ids: Set[str]
+        self, song_title: OCRSongTitles, found_difficulty_textage_ids: FrozenSet[str]
     ) -> Optional[str]:
         found_title_textage_id = None
-        found_en_title_textage_id = self.by_title.get(song_title.en_title, None)
-        found_jp_title_textage_id = self.by_title.get(song_title.jp_title, None)
+        found_en_title_textage_id = self._lookup_title(
+            song_title.en_title, found_difficulty_textage_ids
+        )
+        found_jp_title_textage_id = self._lookup_title(
+            song_title.jp_title, found_difficulty_textage_ids
+        )
         log.info(f"found_en_title_textage_id: {found_en_title_textage_id}")
         log.info(f"found_jp_title_textage_id: {found_jp_title_textage_id}")
         if found_en_title_textage_id is not None and found_jp_title_textage_id is None:
@@ -336,7 +463,9 @@ class SongReference:
         self, song_title: OCRSongTitles, difficulty: str, level: int
     ) -> Optional[str]:
         difficulty_tuple: Tuple[str, int] = (difficulty, level)
-        found_difficulty_textage_ids = self.by_difficulty.get(difficulty_tuple, set([]))
+        found_difficulty_textage_ids = self.by_difficulty.get(
+            difficulty_tuple, frozenset()
+        )
         if not found_difficulty_textage_ids:
             log.info(f"Could not lookup difficulty {difficulty_tuple}")
             return None
@@ -367,11 +496,37 @@ class SongReference:
     def resolve_strings(self, title: OCRSongTitles, metadata_titles: Set[str]):
         pass
 
+    def resolve_play_metadata_with_version(
+        self,
+        difficulty_tuple: Tuple[str, int],
+        bpm_tuple: Tuple[int, int],
+        note_count: Optional[int] = None,
+    ) -> SongResolution:
+        """
+        resolve_by_play_metadata, with no match instead of a KeyError.
+        """
+        try:
+            found = self.resolve_by_play_metadata(
+                difficulty_tuple, bpm_tuple, note_count
+            )
+        except KeyError:
+            found = frozenset()
+        return SongResolution(textage_ids=found, version=self.version)
+
+    def resolve_ocr_with_version(
+        self, song_title: OCRSongTitles, difficulty: str, level: int
+    ) -> SongResolution:
+        textage_id = self.resolve_ocr(song_title, difficulty, level)
+        return SongResolution(
+            textage_ids=frozenset() if textage_id is None else frozenset([textage_id]),
+            version=self.version,
+        )
+
 
 @dataclass
 class VideoProcessingState:
     score: Optional[Score] = None
-    score_frame: Optional[NDArray] = None
+    score_frame: Optional["NDArray"] = None
     difficulty: Optional[str] = None
     level: Optional[int] = None
     lifebar_type: Optional[str] = None
@@ -448,3 +603,118 @@ class VideoProcessingState:
         return self.ocr_song_title is None or (
             self.ocr_song_future is not None and not self.ocr_song_future.done()
         )
+
+
+@dataclass(frozen=True)
+class TextageHistoryEntry:
+    javascript_file: str
+    sha256: str
+    fetched_at: str
+    last_modified: str
+
+
+@dataclass(frozen=True)
+class RecoveredScore:
+    """
+    A Score found while backfilling a recording, at the frame it was
+    read from.
+    """
+
+    frame_number: int
+    score: Score
+    textage_id: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class LampTable:
+    """
+    Best lamps and EX scores grouped by chart columns (see
+    chart_aggregation.py). Row i is the group keys[i], one value per
+    column in by.
+    """
+
+    by: Tuple[str, ...]
+    keys: "NDArray"
+    lamp_columns: Tuple[str, ...]
+    grades: Tuple[str, ...]
+    # charts in each group, played or not
+    charts: "NDArray"
+    # (groups, lamp_columns): NO_PLAY, then ClearType FAILED..FULL_COMBO
+    lamp_counts: "NDArray"
+    # (groups, grades): charts by their best DJ level, X for unplayed
+    grade_counts: "NDArray"
+    ex_score: "NDArray"
+    max_ex_score: "NDArray"
+
+    def to_dicts(self) -> list:
+        return [
+            {
+                **{column: int(value) for column, value in zip(self.by, key)},
+                "charts": int(self.charts[group]),
+                "lamps": {
+                    lamp: int(count)
+                    for lamp, count in zip(self.lamp_columns, self.lamp_counts[group])
+                },
+                "grades": {
+                    grade: int(count)
+                    for grade, count in zip(self.grades, self.grade_counts[group])
+                },
+                "ex_score": int(self.ex_score[group]),
+                "max_ex_score": int(self.max_ex_score[group]),
+            }
+            for group, key in enumerate(self.keys)
+        ]
+
+
+@dataclass(frozen=True)
+class SongSelectFolder:
+    """
+    A song select folder: kind is alphanumeric, level or version, style
+    is SP or DP, and value is the Alphanumeric value, the level or the
+    textage version id.
+    """
+
+    kind: str
+    style: str
+    value: int
+
+
+@dataclass(frozen=True)
+class ChartPosition:
+    folder: SongSelectFolder
+    position: int
+
+
+@dataclass(frozen=True)
+class CorpusFile:
+    """
+    One revision of a textage javascript file for the parser harness.
+    label says where it came from (cache, history sha256, generated, or
+    the mutations applied).
+    """
+
+    javascript_file: str
+    label: str
+    text: str
+
+
+@dataclass(frozen=True)
+class CatalogStatistics:
+    """
+    Chart and song counts over the catalog whose textage files hash to
+    digest (see catalog_statistics.py). Levels index the level axes
+    directly, and songs rows are textage version id + 1, since
+    substream is -1.
+    """
+
+    digest: str
+    note_bin_width: int
+    # (Difficulty value, level): charts, and how many of them are soflan
+    charts: "NDArray"
+    soflan_charts: "NDArray"
+    # (level, notes // note_bin_width), the last bin counts everything above
+    notes: "NDArray"
+    # (level,): sum of the notes of every chart
+    notes_total: "NDArray"
+    # (textage version id + 1, Alphanumeric value)
+    songs: "NDArray"
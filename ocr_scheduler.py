@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Schedules title OCR for the capture loop without OCRing the same title
+over and over. Each title crop gets a 64 bit difference hash (dHash),
+so near-identical crops from consecutive frames are found cheaply. A
+hash match only counts once the crops themselves agree pixel for pixel
+(up to noise), as titles a letter apart can hash the same:
+- a crop matching a cached one gets the cached OCRSongTitles back at once
+- a crop matching one already being OCRed shares that job's future
+- anything else is copied (crops are usually ring buffer views) and
+  OCRed on a bounded thread pool
+
+    scheduler = OCRScheduler(read_song_titles, max_workers=2)
+    scheduler.submit_for_state(state, title_crop)
+    ...
+    if state.returned_to_song_select_before_writing():
+        scheduler.reset_state(state)
+
+Run as a script, this checks that titles a letter apart aren't mixed up
+and that resetting one state doesn't cancel OCR another state shares,
+then replays a synthetic capture and prints
+how many OCR calls were made.
+"""
+
+import time
+import logging
+import argparse
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from local_dataclasses import OCRSongTitles, VideoProcessingState
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_CACHE_SIZE = 128
+# jobs waiting for a worker beyond this are stale, the oldest is cancelled
+DEFAULT_MAX_PENDING = 8
+# hashes this many bits apart or closer are worth comparing crops for
+DEFAULT_MAX_DISTANCE = 3
+HASH_SIZE = 8
+# gray levels a block must be brighter than its left neighbour by for a
+# 1 bit, so flat background doesn't flip bits with noise
+HASH_MARGIN = 2.0
+# gray levels two pixels can differ by and still be the same pixel under
+# sensor noise
+PIXEL_TOLERANCE = 32
+# crops with more pixels than this out of tolerance are different crops,
+# well under the size of one glyph stroke
+MAX_DIFFERING_PIXELS = 8
+
+
+def difference_hash(crop: NDArray) -> int:
+    """
+    dHash: the crop's brightness, averaged down to HASH_SIZE rows of
+    HASH_SIZE + 1 columns, one bit per pair of neighbouring columns for
+    whether brightness goes up by more than HASH_MARGIN. Cheap, and
+    stable under the small noise between frames of the same screen.
+    """
+    height, width = crop.shape[:2]
+    if height < HASH_SIZE or width < HASH_SIZE + 1:
+        raise ValueError(f"a {width}x{height} crop is too small to hash")
+    row_starts = np.linspace(0, height, HASH_SIZE, endpoint=False).astype(np.intp)
+    column_starts = np.linspace(0, width, HASH_SIZE + 1, endpoint=False).astype(np.intp)
+    blocks = np.add.reduceat(
+        np.add.reduceat(crop, row_starts, axis=0, dtype=np.int32),
+        column_starts,
+        axis=1,
+    )
+    # averaging the channels after shrinking, it's slow on the full crop
+    if blocks.ndim == 3:
+        blocks = blocks.mean(axis=2)
+    # blocks are uneven by a pixel here and there, mean gray levels keep
+    # HASH_MARGIN the same for every block
+    row_heights = np.diff(np.append(row_starts, height))
+    column_widths = np.diff(np.append(column_starts, width))
+    blocks = blocks / np.outer(row_heights, column_widths)
+    bits = (blocks[:, 1:] > blocks[:, :-1] + HASH_MARGIN).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hash_distance(first: int, second: int) -> int:
+    return bin(first ^ second).count("1")
+
+
+def _gray(crop: NDArray) -> NDArray:
+    if crop.ndim == 3:
+        return (crop.sum(axis=2, dtype=np.uint16) // crop.shape[2]).astype(np.uint8)
+    return crop.astype(np.uint8)
+
+
+def same_crop(first: NDArray, second: NDArray) -> bool:
+    """
+    Whether two gray crops show the same thing: at most
+    MAX_DIFFERING_PIXELS pixels further apart than PIXEL_TOLERANCE.
+    """
+    if first.shape != second.shape:
+        return False
+    differing = np.abs(first.astype(np.int16) - second) > PIXEL_TOLERANCE
+    return int(np.count_nonzero(differing)) <= MAX_DIFFERING_PIXELS
+
+
+class OCRScheduler:
+    """
+    The in-flight jobs and the cache are both keyed by job, each job
+    remembering its crop's hash and gray levels. A lookup accepts a job
+    whose hash is within max_distance bits and whose crop is the same.
+    """
+
+    def __init__(
+        self,
+        ocr: Callable[[NDArray], OCRSongTitles],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        max_distance: int = DEFAULT_MAX_DISTANCE,
+    ):
+        self._ocr = ocr
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ocr"
+        )
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self.max_distance = max_distance
+        self._cache: "OrderedDict[int, OCRSongTitles]" = OrderedDict()
+        # oldest first, so the stalest job is the first one cancelled
+        self._in_flight: "OrderedDict[int, Future]" = OrderedDict()
+        # how many callers were handed each in-flight job and still want it
+        self._holders: Dict[int, int] = {}
+        # hash and gray crop of every job in flight or cached
+        self._crops: Dict[int, Tuple[int, NDArray]] = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "submitted": 0,
+            "cache_hits": 0,
+            "coalesced": 0,
+            "ocr_calls": 0,
+            "cancelled": 0,
+        }
+
+    def _find(
+        self, table: Mapping[int, Any], crop_hash: int, gray: NDArray
+    ) -> Optional[int]:
+        for job in table:
+            job_hash, job_gray = self._crops[job]
+            if hash_distance(job_hash, crop_hash) <= self.max_distance and same_crop(
+                job_gray, gray
+            ):
+                return job
+        return None
+
+    def submit(self, crop: NDArray) -> "Future[OCRSongTitles]":
+        crop_hash = difference_hash(crop)
+        gray = _gray(crop)
+        with self._lock:
+            self.stats["submitted"] += 1
+            cached_job = self._find(self._cache, crop_hash, gray)
+            if cached_job is not None:
+                self.stats["cache_hits"] += 1
+                self._cache.move_to_end(cached_job)
+                cached: "Future[OCRSongTitles]" = Future()
+                cached.set_result(self._cache[cached_job])
+                return cached
+            in_flight_job = self._find(self._in_flight, crop_hash, gray)
+            if in_flight_job is not None:
+                self.stats["coalesced"] += 1
+                self._holders[in_flight_job] += 1
+                return self._in_flight[in_flight_job]
+            # the crop may be a view into a frame that is about to be reused
+            future = self._executor.submit(self._run_ocr, crop.copy())
+            job = next(self._job_ids)
+            self._in_flight[job] = future
+            self._holders[job] = 1
+            self._crops[job] = (crop_hash, gray)
+            stale = self._stale_jobs()
+        future.add_done_callback(lambda done: self._finish(job, done))
+        # outside the lock, cancelling runs _finish straight away
+        self._cancel(stale)
+        return future
+
+    def _run_ocr(self, crop: NDArray) -> OCRSongTitles:
+        with self._lock:
+            self.stats["ocr_calls"] += 1
+        return self._ocr(crop)
+
+    def _stale_jobs(self) -> List[Future]:
+        pending = [
+            future
+            for future in self._in_flight.values()
+            if not future.running() and not future.done()
+        ]
+        return pending[: max(0, len(pending) - self.max_pending)]
+
+    def _cancel(self, futures: List[Future]) -> int:
+        cancelled = sum(1 for future in futures if future.cancel())
+        with self._lock:
+            self.stats["cancelled"] += cancelled
+        return cancelled
+
+    def _finish(self, job: int, future: Future):
+        with self._lock:
+            del self._in_flight[job]
+            del self._holders[job]
+            if future.cancelled() or future.exception() is not None:
+                del self._crops[job]
+                return
+            self._cache[job] = future.result()
+            while len(self._cache) > self.cache_size:
+                evicted, _ = self._cache.popitem(last=False)
+                del self._crops[evicted]
+
+    def _release(self, future: Future) -> bool:
+        """
+        Drops one caller's interest in an in-flight job. True if nobody
+        else was handed it, so it can be cancelled.
+        """
+        with self._lock:
+            for job, in_flight in self._in_flight.items():
+                if in_flight is future:
+                    self._holders[job] -= 1
+                    return self._holders[job] <= 0
+        return False
+
+    def submit_for_state(
+        self, state: VideoProcessingState, crop: NDArray
+    ) -> "Future[OCRSongTitles]":
+        """
+        submit(), keeping the future in state. A state holds one
+        interest in its job however many frames of the same title it
+        submits.
+        """
+        previous = state.ocr_song_future
+        future = self.submit(crop)
+        if previous is not None:
+            # moving on to another title doesn't cancel the old job, its
+            # result is still cached for when the title comes back
+            self._release(previous)
+        state.ocr_song_future = future
+        return future
+
+    def reset_state(self, state: VideoProcessingState):
+        """
+        For when the state is thrown away (back at song select before
+        the score was written): its OCR job is cancelled if it hasn't
+        started and no other caller was handed the same job. Finished
+        results stay cached, they're still right for that crop.
+        """
+        future = state.ocr_song_future
+        state.ocr_song_future = None
+        if future is not None and self._release(future):
+            self._cancel([future])
+
+    def cancel_pending(self) -> int:
+        """
+        Cancels every job that hasn't started. Returns how many.
+        """
+        with self._lock:
+            futures = list(self._in_flight.values())
+        return self._cancel(futures)
+
+    def shutdown(self, wait: bool = True):
+        self.cancel_pending()
+        self._executor.shutdown(wait=wait)
+
+
+def _synthetic_title_crops(
+    titles: int, frames_per_title: int, height: int, width: int
+) -> List[NDArray]:
+    """
+    Each title held for frames_per_title frames with a little sensor
+    noise on every frame, like a song select screen being scrolled.
+    """
+    generator = np.random.default_rng(0)
+    crops = []
+    for _ in range(titles):
+        title = generator.integers(0, 256, (height, width, 3)).astype(np.int16)
+        for _ in range(frames_per_title):
+            noise = generator.integers(-3, 4, (height, width, 3))
+            crops.append(np.clip(title + noise, 0, 255).astype(np.uint8))
+    return crops
+
+
+# 5x7 bitmap glyphs, enough to render titles a letter apart
+_GLYPHS = {
+    "D": ["11110", "10001", "10001", "10001", "10001", "10001", "11110"],
+    "E": ["11111", "10000", "11110", "10000", "10000", "10000", "11111"],
+    "F": ["11111", "10000", "11110", "10000", "10000", "10000", "10000"],
+    "L": ["10000", "10000", "10000", "10000", "10000", "10000", "11111"],
+    "O": ["01110", "10001", "10001", "10001", "10001", "10001", "01110"],
+    "R": ["11110", "10001", "10001", "11110", "10100", "10010", "10001"],
+    "W": ["10001", "10001", "10001", "10101", "10101", "10101", "01010"],
+}
+
+
+def _render_title(
+    title: str, height: int, width: int, noise: int, seed: int, scale: int = 4
+) -> NDArray:
+    """
+    Light text on a dark background, like the song select title, with
+    up to noise gray levels of sensor noise.
+    """
+    crop = np.full((height, width, 3), 30, dtype=np.int16)
+    left = 10
+    for letter in title:
+        glyph = np.array([[bit == "1" for bit in row] for row in _GLYPHS[letter]])
+        glyph = np.kron(glyph, np.ones((scale, scale), dtype=bool))
+        crop[20 : 20 + glyph.shape[0], left : left + glyph.shape[1]][glyph] = 230
+        left += 6 * scale
+    generator = np.random.default_rng(seed)
+    crop += generator.integers(-noise, noise + 1, crop.shape, dtype=np.int16)
+    return np.clip(crop, 0, 255).astype(np.uint8)
+
+
+def _check_similar_titles():
+    """
+    FLOWER and FLOWED hash the same, FLOWED mustn't get FLOWER's
+    titles. Another noisy frame of FLOWER still should.
+    """
+    titles = ["FLOWER", "FLOWED"]
+    reads = iter(titles)
+
+    def reading_ocr(crop: NDArray) -> OCRSongTitles:
+        return OCRSongTitles(next(reads), "", "", "")
+
+    scheduler = OCRScheduler(reading_ocr, max_workers=1)
+    try:
+        crops = {
+            title: _render_title(title, 80, 400, noise=8, seed=seed)
+            for seed, title in enumerate(titles)
+        }
+        if difference_hash(crops["FLOWER"]) != difference_hash(crops["FLOWED"]):
+            log.warning("FLOWER and FLOWED no longer hash the same")
+        for title, crop in crops.items():
+            read = scheduler.submit(crop).result(timeout=10)
+            if read.en_title != title:
+                raise RuntimeError(f"{title} was read as {read.en_title}")
+        again = _render_title("FLOWER", 80, 400, noise=8, seed=len(titles))
+        if scheduler.submit(again).result(timeout=10).en_title != "FLOWER":
+            raise RuntimeError("another frame of FLOWER got the wrong titles")
+        if scheduler.stats["cache_hits"] != 1:
+            raise RuntimeError("another frame of FLOWER wasn't a cache hit")
+    finally:
+        scheduler.shutdown()
+
+
+def _check_shared_reset(crops: List[NDArray]):
+    """
+    Two states handed the same queued job: resetting one mustn't cancel
+    it for the other, resetting both does.
+    """
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_ocr(crop: NDArray) -> OCRSongTitles:
+        started.set()
+        release.wait()
+        return OCRSongTitles("", "", "", "")
+
+    scheduler = OCRScheduler(blocking_ocr, max_workers=1)
+    try:
+        # keeps the only worker busy, so the next job stays queued
+        scheduler.submit(crops[0])
+        started.wait()
+        first, second = VideoProcessingState(), VideoProcessingState()
+        shared = scheduler.submit_for_state(first, crops[-1])
+        scheduler.submit_for_state(first, crops[-1])
+        if scheduler.submit_for_state(second, crops[-1]) is not shared:
+            raise RuntimeError("the same crop wasn't coalesced")
+        scheduler.reset_state(first)
+        if shared.cancelled():
+            raise RuntimeError("resetting one state cancelled another state's OCR")
+        scheduler.reset_state(second)
+        if not shared.cancelled():
+            raise RuntimeError("an OCR job nobody wants anymore wasn't cancelled")
+    finally:
+        release.set()
+        scheduler.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--titles", type=int, default=20)
+    parser.add_argument("--frames-per-title", type=int, default=30)
+    parser.add_argument("--revisits", type=int, default=2, help="passes over titles")
+    parser.add_argument("--ocr-ms", type=float, default=40.0)
+    parser.add_argument("--fps", type=float, default=240.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    crops = _synthetic_title_crops(args.titles, args.frames_per_title, 80, 400)
+    _check_similar_titles()
+    _check_shared_reset(crops)
+
+    def fake_ocr(crop: NDArray) -> OCRSongTitles:
+        time.sleep(args.ocr_ms / 1000)
+        return OCRSongTitles(str(int(crop.sum())), "", "", "")
+
+    scheduler = OCRScheduler(fake_ocr)
+    state = VideoProcessingState()
+    futures = []
+    started = time.perf_counter()
+    for _ in range(args.revisits):
+        for crop in crops:
+            futures.append(scheduler.submit_for_state(state, crop))
+            time.sleep(1 / args.fps)
+    answered = sum(1 for future in futures if not future.cancelled())
+    for future in futures:
+        if not future.cancelled():
+            future.result()
+    elapsed = time.perf_counter() - started
+    scheduler.shutdown()
+    frames = len(crops) * args.revisits
+    print(f"{frames} title crops ({args.titles} titles) in {elapsed:.2f}s")
+    print(f"{answered} answered, the rest were cancelled as stale")
+    print(
+        f"without the scheduler: {frames} OCR calls, {frames * args.ocr_ms / 1000:.1f}s"
+    )
+    for name, count in scheduler.stats.items():
+        print(f"  {name:12s} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Reads the song catalog from what is already in .textage-metadata
+(or, with a date, from the download history) without going near
+textage. Meant for short lived tools: neither importing this nor
+loading the catalog imports requests or numpy, which used to be most of
+the startup time.
+
+    python3 offline_catalog.py [--date 2024-01-31] [--lazy] [textage id ...]
+
+check_import_time.py keeps it that way.
+"""
+
+import sys
+import logging
+import argparse
+from datetime import date, datetime
+from typing import Dict, Mapping, Optional, Union
+
+from lazy_catalog import get_lazy_song_metadata
+from local_dataclasses import SongMetadata
+from download_textage_tables import (
+    get_all_song_metadata,
+    get_historical_song_metadata,
+)
+
+log = logging.getLogger(__name__)
+
+
+def load_offline_song_metadata(
+    when: Optional[Union[date, datetime]] = None,
+) -> Dict[str, SongMetadata]:
+    """
+    get_all_song_metadata(download=False), or the catalog as of `when`
+    from the download history.
+    """
+    if when is not None:
+        return get_historical_song_metadata(when)
+    return get_all_song_metadata(download=False)
+
+
+def load_offline_lazy_song_metadata() -> Mapping[str, SongMetadata]:
+    """
+    A LazySongCatalog over the cached files, for looking up a few ids.
+    """
+    return get_lazy_song_metadata(download=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "textage_ids", nargs="*", help="songs to print, all of them if none are given"
+    )
+    parser.add_argument(
+        "--date",
+        type=date.fromisoformat,
+        default=None,
+        help="YYYY-MM-DD, the catalog as of this date from the download history",
+    )
+    parser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="only build the songs asked for (ignored with --date)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    songs: Mapping[str, SongMetadata]
+    if args.lazy and args.date is None:
+        songs = load_offline_lazy_song_metadata()
+    else:
+        songs = load_offline_song_metadata(args.date)
+    textage_ids = args.textage_ids or sorted(songs)
+    missing = [textage_id for textage_id in textage_ids if textage_id not in songs]
+    for textage_id in textage_ids:
+        if textage_id in songs:
+            print(songs[textage_id].to_dict())
+    if missing:
+        log.error(f"not in the cached catalog: {missing}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""
+A differential harness for the textage javascript converters in
+download_textage_tables (TEXTAGE_JAVASCRIPT_PARSERS and the get_bpm
+trailing parser), so a faster parser can be swapped in without
+changing a single parsed table.
+
+The corpus is every revision of each file we have: the cached copies
+in .textage-metadata, every version in .textage-metadata/history, and
+a generated corpus (generate_textage_corpus) so there's always
+something to run. The fuzzer then makes format-valid variants of each
+file by mutating rows the way textage's files vary: html and
+.fontcolor() in titles, hex levels and //comments in actbl, single
+quoted bpm strings, fall-through get_bpm cases, comments, blank lines
+and indentation.
+
+A candidate is a module with TEXTAGE_JAVASCRIPT_PARSERS and/or
+TEXTAGE_JAVASCRIPT_TRAILING_PARSERS laid out like the ones in
+download_textage_tables; files it leaves out use the current parsers.
+Every corpus file and mutant is parsed by both, and the parsed tables
+have to be equal:
+
+    python3 parser_fuzz.py --candidate faster_parsers --mutants 500
+
+Exits 1 on any difference, after writing the differing inputs to
+--failures. Otherwise times both over every file and mutant they
+parsed, alternating between them in each of --repeats repeats, and
+prints the median lines/s and MB/s of each with its spread, and the
+median candidate/current ratio with its range.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import importlib
+import statistics
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from compressed_cache import cache_file_exists, open_cache_file
+from local_dataclasses import CorpusFile
+from generate_textage_corpus import generate_textage_corpus
+from textage_history import read_history_manifest, read_history_object
+from download_textage_tables import (
+    TEXTAGE_JAVASCRIPT_FILES,
+    TEXTAGE_JAVASCRIPT_PARSERS,
+    TEXTAGE_JAVASCRIPT_TRAILING_PARSERS,
+    _convert_javascript_lines,
+    _get_textage_history_path,
+    _get_textage_metadata_path,
+)
+
+log = logging.getLogger(__name__)
+
+LineParsers = Dict[str, Tuple[str, str, Callable[[str], str]]]
+TrailingParsers = Dict[str, Tuple[str, Callable[[Iterable[str]], Any]]]
+ParsedFile = Tuple[Any, Any]
+
+DEFAULT_MUTANTS = 200
+DEFAULT_REPEATS = 7
+MAX_MUTATIONS = 4
+
+
+def collect_corpus(
+    textage_metadata_path: Path, generated_scale: float = 0.1
+) -> List[CorpusFile]:
+    """
+    The cached files, every distinct revision in the download history,
+    and (unless generated_scale is 0) a generated corpus.
+    """
+    corpus = []
+    for javascript_file in TEXTAGE_JAVASCRIPT_FILES:
+        cached_file = textage_metadata_path / Path(javascript_file)
+        if cache_file_exists(cached_file):
+            with open_cache_file(cached_file) as reader:
+                corpus.append(CorpusFile(javascript_file, "cache", reader.read()))
+    history_path = _get_textage_history_path(textage_metadata_path)
+    seen = set()
+    for entry in read_history_manifest(history_path):
+        if (
+            entry.sha256 in seen
+            or entry.javascript_file not in TEXTAGE_JAVASCRIPT_FILES
+        ):
+            continue
+        seen.add(entry.sha256)
+        corpus.append(
+            CorpusFile(
+                entry.javascript_file,
+                f"history {entry.sha256[:12]} ({entry.last_modified})",
+                read_history_object(history_path, entry.sha256),
+            )
+        )
+    if generated_scale > 0:
+        for javascript_file, text in generate_textage_corpus(generated_scale).items():
+            corpus.append(
+                CorpusFile(javascript_file, f"generated {generated_scale}x", text)
+            )
+    return corpus
+
+
+def parse_javascript_text(
+    javascript_file: str,
+    text: str,
+    line_parsers: LineParsers = TEXTAGE_JAVASCRIPT_PARSERS,
+    trailing_parsers: TrailingParsers = TEXTAGE_JAVASCRIPT_TRAILING_PARSERS,
+) -> ParsedFile:
+    """
+    What _convert_javascript_and_write_to_json would write for text,
+    decoded: the parsed table, and the trailing parser's output (None
+    for files without one).
+    """
+    start_regex, end_regex, line_parser = line_parsers[javascript_file]
+    # read like open_cache_file reads, universal newlines
+    reader = io.StringIO(text, newline=None)
+    converted: List[str] = []
+    _convert_javascript_lines(
+        reader, start_regex, end_regex, line_parser, converted.append
+    )
+    table = json.loads("".join(converted))
+    trailing = None
+    if javascript_file in trailing_parsers:
+        _, trailing_parser = trailing_parsers[javascript_file]
+        trailing = json.loads(json.dumps(trailing_parser(reader)))
+    return table, trailing
+
+
+def _quoted_cells(row: str) -> List[Tuple[int, int]]:
+    """
+    (start, end) of each double quoted cell in a row, quotes included.
+    """
+    cells = []
+    start = row.find('"')
+    while start != -1:
+        end = row.find('"', start + 1)
+        if end == -1:
+            break
+        cells.append((start, end + 1))
+        start = row.find('"', end + 1)
+    return cells
+
+
+def _decorate_title(row: str, rng: random.Random) -> str:
+    cells = _quoted_cells(row)
+    if not cells:
+        return row
+    start, end = rng.choice(cells)
+    inner = row[start + 1 : end - 1]
+    decorated = rng.choice(
+        [
+            f'"<b>{inner}<\\/b>"',
+            f"\"<span style='color:#{rng.randrange(0x1000000):06x}'>{inner}<\\/span>\"",
+            f"\"<div class='small'>{inner}<br><\\/div>\"",
+            f"\"{inner}\".fontcolor('{rng.choice(['red', 'blue', '#ff8800'])}')",
+            f'"{inner}<br>"',
+            f'"\t{inner}"',
+        ]
+    )
+    return row[:start] + decorated + row[end:]
+
+
+def _hex_level(row: str, rng: random.Random) -> str:
+    head, bracket, cells = row.partition("[")
+    if not bracket:
+        return row
+    values = cells.split(",")
+    numeric = [
+        index for index in range(2, len(values), 2) if values[index].strip().isdigit()
+    ]
+    if not numeric:
+        return row
+    index = rng.choice(numeric)
+    values[index] = rng.choice("0123456789ABCDEF")
+    return head + bracket + ",".join(values)
+
+
+def _act_comment(row: str, rng: random.Random) -> str:
+    if "//" in row:
+        return row
+    return f"{row}//{rng.randrange(1000)}"
+
+
+def _act_span(row: str, rng: random.Random) -> str:
+    closing = row.rfind("]")
+    if closing == -1 or "<span" in row:
+        return row
+    return row[:closing] + ",\"<span style='color:red'>†<\\/span>\"" + row[closing:]
+
+
+def _single_quote_bpm(row: str, rng: random.Random) -> str:
+    cells = _quoted_cells(row)
+    if not cells:
+        return row
+    start, end = cells[-1]
+    return row[:start] + "'" + row[start + 1 : end - 1] + "'" + row[end:]
+
+
+def _bpm_range(row: str, rng: random.Random) -> str:
+    cells = _quoted_cells(row)
+    if not cells:
+        return row
+    start, end = cells[-1]
+    low = rng.randint(40, 150)
+    return row[:start] + f'"{low}〜{low + rng.randint(1, 100)}"' + row[end:]
+
+
+def _indent(row: str, rng: random.Random) -> str:
+    return rng.choice(["\t", "  ", " \t "]) + row + rng.choice(["", " ", "\t"])
+
+
+def _space_case(row: str, rng: random.Random) -> str:
+    row = row.replace('case "', rng.choice(['case "', 'case  "', ' case "']))
+    row = row.replace('":', rng.choice(['":', '" :', '":  ']))
+    row = row.replace("if(", rng.choice(["if(", "if (", "if  ("]))
+    return row.replace(")return", rng.choice([")return", ") return", ")  return"]))
+
+
+def _split_break(row: str, rng: random.Random) -> str:
+    # a break on its own line after the ifs
+    if not row.rstrip().endswith("break;"):
+        return row
+    indent = row[: len(row) - len(row.lstrip())]
+    return row.rstrip()[: -len("break;")] + f"\n{indent}break;"
+
+
+# javascript file -> row mutations that keep the file in textage's format
+ROW_MUTATIONS: Dict[str, List[Callable[[str, random.Random], str]]] = {
+    "titletbl.js": [_decorate_title, _indent],
+    "actbl.js": [_hex_level, _act_comment, _act_span, _indent],
+    "datatbl.js": [_single_quote_bpm, _bpm_range, _indent],
+    "scrlist.js": [_indent],
+}
+CASE_MUTATIONS: List[Callable[[str, random.Random], str]] = [
+    _space_case,
+    _split_break,
+    _indent,
+]
+
+
+def _is_table_row(line: str) -> bool:
+    return line.lstrip().startswith("'") and ":[" in line
+
+
+def _is_case(line: str) -> bool:
+    return line.lstrip().startswith("case ")
+
+
+def mutate(corpus_file: CorpusFile, rng: random.Random) -> CorpusFile:
+    """
+    A variant of corpus_file with 1 to MAX_MUTATIONS mutations: row
+    mutations, get_bpm case mutations, fall-through cases, inserted
+    comments and blank lines, and rows copied under a new id.
+    """
+    lines = corpus_file.text.split("\n")
+    rows = [number for number, line in enumerate(lines) if _is_table_row(line)]
+    cases = [number for number, line in enumerate(lines) if _is_case(line)]
+    applied = []
+    for _ in range(rng.randint(1, MAX_MUTATIONS)):
+        kind = rng.choice(["row", "row", "case", "fall through", "comment", "copy"])
+        if kind == "row" and rows:
+            number = rng.choice(rows)
+            mutation = rng.choice(ROW_MUTATIONS[corpus_file.javascript_file])
+            lines[number] = mutation(lines[number], rng)
+            applied.append(mutation.__name__.lstrip("_"))
+        elif kind == "case" and cases:
+            number = rng.choice(cases)
+            mutation = rng.choice(CASE_MUTATIONS)
+            lines[number] = mutation(lines[number], rng)
+            applied.append(mutation.__name__.lstrip("_"))
+        elif kind == "fall through" and cases:
+            # another id grouped in front of an existing case
+            number = rng.choice(cases)
+            indent = lines[number][: len(lines[number]) - len(lines[number].lstrip())]
+            lines[number] = (
+                f'{indent}case "fuzz{rng.randrange(10**6):06d}":\n' + lines[number]
+            )
+            applied.append("fall_through")
+        elif kind == "comment" and rows:
+            number = rng.choice(rows)
+            lines[number] = rng.choice(["// fuzz\n", "\n", "  \t\n"]) + lines[number]
+            applied.append("comment")
+        elif kind == "copy" and rows:
+            number = rng.choice(rows)
+            line = lines[number]
+            if not line.rstrip().endswith(",") and "//" not in line:
+                continue
+            quote = line.index("'")
+            end = line.index("'", quote + 1)
+            copied = line[: quote + 1] + f"fuzz{rng.randrange(10**6):06d}" + line[end:]
+            lines[number] = f"{line}\n{copied}"
+            applied.append("copy")
+    return CorpusFile(
+        corpus_file.javascript_file,
+        f"{corpus_file.label} + {', '.join(applied) or 'nothing'}",
+        "\n".join(lines),
+    )
+
+
+def load_candidate(module_name: str) -> Tuple[LineParsers, TrailingParsers]:
+    """
+    The current parsers with whatever module_name overrides.
+    """
+    module = importlib.import_module(module_name)
+    line_parsers = {
+        **TEXTAGE_JAVASCRIPT_PARSERS,
+        **getattr(module, "TEXTAGE_JAVASCRIPT_PARSERS", {}),
+    }
+    trailing_parsers = {
+        **TEXTAGE_JAVASCRIPT_TRAILING_PARSERS,
+        **getattr(module, "TEXTAGE_JAVASCRIPT_TRAILING_PARSERS", {}),
+    }
+    return line_parsers, trailing_parsers
+
+
+def _first_difference(expected: Any, found: Any, path: str) -> str:
+    if isinstance(expected, dict) and isinstance(found, dict):
+        for key in sorted(set(expected) | set(found)):
+            if expected.get(key) != found.get(key):
+                return _first_difference(
+                    expected.get(key), found.get(key), f"{path}[{key!r}]"
+                )
+    return f"{path}: expected {expected!r}, got {found!r}"
+
+
+def compare_parsers(
+    corpus: Iterable[CorpusFile],
+    line_parsers: LineParsers,
+    trailing_parsers: TrailingParsers,
+) -> Tuple[List[CorpusFile], int, List[Tuple[CorpusFile, str]]]:
+    """
+    (files compared, files the current parsers reject, differences).
+    Files the current parsers can't parse aren't valid textage files,
+    so they're skipped rather than counted against the candidate.
+    """
+    compared = []
+    rejected = 0
+    differences = []
+    for corpus_file in corpus:
+        try:
+            expected = parse_javascript_text(
+                corpus_file.javascript_file, corpus_file.text
+            )
+        except (ValueError, RuntimeError, KeyError, IndexError):
+            rejected += 1
+            continue
+        compared.append(corpus_file)
+        try:
+            found = parse_javascript_text(
+                corpus_file.javascript_file,
+                corpus_file.text,
+                line_parsers,
+                trailing_parsers,
+            )
+        except Exception as error:
+            differences.append((corpus_file, f"raised {error!r}"))
+            continue
+        for name, expected_part, found_part in zip(
+            ("table", "trailing parser"), expected, found
+        ):
+            if found_part != expected_part:
+                differences.append(
+                    (corpus_file, _first_difference(expected_part, found_part, name))
+                )
+                break
+    return compared, rejected, differences
+
+
+def measure_throughput(
+    corpus: List[CorpusFile],
+    parser_sets: Dict[str, Tuple[LineParsers, TrailingParsers]],
+    repeats: int = DEFAULT_REPEATS,
+) -> Dict[str, Tuple[int, float, Dict[str, List[float]]]]:
+    """
+    javascript file -> (lines, MB, parser set name -> seconds of each
+    repeat). Every repeat times each parser set over the same files,
+    in an order flipped every repeat, so a change in machine load
+    lands on all of them rather than on whichever ran last.
+    """
+    throughput = {}
+    for javascript_file in TEXTAGE_JAVASCRIPT_FILES:
+        files = [
+            corpus_file
+            for corpus_file in corpus
+            if corpus_file.javascript_file == javascript_file
+        ]
+        if not files:
+            continue
+        lines = sum(corpus_file.text.count("\n") + 1 for corpus_file in files)
+        megabytes = (
+            sum(len(corpus_file.text.encode("utf-8")) for corpus_file in files) / 1e6
+        )
+        seconds: Dict[str, List[float]] = {name: [] for name in parser_sets}
+        names = list(parser_sets)
+        for _ in range(repeats):
+            for name in names:
+                line_parsers, trailing_parsers = parser_sets[name]
+                started = time.perf_counter()
+                for corpus_file in files:
+                    parse_javascript_text(
+                        javascript_file,
+                        corpus_file.text,
+                        line_parsers,
+                        trailing_parsers,
+                    )
+                seconds[name].append(time.perf_counter() - started)
+            names.reverse()
+        throughput[javascript_file] = (lines, megabytes, seconds)
+    return throughput
+
+
+def _median_and_spread(values: List[float]) -> Tuple[float, float]:
+    """
+    The median, and half the range as a share of it.
+    """
+    median = statistics.median(values)
+    return median, (max(values) - min(values)) / 2 / median
+
+
+def _write_failures(failures_path: Path, differences: List[Tuple[CorpusFile, str]]):
+    os.makedirs(failures_path, exist_ok=True)
+    for number, (corpus_file, difference) in enumerate(differences):
+        failure_file = failures_path / Path(
+            f"{number:04d}_{corpus_file.javascript_file}"
+        )
+        with open(failure_file, "wt") as writer:
+            writer.write(corpus_file.text)
+        with open(f"{failure_file}.txt", "wt") as writer:
+            writer.write(f"{corpus_file.label}\n{difference}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--candidate", default=None, help="module with parsers")
+    parser.add_argument("--mutants", type=int, default=DEFAULT_MUTANTS, help="per file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--generated-scale", type=float, default=0.1)
+    parser.add_argument("--failures", type=Path, default=Path("parser-fuzz-failures"))
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    corpus = collect_corpus(_get_textage_metadata_path(), args.generated_scale)
+    if args.candidate is None:
+        line_parsers, trailing_parsers = (
+            TEXTAGE_JAVASCRIPT_PARSERS,
+            TEXTAGE_JAVASCRIPT_TRAILING_PARSERS,
+        )
+        candidate_name = "current"
+    else:
+        line_parsers, trailing_parsers = load_candidate(args.candidate)
+        candidate_name = args.candidate
+    rng = random.Random(args.seed)
+    mutants = [
+        mutate(corpus_file, rng) for corpus_file in corpus for _ in range(args.mutants)
+    ]
+    compared, rejected, differences = compare_parsers(
+        corpus + mutants, line_parsers, trailing_parsers
+    )
+    print(
+        f"{len(corpus)} corpus files and {len(mutants)} mutants: {len(compared)} compared, "
+        f"{rejected} rejected by the current parsers, {len(differences)} differ"
+    )
+    if differences:
+        _write_failures(args.failures, differences)
+        for corpus_file, difference in differences[:10]:
+            print(f"{corpus_file.javascript_file} {corpus_file.label}: {difference}")
+        print(f"wrote {len(differences)} differing inputs to {args.failures}")
+        sys.exit(1)
+    parser_sets = {
+        "current": (TEXTAGE_JAVASCRIPT_PARSERS, TEXTAGE_JAVASCRIPT_TRAILING_PARSERS)
+    }
+    parser_sets[candidate_name] = (line_parsers, trailing_parsers)
+    print(
+        f"median lines/s and MB/s over the {len(compared)} compared files, "
+        f"+/- half the range of {args.repeats} repeats"
+    )
+    throughput = measure_throughput(compared, parser_sets, args.repeats)
+    for javascript_file, (lines, megabytes, seconds) in throughput.items():
+        print(f"  {javascript_file}")
+        for name, runs in seconds.items():
+            median, spread = _median_and_spread(runs)
+            print(
+                f"    {name:16s} {lines / median:10.0f} lines/s "
+                f"{megabytes / median:6.1f}MB/s +/-{spread:.0%}"
+            )
+        if candidate_name != "current":
+            # each repeat timed both back to back, so their ratio is paired
+            ratios = [
+                current / candidate
+                for current, candidate in zip(
+                    seconds["current"], seconds[candidate_name]
+                )
+            ]
+            print(
+                f"    {candidate_name} is {statistics.median(ratios):.2f}x current "
+                f"({min(ratios):.2f}x to {max(ratios):.2f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+import random
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from catalog_statistics import refresh_catalog_statistics
+from local_dataclasses import (
+    CatalogStatistics,
+    PicklableMappingProxies,
+    SongMetadata,
+    SongReference,
+)
+from download_textage_tables import (
+    _get_textage_metadata_path,
+    build_song_reference,
+    get_all_song_metadata,
+    get_textage_javascript_digest,
+    download_textage_javascript_files,
+)
+
+log = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_SECONDS = 6 * 60 * 60
+DEFAULT_JITTER_RATIO = 0.1
+DEFAULT_BACKOFF_SECONDS = 60
+DEFAULT_MAX_BACKOFF_SECONDS = 60 * 60
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot(PicklableMappingProxies):
+    """
+    A fully built catalog. Snapshots are never modified after they
+    are published, a refresh builds a new one and swaps it in. songs
+    is a read-only view, since every reader thread shares it.
+    """
+
+    songs: Mapping[str, SongMetadata]
+    song_reference: SongReference
+    statistics: CatalogStatistics
+    digest: str
+    built_at: datetime
+    version: int
+
+
+def build_catalog_snapshot(
+    previous: Optional[CatalogSnapshot] = None,
+    version: Optional[int] = None,
+    previous_statistics: Optional[CatalogStatistics] = None,
+    previous_songs: Optional[Mapping[str, SongMetadata]] = None,
+) -> CatalogSnapshot:
+    """
+    Builds a snapshot from the files currently in .textage-metadata.
+    Returns previous unchanged if the files are the ones it was built from.
+    Statistics are updated from previous's for the songs that changed.
+    version is the catalog version (of the snapshot and its
+    SongReference), previous.version + 1 or 1 by default.
+
+    Callers that can't cheaply send previous (to a process pool) can
+    send just previous_statistics and previous_songs for the update.
+    """
+    digest = get_textage_javascript_digest()
+    if previous is not None and previous.digest == digest:
+        log.info(f"textage data unchanged ({digest[:12]}), keeping catalog")
+        return previous
+    songs = get_all_song_metadata(download=False)
+    if version is None:
+        version = 1 if previous is None else previous.version + 1
+    if previous is not None:
+        previous_statistics, previous_songs = previous.statistics, previous.songs
+    statistics = refresh_catalog_statistics(
+        _get_textage_metadata_path(),
+        songs,
+        digest,
+        previous_statistics=previous_statistics,
+        previous_songs=previous_songs,
+    )
+    return CatalogSnapshot(
+        songs=MappingProxyType(songs),
+        song_reference=build_song_reference(songs, version),
+        statistics=statistics,
+        digest=digest,
+        built_at=datetime.now(tz=timezone.utc),
+        version=version,
+    )
+
+
+class CatalogRefresher:
+    """
+    Keeps the latest CatalogSnapshot in memory and revalidates the
+    textage files on a jittered schedule.
+
+    Readers call .snapshot and get whatever was last published.
+    Publishing is a single attribute assignment, so readers never
+    take a lock and never see a half built catalog.
+    """
+
+    def __init__(
+        self,
+        refresh_seconds: float = DEFAULT_REFRESH_SECONDS,
+        jitter_ratio: float = DEFAULT_JITTER_RATIO,
+        backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+        max_backoff_seconds: float = DEFAULT_MAX_BACKOFF_SECONDS,
+        download: bool = True,
+    ):
+        self.download = download
+        self.refresh_seconds = refresh_seconds
+        self.jitter_ratio = jitter_ratio
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.consecutive_failures = 0
+        self._snapshot: Optional[CatalogSnapshot] = None
+        # only serializes refreshes against each other, never readers
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._published_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        return self._snapshot
+
+    def wait_for_snapshot(self, timeout: Optional[float] = None) -> CatalogSnapshot:
+        """
+        Blocks until the first catalog has been published.
+        """
+        if not self._published_event.wait(timeout):
+            raise TimeoutError("no catalog has been published yet")
+        snapshot = self._snapshot
+        assert snapshot is not None
+        return snapshot
+
+    def refresh(self) -> bool:
+        """
+        Revalidates the textage files and publishes a new snapshot if
+        their contents changed. Returns True if a new snapshot was published.
+        """
+        with self._refresh_lock:
+            if self.download:
+                download_textage_javascript_files()
+            current = self._snapshot
+            snapshot = build_catalog_snapshot(current)
+            if snapshot is current:
+                return False
+            self._snapshot = snapshot
+            self._published_event.set()
+            log.info(
+                f"published catalog version {snapshot.version} "
+                f"({len(snapshot.songs)} songs, {snapshot.digest[:12]})"
+            )
+            return True
+
+    def _jittered(self, seconds: float) -> float:
+        jitter = seconds * self.jitter_ratio
+        return max(0.0, seconds + random.uniform(-jitter, jitter))
+
+    def next_delay(self) -> float:
+        """
+        The normal refresh interval, or an exponential backoff capped at
+        max_backoff_seconds while refreshes keep failing.
+        """
+        if self.consecutive_failures == 0:
+            return self._jittered(self.refresh_seconds)
+        backoff = self.backoff_seconds * 2 ** (self.consecutive_failures - 1)
+        return self._jittered(min(backoff, self.max_backoff_seconds))
+
+    def run_forever(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+                self.consecutive_failures = 0
+            except Exception:
+                self.consecutive_failures += 1
+                log.exception(
+                    f"catalog refresh failed ({self.consecutive_failures} in a row)"
+                )
+            delay = self.next_delay()
+            log.info(f"next catalog refresh in {delay:.0f}s")
+            self._stop_event.wait(delay)
+
+    def start(self) -> threading.Thread:
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self.run_forever, name="catalog-refresher", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep the textage catalog up to date in a long running process"
+    )
+    parser.add_argument("--refresh-hours", type=float, default=6.0)
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER_RATIO)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    refresher = CatalogRefresher(
+        refresh_seconds=args.refresh_hours * 60 * 60, jitter_ratio=args.jitter
+    )
+    try:
+        refresher.run_forever()
+    except KeyboardInterrupt:
+        refresher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+An append-only log of Score records, stored by column in a NumPy
+structured dtype (SCORE_DTYPE) instead of one object per play:
+
+    log = ScoreLog(Path("scores"))
+    log.append("_aa_cs", Difficulty.SP_ANOTHER, score)
+    records = log.select(difficulty=Difficulty.SP_ANOTHER, since=last_week)
+    ex_scores = 2 * records["fgreat"].astype(int) + records["great"]
+
+The log is a directory of segments, plain files of packed records that
+are read memory-mapped:
+- active.rows takes appends. Each append is written in one write and
+  fsynced before it returns, and a torn record left by a crash is cut
+  off the next time the log is opened.
+- Once active.rows holds segment_rows records it is renamed to a
+  sealed segment, segment_<first>-<last>.rows.
+- compact() merges every segment into one, sorted by timestamp. The
+  merged segment is named for the range it covers, so a segment left
+  behind by an interrupted compaction is recognised and removed.
+
+Grades and clear types are stored as small ints: the index into GRADES
+and the ClearType value.
+
+Run as a script, this fills a log with random plays and compares an
+EX score by difficulty scan with loading the same plays as Scores.
+"""
+
+import os
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from local_dataclasses import ClearType, Difficulty, Score
+
+log = logging.getLogger(__name__)
+
+GRADES = ("X", "F", "E", "D", "C", "B", "A", "AA", "AAA")
+SCORE_FIELDS = ("fgreat", "great", "good", "bad", "poor", "fast", "slow")
+TEXTAGE_ID_BYTES = 16
+
+SCORE_DTYPE = np.dtype(
+    [
+        ("textage_id", f"S{TEXTAGE_ID_BYTES}"),
+        ("difficulty", np.int8),
+        # unix time in milliseconds
+        ("timestamp", np.int64),
+        *[(score_field, np.uint16) for score_field in SCORE_FIELDS],
+        ("grade", np.uint8),
+        ("clear_type", np.uint8),
+    ]
+)
+
+DEFAULT_SEGMENT_ROWS = 65536
+ACTIVE_SEGMENT = "active.rows"
+SCHEMA_FILE = "schema.json"
+SEGMENT_PATTERN = re.compile(r"segment_(\d+)-(\d+)\.rows")
+
+ScoreRow = Tuple[str, Union[Difficulty, str], Score, Optional[float]]
+
+
+def encode_scores(rows: Iterable[ScoreRow]) -> NDArray:
+    """
+    SCORE_DTYPE records for (textage id, difficulty, Score, unix time)
+    rows. The difficulty can be a Difficulty or its name, and a missing
+    time means now.
+    """
+    rows = list(rows)
+    records = np.zeros(len(rows), SCORE_DTYPE)
+    now = time.time()
+    for index, (textage_id, difficulty, score, timestamp) in enumerate(rows):
+        encoded_id = textage_id.encode("ascii")
+        if len(encoded_id) > TEXTAGE_ID_BYTES:
+            raise ValueError(f"textage id {textage_id} is too long to store")
+        if isinstance(difficulty, str):
+            difficulty = Difficulty[difficulty]
+        records[index] = (
+            encoded_id,
+            difficulty.value,
+            round((now if timestamp is None else timestamp) * 1000),
+            *[getattr(score, score_field) for score_field in SCORE_FIELDS],
+            GRADES.index(score.grade),
+            ClearType[score.clear_type].value,
+        )
+    return records
+
+
+def decode_score(record: np.void) -> Score:
+    """
+    One record back as a Score, for the odd lookup. Scans should stay
+    on the columns.
+    """
+    return Score(
+        **{score_field: int(record[score_field]) for score_field in SCORE_FIELDS},
+        grade=GRADES[int(record["grade"])],
+        clear_type=ClearType(int(record["clear_type"])).name,
+    )
+
+
+def _segment_name(first: int, last: int) -> str:
+    return f"segment_{first:06d}-{last:06d}.rows"
+
+
+def _fsync_directory(path: Path):
+    directory = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def _map_rows(segment_file: Path) -> NDArray:
+    rows = segment_file.stat().st_size // SCORE_DTYPE.itemsize
+    if rows == 0:
+        return np.zeros(0, SCORE_DTYPE)
+    return np.memmap(segment_file, SCORE_DTYPE, mode="r", shape=(rows,))
+
+
+class ScoreLog:
+    """
+    Meant for one writing process. Arrays handed out by segments(),
+    scan() and select() are read-only.
+    """
+
+    def __init__(self, path: Path, segment_rows: int = DEFAULT_SEGMENT_ROWS):
+        self.path = path
+        self.segment_rows = segment_rows
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._check_schema()
+        # (first, last) -> memmap, in segment order
+        self._sealed: Dict[Tuple[int, int], NDArray] = {}
+        self._open_sealed_segments()
+        self._active_file = self.path / Path(ACTIVE_SEGMENT)
+        self._recover_active_segment()
+
+    def _check_schema(self):
+        schema_file = self.path / Path(SCHEMA_FILE)
+        schema = json.loads(json.dumps(SCORE_DTYPE.descr))
+        if not schema_file.exists():
+            with open(schema_file, "wt") as writer:
+                json.dump(schema, writer)
+            return
+        with open(schema_file, "rt") as reader:
+            stored = json.load(reader)
+        if stored != schema:
+            raise ValueError(
+                f"{self.path} was written with a different record layout: {stored}"
+            )
+
+    def _open_sealed_segments(self):
+        ranges = []
+        for segment_file in self.path.glob("segment_*.rows"):
+            match = SEGMENT_PATTERN.fullmatch(segment_file.name)
+            if match is not None:
+                ranges.append((int(match.group(1)), int(match.group(2))))
+        for first, last in sorted(ranges):
+            covered = any(
+                other_first <= first
+                and last <= other_last
+                and (other_first, other_last) != (first, last)
+                for other_first, other_last in ranges
+            )
+            segment_file = self.path / Path(_segment_name(first, last))
+            if covered:
+                log.info(f"removing {segment_file.name}, it was already compacted")
+                segment_file.unlink()
+                continue
+            self._sealed[(first, last)] = _map_rows(segment_file)
+        for partial_file in self.path.glob("*.partial"):
+            partial_file.unlink()
+
+    def _recover_active_segment(self):
+        if not self._active_file.exists():
+            self._active_file.touch()
+            return
+        size = self._active_file.stat().st_size
+        torn = size % SCORE_DTYPE.itemsize
+        if torn:
+            log.warning(f"cutting a torn {torn} byte record off {self._active_file}")
+            os.truncate(self._active_file, size - torn)
+
+    def _next_segment_number(self) -> int:
+        return max((last for _, last in self._sealed), default=-1) + 1
+
+    @property
+    def active_rows(self) -> int:
+        return self._active_file.stat().st_size // SCORE_DTYPE.itemsize
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self._sealed.values()) + (
+            self.active_rows
+        )
+
+    def append_records(self, records: NDArray):
+        """
+        Appends SCORE_DTYPE records, durably: they're on disk when this
+        returns.
+        """
+        if records.dtype != SCORE_DTYPE:
+            raise TypeError(f"expected SCORE_DTYPE records, got {records.dtype}")
+        if len(records) == 0:
+            return
+        descriptor = os.open(self._active_file, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(descriptor, np.ascontiguousarray(records).tobytes())
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+        if self.active_rows >= self.segment_rows:
+            self.seal()
+
+    def append(
+        self,
+        textage_id: str,
+        difficulty: Union[Difficulty, str],
+        score: Score,
+        timestamp: Optional[float] = None,
+    ):
+        self.append_records(encode_scores([(textage_id, difficulty, score, timestamp)]))
+
+    def seal(self):
+        """
+        Turns active.rows into a sealed segment and starts a new one.
+        """
+        if self.active_rows == 0:
+            return
+        number = self._next_segment_number()
+        segment_file = self.path / Path(_segment_name(number, number))
+        os.replace(self._active_file, segment_file)
+        self._active_file.touch()
+        _fsync_directory(self.path)
+        self._sealed[(number, number)] = _map_rows(segment_file)
+
+    def segments(self) -> List[NDArray]:
+        """
+        Every segment, oldest first, memory-mapped. Nothing is read until
+        a column is used.
+        """
+        return [*self._sealed.values(), _map_rows(self._active_file)]
+
+    def scan(self, columns: Optional[Sequence[str]] = None) -> NDArray:
+        """
+        The whole log as one record array, or just the given columns.
+        """
+        segments = self.segments()
+        if columns is not None:
+            segments = [segment[list(columns)] for segment in segments]
+        return np.concatenate(segments)
+
+    def select(
+        self,
+        textage_ids: Optional[Iterable[str]] = None,
+        difficulty: Optional[Union[Difficulty, str]] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> NDArray:
+        """
+        The records matching every filter given, with one mask per
+        segment. since and until are unix times, until is exclusive.
+        """
+        if isinstance(difficulty, str):
+            difficulty = Difficulty[difficulty]
+        wanted_ids = None
+        if textage_ids is not None:
+            wanted_ids = np.array(
+                [textage_id.encode("ascii") for textage_id in textage_ids],
+                f"S{TEXTAGE_ID_BYTES}",
+            )
+        selected = []
+        for segment in self.segments():
+            mask = np.ones(len(segment), np.bool_)
+            if wanted_ids is not None:
+                mask &= np.isin(segment["textage_id"], wanted_ids)
+            if difficulty is not None:
+                mask &= segment["difficulty"] == difficulty.value
+            if since is not None:
+                mask &= segment["timestamp"] >= round(since * 1000)
+            if until is not None:
+                mask &= segment["timestamp"] < round(until * 1000)
+            selected.append(segment[mask])
+        return np.concatenate(selected)
+
+    def compact(self):
+        """
+        Rewrites every segment, active.rows included, as one sealed
+        segment sorted by timestamp. Plays with the same timestamp keep
+        the order they were appended in.
+        """
+        self.seal()
+        if len(self._sealed) < 2:
+            return
+        ranges = list(self._sealed)
+        first, last = ranges[0][0], ranges[-1][1]
+        records = self.scan()
+        records = records[np.argsort(records["timestamp"], kind="stable")]
+        segment_file = self.path / Path(_segment_name(first, last))
+        partial_file = segment_file.with_name(segment_file.name + ".partial")
+        with open(partial_file, "wb") as writer:
+            writer.write(records.tobytes())
+            writer.flush()
+            os.fsync(writer.fileno())
+        # the old segments are only removed once the merged one is in place,
+        # and a crash in between leaves them covered by its range
+        self._sealed.clear()
+        os.replace(partial_file, segment_file)
+        _fsync_directory(self.path)
+        for old_first, old_last in ranges:
+            if (old_first, old_last) != (first, last):
+                (self.path / Path(_segment_name(old_first, old_last))).unlink()
+        self._sealed[(first, last)] = _map_rows(segment_file)
+        log.info(f"compacted {len(ranges)} segments into {segment_file.name}")
+
+
+def _random_rows(plays: int, songs: int) -> List[ScoreRow]:
+    random.seed(0)
+    difficulties = [difficulty for difficulty in Difficulty if difficulty.value < 99]
+    started = time.time() - plays * 60
+    rows: List[ScoreRow] = []
+    for play in range(plays):
+        notes = random.randrange(500, 2500)
+        fgreat = random.randrange(notes // 2, notes)
+        great = random.randrange(0, notes - fgreat + 1)
+        score = Score(
+            fgreat,
+            great,
+            notes - fgreat - great,
+            0,
+            random.randrange(0, 50),
+            random.randrange(0, 200),
+            random.randrange(0, 200),
+            grade=random.choice(GRADES),
+            clear_type=random.choice([clear_type.name for clear_type in ClearType]),
+        )
+        rows.append(
+            (
+                f"song{random.randrange(songs)}",
+                random.choice(difficulties),
+                score,
+                started + play * 60,
+            )
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--plays", type=int, default=200000)
+    parser.add_argument("--songs", type=int, default=2000)
+    parser.add_argument("--segment-rows", type=int, default=DEFAULT_SEGMENT_ROWS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    rows = _random_rows(args.plays, args.songs)
+
+    with tempfile.TemporaryDirectory() as temporary_path:
+        # the row at a time layout: one JSON object per play
+        rows_file = Path(temporary_path) / Path("scores.jsonl")
+        with open(rows_file, "wt") as writer:
+            for textage_id, difficulty, score, timestamp in rows:
+                json.dump(
+                    {
+                        "textage_id": textage_id,
+                        "difficulty": Difficulty(difficulty).name,
+                        "timestamp": timestamp,
+                        **score.__dict__,
+                    },
+                    writer,
+                )
+                writer.write("\n")
+
+        score_log = ScoreLog(Path(temporary_path) / Path("scores"), args.segment_rows)
+        started = time.perf_counter()
+        score_log.append_records(encode_scores(rows))
+        append_seconds = time.perf_counter() - started
+        score_log.compact()
+
+        started = time.perf_counter()
+        by_row: Dict[str, int] = {}
+        with open(rows_file, "rt") as reader:
+            for line in reader:
+                row = json.loads(line)
+                difficulty_name = row.pop("difficulty")
+                del row["textage_id"], row["timestamp"]
+                score = Score(**row)
+                by_row[difficulty_name] = (
+                    by_row.get(difficulty_name, 0) + 2 * score.fgreat + score.great
+                )
+        row_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        records = ScoreLog(score_log.path).scan(["difficulty", "fgreat", "great"])
+        ex_scores = 2 * records["fgreat"].astype(np.int64) + records["great"]
+        totals = np.bincount(records["difficulty"], weights=ex_scores)
+        by_column = {
+            Difficulty(value).name: int(totals[value])
+            for value in np.flatnonzero(totals)
+        }
+        column_seconds = time.perf_counter() - started
+
+        if by_row != by_column:
+            raise RuntimeError("the score log and the rows disagree")
+        print(f"{args.plays} plays, total EX score by difficulty")
+        print(f"  {'append (one fsync)':24s} {append_seconds * 1000:8.1f}ms")
+        print(
+            f"  {'rows as Scores':24s} {row_seconds * 1000:8.1f}ms, "
+            f"{rows_file.stat().st_size / 1e6:.1f}MB"
+        )
+        print(
+            f"  {'score log scan':24s} {column_seconds * 1000:8.1f}ms, "
+            f"{len(records) * SCORE_DTYPE.itemsize / 1e6:.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import json
+import logging
+from typing import List, Dict, Set, Any
+
+from local_dataclasses import SongMetadata
+from title_normalization import normalize_key
+
+log = logging.getLogger(__name__)
+
+
+def _search_grams(normalized: str) -> Set[str]:
+    """
+    Unigrams and bigrams of a normalized field. A query of any length
+    can be answered by looking up its rarest bigram (or its only
+    unigram) and then checking candidates with a substring match.
+    """
+    grams: Set[str] = set(normalized)
+    grams.update(normalized[i : i + 2] for i in range(len(normalized) - 1))
+    return grams
+
+
+def build_search_index(songs: List[SongMetadata]) -> Dict[str, Any]:
+    """
+    Precomputes a compact n-gram index over title, artist and genre.
+
+    ids: textage ids, the position in this list is the song number
+    keys: normalized "title\\nartist\\ngenre" per song number,
+          used to confirm candidates
+    grams: gram -> sorted list of song numbers
+    """
+    ids: List[str] = []
+    keys: List[str] = []
+    postings: Dict[str, List[int]] = {}
+    for song_number, song in enumerate(sorted(songs, key=lambda s: s.textage_id)):
+        fields = [
+            normalize_key(field) for field in (song.title, song.artist, song.genre)
+        ]
+        ids.append(song.textage_id)
+        keys.append("\n".join(fields))
+        song_grams: Set[str] = set()
+        for field in fields:
+            song_grams.update(_search_grams(field))
+        for gram in song_grams:
+            postings.setdefault(gram, []).append(song_number)
+    log.info(f"built search index of {len(postings)} grams for {len(ids)} songs")
+    return {"ids": ids, "keys": keys, "grams": postings}
+
+
+def search_index_to_javascript(search_index: Dict[str, Any]) -> str:
+    """
+    Serializes the index without whitespace. "</" is escaped so that
+    a title can never close the surrounding script tag.
+    """
+    index_json = json.dumps(search_index, ensure_ascii=False, separators=(",", ":"))
+    return index_json.replace("</", "<\\/")
+
+
+SEARCH_JAVASCRIPT = """
+    <script>
+        const searchIndex = {search_index};
+        const rowsBySong = new Map();
+        let visibleSongs = null;
+
+        function normalizeSearchText(text) {
+            return text
+                .normalize("NFKC")
+                .toLowerCase()
+                .replace(/[\\u30a1-\\u30f6]/g, (c) =>
+                    String.fromCharCode(c.charCodeAt(0) - 0x60))
+                .replace(/[^\\p{L}\\p{N}]/gu, "");
+        }
+
+        function findSongs(query) {
+            var candidates = null;
+            if (query.length == 1) {
+                candidates = searchIndex.grams[query] || [];
+            } else {
+                for (var i = 0; i < query.length - 1; i++) {
+                    var posting = searchIndex.grams[query.substring(i, i + 2)];
+                    if (posting == undefined) {
+                        return new Set();
+                    }
+                    if (candidates == null || posting.length < candidates.length) {
+                        candidates = posting;
+                    }
+                }
+            }
+            var found = new Set();
+            for (const song of candidates) {
+                if (searchIndex.keys[song].includes(query)) {
+                    found.add(song);
+                }
+            }
+            return found;
+        }
+
+        function setSongVisible(song, visible) {
+            for (const row of rowsBySong.get(song) || []) {
+                row.style.display = visible ? "" : "none";
+            }
+        }
+
+        function filterSongs(input) {
+            var query = normalizeSearchText(input);
+            var found = query.length == 0 ? null : findSongs(query);
+            // only touch the rows whose visibility actually changes
+            for (var song = 0; song < searchIndex.ids.length; song++) {
+                var wasVisible = visibleSongs == null || visibleSongs.has(song);
+                var isVisible = found == null || found.has(song);
+                if (wasVisible != isVisible) {
+                    setSongVisible(song, isVisible);
+                }
+            }
+            visibleSongs = found;
+        }
+
+        document.addEventListener("DOMContentLoaded", function () {
+            var songNumbers = new Map();
+            searchIndex.ids.forEach((id, song) => songNumbers.set(id, song));
+            for (const row of document.querySelectorAll("tr[data-song]")) {
+                var song = songNumbers.get(row.dataset.song);
+                if (!rowsBySong.has(song)) {
+                    rowsBySong.set(song, []);
+                }
+                rowsBySong.get(song).push(row);
+            }
+        });
+    </script>
+"""
+
+
+def build_search_javascript(search_index: Dict[str, Any]) -> str:
+    return SEARCH_JAVASCRIPT.replace(
+        "{search_index}", search_index_to_javascript(search_index)
+    )
+
+
+def build_search_box() -> str:
+    return (
+        "<div id='search_area'>"
+        "<input id='search' type='search' "
+        "placeholder='Search title / artist / genre' "
+        "autocomplete='off' "
+        "oninput='filterSongs(this.value)'>"
+        "</input>"
+        "</div>\n"
+    )
@@ -0,0 +1,86 @@
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from local_dataclasses import (
+    OCRSongTitles,
+    SongMetadata,
+    SongReference,
+    SongResolution,
+)
+from download_textage_tables import build_song_reference
+
+log = logging.getLogger(__name__)
+
+
+class SongReferenceStore:
+    """
+    Holds the SongReference that OCR workers resolve against.
+
+    Readers never take a lock: they read the current reference once and
+    resolve against it, and every result carries that reference's
+    version. rebuild() builds a new reference off to the side and
+    publishes it with a single attribute assignment, so a reader sees
+    either the old reference or the new one, never a mix.
+    """
+
+    def __init__(self, song_reference: Optional[SongReference] = None):
+        self._song_reference = (
+            song_reference if song_reference is not None else SongReference()
+        )
+        # only serializes publishers against each other
+        self._publish_lock = threading.Lock()
+        self._next_version = self._song_reference.version + 1
+
+    @property
+    def song_reference(self) -> SongReference:
+        return self._song_reference
+
+    @property
+    def version(self) -> int:
+        return self._song_reference.version
+
+    def publish(self, song_reference: SongReference) -> bool:
+        """
+        Swaps song_reference in, unless a newer version has already
+        been published (a slow rebuild finishing after a quick one).
+        """
+        with self._publish_lock:
+            if song_reference.version <= self._song_reference.version:
+                log.info(
+                    f"not publishing song reference {song_reference.version}, "
+                    f"{self._song_reference.version} is newer"
+                )
+                return False
+            self._song_reference = song_reference
+            self._next_version = max(self._next_version, song_reference.version + 1)
+        return True
+
+    def rebuild(self, songs: Dict[str, SongMetadata]) -> SongReference:
+        """
+        Builds a reference for songs under the next version and
+        publishes it. Readers keep using the current one until then.
+        """
+        with self._publish_lock:
+            version = self._next_version
+            self._next_version += 1
+        song_reference = build_song_reference(songs, version)
+        self.publish(song_reference)
+        return song_reference
+
+    def resolve_by_play_metadata(
+        self,
+        difficulty_tuple: Tuple[str, int],
+        bpm_tuple: Tuple[int, int],
+        note_count: Optional[int] = None,
+    ) -> SongResolution:
+        return self._song_reference.resolve_play_metadata_with_version(
+            difficulty_tuple, bpm_tuple, note_count
+        )
+
+    def resolve_ocr(
+        self, song_title: OCRSongTitles, difficulty: str, level: int
+    ) -> SongResolution:
+        return self._song_reference.resolve_ocr_with_version(
+            song_title, difficulty, level
+        )
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Where every chart sits on the song select screen, for predicting the
+next screen while scrolling:
+
+    index = SongSelectIndex(songs, version)
+    index.positions("_aa_cs", Difficulty.SP_ANOTHER)["level"]
+    # ChartPosition(SongSelectFolder("level", "SP", 12), 41)
+    index.entry(SongSelectFolder("level", "SP", 12), 42)
+    # ("_ab_cd", Difficulty.SP_HYPER)
+
+Every folder is per play style (SP or DP), and sorted like
+SongMetadata.sort_by_alphanumeric (alphanumeric folder, then title),
+ties broken by textage id:
+- alphanumeric and version folders list songs with at least one chart
+  in that style, so every chart of a song shares its song's position,
+  and entry() has no difficulty to give (None)
+- level folders list charts, so a song can be there twice (an SP HYPER
+  and an SP ANOTHER 12), ordered by difficulty after the title
+
+The index is built once per catalog version with array sorts over a
+ChartIndex, after which lookups both ways are a few array reads.
+
+Run as a script, this builds the index for the cached catalog and checks
+it against sorting every folder with the sort_by_* methods.
+"""
+
+import time
+import random
+import logging
+import argparse
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from chart_aggregation import NO_PLAY, ChartIndex
+from download_textage_tables import get_all_song_metadata
+from local_dataclasses import (
+    BPM_TABLE_COLUMNS,
+    ChartPosition,
+    Difficulty,
+    SongMetadata,
+    SongSelectFolder,
+)
+
+log = logging.getLogger(__name__)
+
+FOLDER_KINDS = ("alphanumeric", "level", "version")
+STYLES = ("SP", "DP")
+SONG_FOLDER_KINDS = ("alphanumeric", "version")
+
+
+def _play_styles(difficulties: NDArray) -> NDArray[np.intp]:
+    # SP_* are 2-5 and DP_* are 7-10
+    return (difficulties > Difficulty.SP_LEGGENDARIA.value).astype(np.intp)
+
+
+class _FolderLayout:
+    """
+    Entries (charts or songs) sorted into folders: entries[start:end]
+    is a folder in order, and positions[entry] is where it sits in it.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        styles: NDArray,
+        values: NDArray,
+        title_ranks: NDArray,
+        tie_breaks: NDArray,
+    ):
+        order = np.lexsort((tie_breaks, title_ranks, values, styles))
+        sorted_styles, sorted_values = styles[order], values[order]
+        new_folder = np.ones(len(order), np.bool_)
+        new_folder[1:] = (sorted_styles[1:] != sorted_styles[:-1]) | (
+            sorted_values[1:] != sorted_values[:-1]
+        )
+        starts = np.flatnonzero(new_folder)
+        ends = np.append(starts[1:], len(order))
+        self.entries: NDArray[np.intp] = order
+        self.positions: NDArray[np.intp] = np.empty(len(order), np.intp)
+        self.positions[order] = (
+            np.arange(len(order)) - starts[np.cumsum(new_folder) - 1]
+        )
+        self.folders: Dict[SongSelectFolder, Tuple[int, int]] = {
+            SongSelectFolder(
+                kind, STYLES[int(sorted_styles[start])], int(sorted_values[start])
+            ): (int(start), int(end))
+            for start, end in zip(starts, ends)
+        }
+
+
+class SongSelectIndex:
+    """
+    Folder and position of every chart in the catalog, in every folder
+    kind. version is the catalog version it was built from.
+    """
+
+    def __init__(self, songs: Mapping[str, SongMetadata], version: int = 0):
+        self.version = version
+        self.charts = ChartIndex(songs)
+        textage_ids = [
+            textage_id.decode("ascii") for textage_id in self.charts.textage_ids
+        ]
+        self.row_by_textage_id: Dict[str, int] = {
+            textage_id: row for row, textage_id in enumerate(textage_ids)
+        }
+        # rank of every song row in sort_by_alphanumeric order
+        sort_keys = np.array(
+            [songs[textage_id].sort_by_alphanumeric() for textage_id in textage_ids]
+        )
+        self.title_ranks: NDArray[np.intp] = np.empty(len(textage_ids), np.intp)
+        self.title_ranks[np.argsort(sort_keys, kind="stable")] = np.arange(
+            len(textage_ids)
+        )
+
+        song_rows = self.charts.song_rows.astype(np.intp)
+        difficulties = self.charts.columns["difficulty"]
+        styles = _play_styles(difficulties)
+        self._styles = styles
+        self._layouts: Dict[str, _FolderLayout] = {
+            "level": _FolderLayout(
+                "level",
+                styles,
+                self.charts.columns["level"],
+                self.title_ranks[song_rows],
+                difficulties,
+            )
+        }
+        # song folders list each (style, song) once; entry_charts is the
+        # first chart of each, and song_entry maps every chart to its entry
+        style_songs, entry_charts, song_entry = np.unique(
+            styles * len(textage_ids) + song_rows,
+            return_index=True,
+            return_inverse=True,
+        )
+        self._entry_song_rows: NDArray[np.intp] = style_songs % max(len(textage_ids), 1)
+        self._song_entry: NDArray[np.intp] = song_entry.reshape(-1)
+        for kind in SONG_FOLDER_KINDS:
+            self._layouts[kind] = _FolderLayout(
+                kind,
+                styles[entry_charts],
+                self.charts.columns[kind][entry_charts],
+                self.title_ranks[self._entry_song_rows],
+                self._entry_song_rows,
+            )
+
+    def _chart_number(self, textage_id: str, difficulty: Difficulty) -> int:
+        row = self.row_by_textage_id[textage_id]
+        chart = int(
+            self.charts.chart_by_cell[row * BPM_TABLE_COLUMNS + difficulty.value]
+        )
+        if chart == NO_PLAY:
+            raise KeyError(f"{textage_id} has no {difficulty.name} chart")
+        return chart
+
+    def positions(
+        self, textage_id: str, difficulty: Difficulty
+    ) -> Dict[str, ChartPosition]:
+        """
+        The chart's folder and position in each of FOLDER_KINDS. Raises
+        KeyError for charts that aren't in the catalog.
+        """
+        chart = self._chart_number(textage_id, difficulty)
+        style = STYLES[int(self._styles[chart])]
+        chart_positions = {}
+        for kind in FOLDER_KINDS:
+            entry = chart if kind == "level" else int(self._song_entry[chart])
+            chart_positions[kind] = ChartPosition(
+                SongSelectFolder(kind, style, int(self.charts.columns[kind][chart])),
+                int(self._layouts[kind].positions[entry]),
+            )
+        return chart_positions
+
+    def folders(self, kind: str) -> List[SongSelectFolder]:
+        return list(self._layouts[kind].folders)
+
+    def folder_size(self, folder: SongSelectFolder) -> int:
+        start, end = self._layouts[folder.kind].folders[folder]
+        return end - start
+
+    def entry(
+        self, folder: SongSelectFolder, position: int
+    ) -> Tuple[str, Optional[Difficulty]]:
+        """
+        The textage id at position in folder, and the difficulty for
+        level folders (None in song folders, where the player picks).
+        """
+        layout = self._layouts[folder.kind]
+        start, end = layout.folders[folder]
+        if not 0 <= position < end - start:
+            raise IndexError(f"{folder} has {end - start} entries, not {position + 1}")
+        entry = int(layout.entries[start + position])
+        if folder.kind == "level":
+            return self.charts.chart(entry)
+        textage_id = self.charts.textage_ids[self._entry_song_rows[entry]]
+        return textage_id.decode("ascii"), None
+
+
+def _folders_by_sorting(
+    songs: Mapping[str, SongMetadata],
+) -> Dict[SongSelectFolder, List[Tuple[str, Optional[Difficulty]]]]:
+    """
+    Every folder built with the sort_by_* methods, for comparison.
+    """
+    folders: Dict[SongSelectFolder, List[Tuple[str, Optional[Difficulty]]]] = {}
+    ordered = sorted(
+        songs.values(), key=lambda song: (song.sort_by_alphanumeric(), song.textage_id)
+    )
+    for song in ordered:
+        charts = sorted(
+            [
+                (difficulty, metadata)
+                for difficulty, metadata in song.difficulty_metadata.items()
+                if metadata.level and metadata.notes
+            ],
+            key=lambda chart: chart[0].value,
+        )
+        styles: Dict[str, bool] = {}
+        for difficulty, metadata in charts:
+            style = difficulty.name[:2]
+            styles[style] = True
+            folders.setdefault(
+                SongSelectFolder("level", style, metadata.level), []
+            ).append((song.textage_id, difficulty))
+        for style in styles:
+            for kind, value in (
+                ("alphanumeric", song.alphanumeric.value),
+                ("version", song.textage_version_id),
+            ):
+                folders.setdefault(SongSelectFolder(kind, style, value), []).append(
+                    (song.textage_id, None)
+                )
+    return folders
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--lookups", type=int, default=100000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    songs = get_all_song_metadata(download=False)
+
+    started = time.perf_counter()
+    index = SongSelectIndex(songs)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expected = _folders_by_sorting(songs)
+    sorting_seconds = time.perf_counter() - started
+
+    for folder, entries in expected.items():
+        found = [
+            index.entry(folder, position)
+            for position in range(index.folder_size(folder))
+        ]
+        if found != entries:
+            raise RuntimeError(f"{folder} is out of order")
+        for position, (textage_id, difficulty) in enumerate(entries):
+            if difficulty is None:
+                continue
+            if index.positions(textage_id, difficulty)["level"].position != position:
+                raise RuntimeError(f"{textage_id} {difficulty.name} is misplaced")
+    if set(expected) != {
+        folder for kind in FOLDER_KINDS for folder in index.folders(kind)
+    }:
+        raise RuntimeError("the index has different folders")
+
+    random.seed(0)
+    charts = [index.charts.chart(chart) for chart in range(len(index.charts))]
+    lookups = [random.choice(charts) for _ in range(args.lookups)]
+    started = time.perf_counter()
+    for textage_id, difficulty in lookups:
+        index.positions(textage_id, difficulty)
+    positions_seconds = time.perf_counter() - started
+    level_positions = [
+        index.positions(textage_id, difficulty)["level"]
+        for textage_id, difficulty in lookups
+    ]
+    started = time.perf_counter()
+    for chart_position in level_positions:
+        index.entry(chart_position.folder, chart_position.position)
+    entry_seconds = time.perf_counter() - started
+
+    print(f"{len(index.charts)} charts in {len(expected)} folders")
+    print(f"  {'build (per catalog)':22s} {build_seconds * 1000:8.1f}ms")
+    print(f"  {'sort_by_* per folder':22s} {sorting_seconds * 1000:8.1f}ms")
+    print(f"  {'positions()':22s} {positions_seconds / args.lookups * 1e6:8.2f}us")
+    print(f"  {'entry()':22s} {entry_seconds / args.lookups * 1e6:8.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Screen state detection from StatePixel color probes, evaluated with
+NumPy over every probe (and optionally every frame) at once:
+
+    probes = StateProbeSet(state_pixels, tolerance=8)
+    probes.match_state(frame)          # "song_select", or None
+    probes.match_states(frame_stack)   # one state per frame
+
+Frames are (height, width, 3) uint8 arrays in BGR order, like OpenCV
+captures, which is the order StatePixel stores its colors in. A state
+matches when every one of its probes is within `tolerance` of the
+expected color on every channel. When several states match, the one
+with the most probes wins, then the one defined first.
+
+Run as a script, this compares it with checking the probes one by one
+in Python on random frames.
+"""
+
+import time
+import random
+import logging
+import argparse
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from local_dataclasses import StatePixel
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TOLERANCE = 8
+
+
+class StateProbeSet:
+    """
+    Every StatePixel packed into coordinate and expected color arrays,
+    grouped by state. States are ordered by probe count (descending),
+    then by first appearance, so the first fully matched state is the
+    winner.
+    """
+
+    def __init__(
+        self,
+        state_pixels: Iterable[StatePixel],
+        tolerance: Union[int, Tuple[int, int, int]] = DEFAULT_TOLERANCE,
+    ):
+        pixels_by_state: Dict[str, List[StatePixel]] = {}
+        for state_pixel in state_pixels:
+            pixels_by_state.setdefault(state_pixel.state, []).append(state_pixel)
+        if not pixels_by_state:
+            raise ValueError("a StateProbeSet needs at least one StatePixel")
+        self.states: List[str] = sorted(
+            pixels_by_state, key=lambda state: -len(pixels_by_state[state])
+        )
+        pixels = [
+            state_pixel
+            for state in self.states
+            for state_pixel in pixels_by_state[state]
+        ]
+        self.names: List[str] = [state_pixel.name for state_pixel in pixels]
+        self.ys: NDArray[np.intp] = np.array([pixel.y for pixel in pixels], np.intp)
+        self.xs: NDArray[np.intp] = np.array([pixel.x for pixel in pixels], np.intp)
+        self.expected: NDArray[np.int16] = np.array(
+            [(pixel.b, pixel.g, pixel.r) for pixel in pixels], np.int16
+        )
+        self.tolerance: NDArray[np.int16] = np.broadcast_to(
+            np.array(tolerance, np.int16), (3,)
+        ).copy()
+        self.probe_counts: NDArray[np.intp] = np.array(
+            [len(pixels_by_state[state]) for state in self.states], np.intp
+        )
+        # where each state's probes start, for np.logical_and.reduceat
+        self._state_starts = np.concatenate(([0], np.cumsum(self.probe_counts)[:-1]))
+        self._min_height = int(self.ys.max()) + 1
+        self._min_width = int(self.xs.max()) + 1
+
+    def _check_frames(self, frames: NDArray, batch: bool):
+        dimensions = 4 if batch else 3
+        if frames.ndim != dimensions or frames.shape[-1] < 3:
+            raise ValueError(
+                f"expected {'(frames, ' if batch else '('}height, width, 3) "
+                f"frames, got shape {frames.shape}"
+            )
+        height, width = frames.shape[-3], frames.shape[-2]
+        if height < self._min_height or width < self._min_width:
+            raise ValueError(
+                f"probes need frames of at least {self._min_width}x"
+                f"{self._min_height}, got {width}x{height}"
+            )
+
+    def _probe_matches(self, sampled: NDArray) -> NDArray[np.bool_]:
+        difference = np.abs(sampled[..., :3].astype(np.int16) - self.expected)
+        return np.all(difference <= self.tolerance, axis=-1)
+
+    def probe_matches(self, frame: NDArray) -> NDArray[np.bool_]:
+        """
+        Whether each probe matched, in the order of .names.
+        """
+        self._check_frames(frame, batch=False)
+        return self._probe_matches(frame[self.ys, self.xs])
+
+    def _matched_states(self, matches: NDArray[np.bool_]) -> NDArray[np.bool_]:
+        return np.logical_and.reduceat(matches, self._state_starts, axis=-1)
+
+    def matching_states(self, frame: NDArray) -> List[str]:
+        matched = self._matched_states(self.probe_matches(frame))
+        return [self.states[index] for index in np.flatnonzero(matched)]
+
+    def match_state(self, frame: NDArray) -> Optional[str]:
+        matched = self._matched_states(self.probe_matches(frame))
+        if not matched.any():
+            return None
+        return self.states[int(matched.argmax())]
+
+    def match_states(self, frames: NDArray) -> List[Optional[str]]:
+        """
+        match_state for a (frames, height, width, 3) stack, e.g. a
+        replay, in one pass.
+        """
+        self._check_frames(frames, batch=True)
+        matched = self._matched_states(self._probe_matches(frames[:, self.ys, self.xs]))
+        any_matched = matched.any(axis=1)
+        winners = matched.argmax(axis=1)
+        return [
+            self.states[int(winner)] if found else None
+            for winner, found in zip(winners, any_matched)
+        ]
+
+
+def _match_state_per_probe(
+    state_pixels: Sequence[StatePixel], frame: NDArray, tolerance: int
+) -> Optional[str]:
+    """
+    The probe at a time version, for comparison.
+    """
+    matched: Dict[str, bool] = {}
+    for state_pixel in state_pixels:
+        b, g, r = (int(channel) for channel in frame[state_pixel.y, state_pixel.x])
+        close = (
+            abs(b - state_pixel.b) <= tolerance
+            and abs(g - state_pixel.g) <= tolerance
+            and abs(r - state_pixel.r) <= tolerance
+        )
+        matched[state_pixel.state] = matched.get(state_pixel.state, True) and close
+    counts: Dict[str, int] = {}
+    for state_pixel in state_pixels:
+        counts[state_pixel.state] = counts.get(state_pixel.state, 0) + 1
+    found = [state for state, is_matched in matched.items() if is_matched]
+    if not found:
+        return None
+    return max(found, key=lambda state: counts[state])
+
+
+def _random_probes_and_frames(
+    states: int, probes_per_state: int, frames: int, height: int, width: int
+) -> Tuple[List[StatePixel], NDArray[np.uint8]]:
+    """
+    Random probes, and frames that each show one of the states (or none).
+    """
+    random.seed(0)
+    generator = np.random.default_rng(0)
+    state_pixels = [
+        StatePixel(
+            state=f"state{state}",
+            name=f"probe{probe}",
+            y=random.randrange(height),
+            x=random.randrange(width),
+            b=random.randrange(256),
+            g=random.randrange(256),
+            r=random.randrange(256),
+        )
+        for state in range(states)
+        for probe in range(probes_per_state + state % 3)
+    ]
+    frame_stack = generator.integers(0, 256, (frames, height, width, 3), dtype=np.uint8)
+    for frame_number in range(frames):
+        shown = f"state{frame_number % (states + 1)}"
+        for state_pixel in state_pixels:
+            if state_pixel.state == shown:
+                frame_stack[frame_number, state_pixel.y, state_pixel.x] = (
+                    state_pixel.b,
+                    state_pixel.g,
+                    state_pixel.r,
+                )
+    return state_pixels, frame_stack
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--states", type=int, default=12)
+    parser.add_argument("--probes", type=int, default=8, help="per state")
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--width", type=int, default=1920)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    state_pixels, frames = _random_probes_and_frames(
+        args.states, args.probes, args.frames, args.height, args.width
+    )
+    probe_set = StateProbeSet(state_pixels, DEFAULT_TOLERANCE)
+
+    started = time.perf_counter()
+    per_probe = [
+        _match_state_per_probe(state_pixels, frame, DEFAULT_TOLERANCE)
+        for frame in frames
+    ]
+    per_probe_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    per_frame = [probe_set.match_state(frame) for frame in frames]
+    per_frame_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = probe_set.match_states(frames)
+    batched_seconds = time.perf_counter() - started
+
+    if not per_probe == per_frame == batched:
+        raise RuntimeError("the probe set and the per probe loop disagree")
+    print(f"{len(state_pixels)} probes, {len(frames)} frames")
+    for label, seconds in (
+        ("per probe (python)", per_probe_seconds),
+        ("match_state", per_frame_seconds),
+        ("match_states", batched_seconds),
+    ):
+        print(f"  {label:20s} {seconds / len(frames) * 1e6:8.1f}us/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Stress test for SongReferenceStore: reader threads resolve play
+metadata and OCR titles as fast as they can while another thread keeps
+rebuilding and publishing the reference.
+
+Rebuilds alternate between the whole catalog (odd versions) and every
+other song (even versions), so the right answer depends on the version.
+Every result is checked against the answer for the version it reports,
+and each reader checks that versions never go backwards. Exits 1 if
+anything is wrong.
+
+    python3 stress_song_reference.py --readers 16 --seconds 10
+"""
+
+import sys
+import time
+import logging
+import argparse
+import threading
+from typing import Dict, FrozenSet, List, Tuple, Union
+
+from local_dataclasses import OCRSongTitles, SongMetadata, SongResolution
+from download_textage_tables import build_song_reference, get_all_song_metadata
+from song_reference_store import SongReferenceStore
+
+log = logging.getLogger(__name__)
+
+PlayQuery = Tuple[Tuple[str, int], Tuple[int, int], int]
+OCRQuery = Tuple[OCRSongTitles, str, int]
+Query = Union[PlayQuery, OCRQuery]
+
+
+def build_queries(songs: Dict[str, SongMetadata], limit: int) -> List[Query]:
+    """
+    A play metadata and an OCR query for the first chart of the first
+    `limit` songs.
+    """
+    queries: List[Query] = []
+    for textage_id in sorted(songs)[:limit]:
+        song = songs[textage_id]
+        for difficulty, metadata in song.difficulty_metadata.items():
+            queries.append(
+                (
+                    (difficulty.name, metadata.level),
+                    (metadata.min_bpm, metadata.max_bpm),
+                    metadata.notes,
+                )
+            )
+            queries.append(
+                (
+                    OCRSongTitles(song.title, song.artist, "", ""),
+                    difficulty.name,
+                    metadata.level,
+                )
+            )
+            break
+    return queries
+
+
+def _resolve(store: SongReferenceStore, query: Query) -> SongResolution:
+    if isinstance(query[0], OCRSongTitles):
+        return store.resolve_ocr(*query)  # type: ignore
+    return store.resolve_by_play_metadata(*query)  # type: ignore
+
+
+def _catalog_for_version(
+    version: int, catalogs: List[Dict[str, SongMetadata]]
+) -> Dict[str, SongMetadata]:
+    return catalogs[version % 2 == 0]
+
+
+def _reader(
+    store: SongReferenceStore,
+    queries: List[Query],
+    expected: List[List[FrozenSet[str]]],
+    deadline: float,
+    offset: int,
+    reads: List[int],
+    failures: List[str],
+):
+    last_version = 0
+    read_count = 0
+    query_number = offset
+    while time.perf_counter() < deadline:
+        query_index = query_number % len(queries)
+        query_number += 1
+        resolution = _resolve(store, queries[query_index])
+        read_count += 1
+        if resolution.version < last_version:
+            failures.append(
+                f"reader {offset} went from version {last_version} "
+                f"back to {resolution.version}"
+            )
+        last_version = resolution.version
+        if resolution.textage_ids != expected[resolution.version % 2][query_index]:
+            failures.append(
+                f"reader {offset}: {queries[query_index]} at version "
+                f"{resolution.version} gave {set(resolution.textage_ids)}"
+            )
+    reads.append(read_count)
+
+
+def _rebuilder(
+    store: SongReferenceStore,
+    catalogs: List[Dict[str, SongMetadata]],
+    deadline: float,
+    rebuild_seconds: List[float],
+):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        store.rebuild(_catalog_for_version(store.version + 1, catalogs))
+        rebuild_seconds.append(time.perf_counter() - started)
+
+
+def run_stress_test(
+    songs: Dict[str, SongMetadata], readers: int, seconds: float, limit: int
+) -> List[str]:
+    half_songs = {textage_id: songs[textage_id] for textage_id in sorted(songs)[::2]}
+    # index 0 for odd versions, 1 for even ones
+    catalogs = [songs, half_songs]
+    queries = build_queries(songs, limit)
+    # expected[version % 2][query index]
+    expected: List[List[FrozenSet[str]]] = []
+    for version in (2, 1):
+        version_store = SongReferenceStore(
+            build_song_reference(_catalog_for_version(version, catalogs), version)
+        )
+        expected.append(
+            [_resolve(version_store, query).textage_ids for query in queries]
+        )
+    store = SongReferenceStore(build_song_reference(songs, 1))
+    reads: List[int] = []
+    failures: List[str] = []
+    rebuild_seconds: List[float] = []
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(
+            target=_reader,
+            args=(store, queries, expected, deadline, n, reads, failures),
+        )
+        for n in range(readers)
+    ]
+    threads.append(
+        threading.Thread(
+            target=_rebuilder, args=(store, catalogs, deadline, rebuild_seconds)
+        )
+    )
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(f"songs:    {len(songs)} ({len(queries)} queries)")
+    print(f"readers:  {readers}")
+    print(f"reads:    {sum(reads)} ({sum(reads) / elapsed:.0f}/s)")
+    print(f"rebuilds: {len(rebuild_seconds)} (last version {store.version})")
+    if rebuild_seconds:
+        print(
+            f"rebuild:  {sum(rebuild_seconds) / len(rebuild_seconds) * 1000:.1f}ms "
+            "average"
+        )
+    print(f"failures: {len(failures)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--limit", type=int, default=500, help="songs to build queries from"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    songs = get_all_song_metadata(download=False)
+    failures = run_stress_test(songs, args.readers, args.seconds, args.limit)
+    for failure in failures[:20]:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
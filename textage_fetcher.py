@@ -0,0 +1,113 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+import requests  # type: ignore
+from requests.adapters import HTTPAdapter  # type: ignore
+
+log = logging.getLogger(__name__)
+
+TEXTAGE_BASE_URL = "https://textage.cc/score/"
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5.0
+DEFAULT_READ_TIMEOUT_SECONDS = 30.0
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 1.0
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+@dataclass
+class FetchMetrics:
+    url: str
+    status_code: int = 0
+    attempts: int = 0
+    seconds: float = 0.0
+    bytes_read: int = 0
+    error: str = ""
+
+
+class TextageFetcher:
+    """
+    One pooled requests.Session for every textage download, so the
+    files share TCP/TLS connections, with connect/read timeouts and
+    bounded retries with exponential backoff.
+
+    Every get() appends a FetchMetrics to .metrics.
+    """
+
+    def __init__(
+        self,
+        base_url: str = TEXTAGE_BASE_URL,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = DEFAULT_READ_TIMEOUT_SECONDS,
+        retries: int = DEFAULT_RETRIES,
+        backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+        pool_size: int = 4,
+    ):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.metrics: List[FetchMetrics] = []
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, javascript_file: str) -> requests.Response:
+        url = f"{self.base_url}{javascript_file}"
+        metrics = FetchMetrics(url=url)
+        started = time.perf_counter()
+        try:
+            while True:
+                if metrics.attempts > 0:
+                    backoff = self.backoff_seconds * 2 ** (metrics.attempts - 1)
+                    log.warning(f"retrying {url} in {backoff:.1f}s ({metrics.error})")
+                    time.sleep(backoff)
+                metrics.attempts += 1
+                retries_left = metrics.attempts <= self.retries
+                try:
+                    response = self.session.get(url, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as error:
+                    metrics.error = repr(error)
+                    if retries_left:
+                        continue
+                    raise
+                metrics.status_code = response.status_code
+                metrics.bytes_read = len(response.content)
+                if response.status_code in RETRYABLE_STATUS_CODES and retries_left:
+                    metrics.error = f"status {response.status_code}"
+                    continue
+                metrics.error = ""
+                return response
+        finally:
+            metrics.seconds = time.perf_counter() - started
+            self.metrics.append(metrics)
+            log.info(
+                f"fetched {url}: {metrics.status_code} {metrics.bytes_read}B "
+                f"in {metrics.seconds * 1000:.0f}ms, {metrics.attempts} attempt(s)"
+            )
+
+    def close(self):
+        self.session.close()
+
+
+_default_fetcher: Optional[TextageFetcher] = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_default_fetcher() -> TextageFetcher:
+    """
+    The shared fetcher used by download_textage_tables. TEXTAGE_BASE_URL
+    in the environment points it somewhere else, e.g. at
+    textage_stand_in_server.py.
+    """
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = TextageFetcher(
+                base_url=os.environ.get("TEXTAGE_BASE_URL", TEXTAGE_BASE_URL)
+            )
+        return _default_fetcher
@@ -0,0 +1,180 @@
+"""
+Every version of the textage files we've downloaded, kept in
+.textage-metadata/history:
+
+    history/objects/<sha256>.xz    lzma compressed file contents
+    history/manifest.json         one entry per new version, with the
+                                  fetch time and textage's Last-Modified
+    history/snapshots/<digest>/   the files as of some date, unpacked for
+                                  the parsers (and their parsed_*.json)
+
+Objects are named by the sha256 of their contents, so a file textage
+re-serves unchanged is only stored once.
+"""
+
+import os
+import json
+import lzma
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from dataclasses import asdict
+from email.utils import parsedate_to_datetime
+from datetime import date, datetime, time, timezone
+from typing import Dict, List, Optional, Union
+
+from local_dataclasses import TextageHistoryEntry
+from compressed_cache import cache_file_exists, write_cache_file
+
+log = logging.getLogger(__name__)
+
+_manifest_lock = threading.Lock()
+
+
+def _get_objects_path(history_path: Path) -> Path:
+    return history_path / Path("objects")
+
+
+def _get_manifest_file(history_path: Path) -> Path:
+    return history_path / Path("manifest.json")
+
+
+def read_history_manifest(history_path: Path) -> List[TextageHistoryEntry]:
+    manifest_file = _get_manifest_file(history_path)
+    if not os.path.exists(manifest_file):
+        return []
+    with open(manifest_file, "rt") as reader:
+        return [TextageHistoryEntry(**entry) for entry in json.load(reader)]
+
+
+def _write_history_manifest(history_path: Path, entries: List[TextageHistoryEntry]):
+    manifest_file = _get_manifest_file(history_path)
+    partial_file = Path(f"{manifest_file}.partial")
+    with open(partial_file, "wt") as writer:
+        json.dump([asdict(entry) for entry in entries], writer, indent=1)
+    os.replace(partial_file, manifest_file)
+
+
+def _write_history_object(history_path: Path, sha256: str, contents: bytes):
+    objects_path = _get_objects_path(history_path)
+    object_file = objects_path / Path(f"{sha256}.xz")
+    if os.path.exists(object_file):
+        return
+    os.makedirs(objects_path, exist_ok=True)
+    partial_file = Path(f"{object_file}.partial")
+    with lzma.open(partial_file, "wb") as writer:
+        writer.write(contents)
+    os.replace(partial_file, object_file)
+
+
+def read_history_object(history_path: Path, sha256: str) -> str:
+    object_file = _get_objects_path(history_path) / Path(f"{sha256}.xz")
+    with lzma.open(object_file, "rt", encoding="utf-8") as reader:
+        return reader.read()
+
+
+def record_textage_javascript(
+    history_path: Path,
+    javascript_file: str,
+    text: str,
+    last_modified: str,
+    fetched_at: Optional[datetime] = None,
+) -> TextageHistoryEntry:
+    """
+    Stores text as a version of javascript_file, unless it's the same
+    as the latest version already recorded.
+    """
+    contents = text.encode("utf-8")
+    sha256 = hashlib.sha256(contents).hexdigest()
+    if fetched_at is None:
+        fetched_at = datetime.now(tz=timezone.utc)
+    with _manifest_lock:
+        entries = read_history_manifest(history_path)
+        for entry in reversed(entries):
+            if entry.javascript_file == javascript_file:
+                if entry.sha256 == sha256:
+                    return entry
+                break
+        _write_history_object(history_path, sha256, contents)
+        new_entry = TextageHistoryEntry(
+            javascript_file=javascript_file,
+            sha256=sha256,
+            fetched_at=fetched_at.isoformat(),
+            last_modified=last_modified,
+        )
+        entries.append(new_entry)
+        _write_history_manifest(history_path, entries)
+    log.info(f"recorded {javascript_file} {sha256[:12]} ({last_modified})")
+    return new_entry
+
+
+def _as_utc_datetime(when: Union[date, datetime]) -> datetime:
+    """
+    A date means the end of that day. Naive datetimes are taken as UTC,
+    like textage's Last-Modified.
+    """
+    if not isinstance(when, datetime):
+        when = datetime.combine(when, time.max)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when
+
+
+def find_textage_versions(
+    history_path: Path,
+    when: Union[date, datetime],
+    javascript_files: List[str],
+) -> Dict[str, TextageHistoryEntry]:
+    """
+    The version of each file textage was serving at `when`, going by
+    Last-Modified.
+    """
+    when = _as_utc_datetime(when)
+    versions: Dict[str, TextageHistoryEntry] = {}
+    latest: Dict[str, datetime] = {}
+    for entry in read_history_manifest(history_path):
+        if entry.javascript_file not in javascript_files:
+            continue
+        last_modified = parsedate_to_datetime(entry.last_modified)
+        if last_modified > when:
+            continue
+        if (
+            entry.javascript_file not in latest
+            or last_modified >= latest[entry.javascript_file]
+        ):
+            latest[entry.javascript_file] = last_modified
+            versions[entry.javascript_file] = entry
+    missing = [
+        javascript_file
+        for javascript_file in javascript_files
+        if javascript_file not in versions
+    ]
+    if missing:
+        raise RuntimeError(f"no recorded version of {missing} as of {when}")
+    return versions
+
+
+def unpack_textage_snapshot(
+    history_path: Path,
+    when: Union[date, datetime],
+    javascript_files: List[str],
+) -> Path:
+    """
+    Writes the files as of `when` to a snapshot directory and returns
+    it. Dates with the same versions share a directory, so the parsed
+    json from an earlier load is reused.
+    """
+    versions = find_textage_versions(history_path, when, javascript_files)
+    digest = hashlib.sha256()
+    for javascript_file in javascript_files:
+        digest.update(f"{javascript_file}:{versions[javascript_file].sha256}".encode())
+    snapshot_path = history_path / Path("snapshots") / Path(digest.hexdigest()[:16])
+    os.makedirs(snapshot_path, exist_ok=True)
+    for javascript_file, entry in versions.items():
+        snapshot_file = snapshot_path / Path(javascript_file)
+        if cache_file_exists(snapshot_file):
+            continue
+        with write_cache_file(snapshot_file) as writer:
+            writer.write(read_history_object(history_path, entry.sha256))
+    return snapshot_path
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for https://textage.cc/score/ that serves recorded
+textage files, so the download path can be exercised and timed
+without touching textage.
+
+By default it serves the files already in .textage-metadata. Those are
+stored as (possibly compressed) utf-8 text, so they are re-encoded to
+shift_jis on the way out like the real site.
+"""
+
+import os
+import time
+import logging
+import argparse
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple, Any
+
+from textage_fetcher import TextageFetcher
+from compressed_cache import find_cache_file, open_cache_file
+from download_textage_tables import (
+    TEXTAGE_JAVASCRIPT_FILES,
+    _get_textage_metadata_path,
+    _download_textage_javascript,
+)
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class StandInBehavior:
+    """
+    How the stand-in answers for one file.
+
+    delay_seconds: sleep before answering, to trip read timeouts
+    failures: answer failure_status this many times before succeeding
+    last_modified: False drops the Last-Modified header
+    """
+
+    delay_seconds: float = 0.0
+    failures: int = 0
+    failure_status: int = 503
+    last_modified: bool = True
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "TextageStandInServer"
+
+    def log_message(self, format: str, *args: Any):
+        log.debug(format % args)
+
+    def do_GET(self):
+        javascript_file = os.path.basename(self.path.split("?", 1)[0])
+        self.server.request_counts[javascript_file] = (
+            self.server.request_counts.get(javascript_file, 0) + 1
+        )
+        behavior = self.server.behaviors.get(javascript_file, StandInBehavior())
+        if behavior.delay_seconds > 0:
+            time.sleep(behavior.delay_seconds)
+        if behavior.failures > 0:
+            behavior.failures -= 1
+            self.send_response(behavior.failure_status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        recorded_file = self.server.recorded_path / Path(javascript_file)
+        stored = find_cache_file(recorded_file)
+        if stored is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        with open_cache_file(recorded_file) as reader:
+            body = reader.read().encode("shift_jis", errors="replace")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/javascript")
+        self.send_header("Content-Length", str(len(body)))
+        if behavior.last_modified:
+            modified = os.path.getmtime(stored[1])
+            self.send_header("Last-Modified", formatdate(modified, usegmt=True))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up on a slow response, which is the point of delays
+            log.debug(f"client hung up before {javascript_file} was sent")
+
+
+class TextageStandInServer(ThreadingHTTPServer):
+    """
+    Usable as a context manager, which serves from a background thread:
+
+        with TextageStandInServer(path) as server:
+            fetcher = TextageFetcher(base_url=server.base_url)
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        recorded_path: Path,
+        behaviors: Dict[str, StandInBehavior] = {},
+        address: Tuple[str, int] = ("127.0.0.1", 0),
+    ):
+        super().__init__(address, StandInRequestHandler)
+        self.recorded_path = recorded_path
+        self.behaviors = dict(behaviors)
+        self.request_counts: Dict[str, int] = {}
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}/score/"
+
+    def __enter__(self) -> "TextageStandInServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args: Any):
+        self.shutdown()
+        self.server_close()
+
+
+def benchmark_downloads(
+    recorded_path: Path, output_path: Path, rounds: int, delay_seconds: float
+):
+    """
+    Downloads every textage file from a stand-in `rounds` times through
+    one pooled TextageFetcher and prints per-file latency.
+    """
+    behaviors = {
+        javascript_file: StandInBehavior(delay_seconds=delay_seconds)
+        for javascript_file in TEXTAGE_JAVASCRIPT_FILES
+    }
+    os.makedirs(output_path, exist_ok=True)
+    with TextageStandInServer(recorded_path, behaviors) as server:
+        fetcher = TextageFetcher(base_url=server.base_url)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for javascript_file in TEXTAGE_JAVASCRIPT_FILES:
+                _download_textage_javascript(javascript_file, output_path, fetcher)
+        elapsed = time.perf_counter() - started
+        fetcher.close()
+    for javascript_file in TEXTAGE_JAVASCRIPT_FILES:
+        file_metrics = [
+            metrics
+            for metrics in fetcher.metrics
+            if metrics.url.endswith(f"/{javascript_file}")
+        ]
+        timings = sorted(metrics.seconds for metrics in file_metrics)
+        print(
+            f"{javascript_file:12s} "
+            f"median {timings[len(timings) // 2] * 1000:7.2f}ms "
+            f"max {timings[-1] * 1000:7.2f}ms "
+            f"{file_metrics[-1].bytes_read}B"
+        )
+    total = rounds * len(TEXTAGE_JAVASCRIPT_FILES)
+    print(f"{total} downloads in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded textage files")
+    parser.add_argument("--recorded-path", default=str(_get_textage_metadata_path()))
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--failures", type=int, default=0)
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        default=0,
+        metavar="ROUNDS",
+        help="download every file ROUNDS times from an in-process stand-in",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.benchmark else logging.INFO)
+    recorded_path = Path(args.recorded_path)
+    if args.benchmark:
+        benchmark_downloads(
+            recorded_path,
+            recorded_path / Path("stand-in-downloads"),
+            args.benchmark,
+            args.delay,
+        )
+        return
+    behaviors = {
+        javascript_file: StandInBehavior(
+            delay_seconds=args.delay, failures=args.failures
+        )
+        for javascript_file in TEXTAGE_JAVASCRIPT_FILES
+    }
+    server = TextageStandInServer(recorded_path, behaviors, ("127.0.0.1", args.port))
+    log.info(f"serving {recorded_path} as {server.base_url}")
+    log.info(f"TEXTAGE_BASE_URL={server.base_url} python3 write_html.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+The one normalization of titles and artists shared by the search box,
+OCR lookups (SongReference) and folder assignment:
+
+    normalize_key("ＦＬＯＷＥＲ　(ｶﾀｶﾅ)")  # "flowerかたかな"
+    folder_initial("ＦＬＯＷＥＲ")        # "F"
+
+normalize_key is NFKC (full/half width and compatibility forms),
+lowercased, katakana folded onto hiragana, and everything that isn't a
+letter or number (spaces, punctuation, symbols) dropped. Keys are
+cached, so a title normalized while building the catalog costs a dict
+lookup the next time search, OCR or anything else asks for it.
+
+Run as a script, this prints normalization throughput over the cached
+catalog, and how many OCR-style variants of the titles (width, kana,
+spacing) are found by exact and by normalized lookup.
+"""
+
+import re
+import time
+import random
+import logging
+import argparse
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+KATAKANA_START = 0x30A1
+KATAKANA_END = 0x30F6
+KATAKANA_TO_HIRAGANA_OFFSET = 0x60
+KATAKANA_TO_HIRAGANA = {
+    codepoint: codepoint - KATAKANA_TO_HIRAGANA_OFFSET
+    for codepoint in range(KATAKANA_START, KATAKANA_END + 1)
+}
+NON_KEY_REGEX = re.compile(r"[^\w]|_")
+# about two catalogs' worth of titles, artists and genres
+KEY_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def normalize_key(text: str) -> str:
+    """
+    The normalized key of a title, artist or genre. Has to stay in sync
+    with normalizeSearchText in search_index.SEARCH_JAVASCRIPT, which
+    does the same thing in the browser.
+    """
+    if text.isascii():
+        # NFKC and the kana table don't change ASCII
+        return NON_KEY_REGEX.sub("", text.lower())
+    folded = unicodedata.normalize("NFKC", text).lower()
+    return NON_KEY_REGEX.sub("", folded.translate(KATAKANA_TO_HIRAGANA))
+
+
+def folder_initial(title: str) -> str:
+    """
+    The A-Z letter a title's folder is picked by: its first character
+    after NFKC, so full width and compatibility letters count too, or ""
+    when that isn't a letter. Unlike normalize_key, leading punctuation
+    isn't skipped, a title starting with one belongs in OTHERS.
+    """
+    if not title:
+        return ""
+    initial = unicodedata.normalize("NFKC", title[0])[:1].upper()[:1]
+    if "A" <= initial <= "Z":
+        return initial
+    return ""
+
+
+def build_key_index(
+    texts_by_textage_id: Iterable[Tuple[str, str]],
+) -> Dict[str, Set[str]]:
+    """
+    normalized key -> textage ids, from (textage id, text) pairs.
+    """
+    index: Dict[str, Set[str]] = {}
+    for textage_id, text in texts_by_textage_id:
+        index.setdefault(normalize_key(text), set()).add(textage_id)
+    return index
+
+
+def _normalize_key_per_character(text: str) -> str:
+    """
+    How the search index normalized before, a character at a time, for
+    comparison.
+    """
+    folded = unicodedata.normalize("NFKC", text).lower()
+    folded = "".join(
+        (
+            chr(ord(char) - KATAKANA_TO_HIRAGANA_OFFSET)
+            if KATAKANA_START <= ord(char) <= KATAKANA_END
+            else char
+        )
+        for char in folded
+    )
+    return NON_KEY_REGEX.sub("", folded)
+
+
+def _ocr_variant(text: str, generator: random.Random) -> str:
+    """
+    The kind of differences OCR output has from titletbl.js: the other
+    width, the other kana, spaces doubled or dropped.
+    """
+    variant = generator.choice(
+        [
+            unicodedata.normalize("NFKC", text),
+            "".join(
+                chr(ord(char) + 0xFEE0) if "!" <= char <= "~" else char for char in text
+            ),
+            "".join(
+                (
+                    chr(ord(char) + KATAKANA_TO_HIRAGANA_OFFSET)
+                    if KATAKANA_START - KATAKANA_TO_HIRAGANA_OFFSET
+                    <= ord(char)
+                    <= KATAKANA_END - KATAKANA_TO_HIRAGANA_OFFSET
+                    else char
+                )
+                for char in text
+            ),
+            text.replace(" ", "  "),
+            text.replace(" ", ""),
+            f" {text} ",
+        ]
+    )
+    return variant
+
+
+def main():
+    # local_dataclasses imports this module, so the catalog can't be
+    # imported at the top
+    from download_textage_tables import get_all_song_metadata
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    songs = get_all_song_metadata(download=False)
+    texts = [
+        text
+        for song in songs.values()
+        for text in (song.title, song.artist, song.genre)
+    ]
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+
+    def uncached(text: str) -> str:
+        return normalize_key.__wrapped__(text)  # type: ignore[attr-defined]
+
+    normalize_key.cache_clear()
+    print(f"{len(texts)} titles, artists and genres, {megabytes:.2f}MB")
+    for label, normalize in (
+        ("per character", _normalize_key_per_character),
+        ("normalize_key uncached", uncached),
+        ("normalize_key cached", normalize_key),
+    ):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            keys = [normalize(text) for text in texts]
+        seconds = (time.perf_counter() - started) / args.repeat
+        if keys != [_normalize_key_per_character(text) for text in texts]:
+            raise RuntimeError(f"{label} normalizes differently")
+        print(
+            f"  {label:24s} {len(texts) / seconds:12.0f} keys/s "
+            f"{megabytes / seconds:8.1f}MB/s"
+        )
+
+    by_title = {song.title: textage_id for textage_id, song in songs.items()}
+    by_key = build_key_index(
+        (textage_id, song.title) for textage_id, song in songs.items()
+    )
+    generator = random.Random(0)
+    variants = [
+        (textage_id, _ocr_variant(song.title, generator))
+        for textage_id, song in songs.items()
+    ]
+    exact = sum(1 for textage_id, text in variants if by_title.get(text) == textage_id)
+    normalized = sum(
+        1
+        for textage_id, text in variants
+        if textage_id in by_key.get(normalize_key(text), set())
+    )
+    print(f"{len(variants)} OCR-style title variants found by")
+    print(f"  {'exact title':24s} {exact:6d}")
+    print(f"  {'normalized key':24s} {normalized:6d}")
+
+
+if __name__ == "__main__":
+    main()
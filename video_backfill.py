@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Backfills scores from a recorded session across a process pool.
+
+The recording is a (frames, height, width, 3) BGR .npy file, opened
+memory-mapped so no worker holds more of it than it reads. It's split
+where the song select screen comes back (found with a StateProbeSet),
+and each segment is run through a frame processor with its own
+VideoProcessingState in a worker process. The SongReference is built
+once in the parent. Forked workers share it copy-on-write, and spawned
+ones unpickle it once each. The scores come back merged in frame order.
+
+The frame processor is the live per-frame state machine, or anything
+with its signature:
+
+    processor(state, frame_number, frame, frame_state, song_reference)
+        -> Optional[RecoveredScore]
+
+It has to be a module level function so the workers can import it.
+
+Run as a script, this writes a synthetic recording and prints frames/s
+for 1, 2, 4, ... workers, then checks that spawned workers (the only
+kind on Windows) recover the same scores:
+
+    python3 video_backfill.py --songs 40 --workers 1 2 4
+"""
+
+import os
+import time
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+from multiprocessing.context import BaseContext
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ocr_scheduler import difference_hash
+from state_probes import StateProbeSet
+from download_textage_tables import build_song_reference, get_all_song_metadata
+from local_dataclasses import (
+    Score,
+    StatePixel,
+    SongReference,
+    RecoveredScore,
+    VideoProcessingState,
+)
+
+log = logging.getLogger(__name__)
+
+SONG_SELECT_STATE = "song_select"
+CLASSIFY_CHUNK_FRAMES = 256
+
+FrameProcessor = Callable[
+    [VideoProcessingState, int, NDArray, Optional[str], SongReference],
+    Optional[RecoveredScore],
+]
+Segment = Tuple[int, int]
+
+# set in each worker by _init_worker, inherited for free when forked
+_worker_song_reference: Optional[SongReference] = None
+
+
+def open_recording(recording_file: Path) -> NDArray:
+    return np.load(recording_file, mmap_mode="r")
+
+
+def classify_frames(
+    frames: NDArray, probe_set: StateProbeSet, start: int = 0, end: int = -1
+) -> List[Optional[str]]:
+    """
+    The screen state of frames[start:end], a chunk at a time. Only the
+    probed pixels are read.
+    """
+    if end < 0:
+        end = len(frames)
+    states: List[Optional[str]] = []
+    for chunk_start in range(start, end, CLASSIFY_CHUNK_FRAMES):
+        chunk_end = min(end, chunk_start + CLASSIFY_CHUNK_FRAMES)
+        states.extend(probe_set.match_states(frames[chunk_start:chunk_end]))
+    return states
+
+
+def split_at_song_select(frame_states: Sequence[Optional[str]]) -> List[Segment]:
+    """
+    [start, end) frame ranges, each starting where the song select
+    screen comes back, so no play spans two segments.
+    """
+    starts = [0] + [
+        frame_number
+        for frame_number in range(1, len(frame_states))
+        if frame_states[frame_number] == SONG_SELECT_STATE
+        and frame_states[frame_number - 1] != SONG_SELECT_STATE
+    ]
+    ends = starts[1:] + [len(frame_states)]
+    return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+
+def _init_worker(song_reference: SongReference):
+    global _worker_song_reference
+    _worker_song_reference = song_reference
+
+
+def _process_segment(
+    recording_file: Path,
+    segment: Segment,
+    frame_states: List[Optional[str]],
+    processor: FrameProcessor,
+) -> List[RecoveredScore]:
+    song_reference = _worker_song_reference
+    assert song_reference is not None, "worker was started without _init_worker"
+    frames = open_recording(recording_file)
+    state = VideoProcessingState()
+    recovered = []
+    start, end = segment
+    for frame_number in range(start, end):
+        score = processor(
+            state,
+            frame_number,
+            frames[frame_number],
+            frame_states[frame_number - start],
+            song_reference,
+        )
+        if score is not None:
+            recovered.append(score)
+    return recovered
+
+
+def backfill_recording(
+    recording_file: Path,
+    state_pixels: Sequence[StatePixel],
+    processor: FrameProcessor,
+    song_reference: SongReference,
+    workers: int = 0,
+    start_method: Optional[str] = None,
+) -> List[RecoveredScore]:
+    """
+    Every score processor recovers from the recording, in frame order.
+    workers defaults to one per core. start_method defaults to fork
+    where there is one, and the platform default elsewhere.
+    """
+    frames = open_recording(recording_file)
+    frame_states = classify_frames(frames, StateProbeSet(state_pixels))
+    segments = split_at_song_select(frame_states)
+    log.info(f"{recording_file}: {len(frames)} frames, {len(segments)} segments")
+    # fork, where there is one, so workers inherit the imports and the
+    # SongReference instead of unpickling them
+    if start_method is None and "fork" in multiprocessing.get_all_start_methods():
+        start_method = "fork"
+    context: BaseContext = multiprocessing.get_context(start_method)
+    with ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(song_reference,),
+    ) as executor:
+        results = executor.map(
+            _process_segment,
+            [recording_file] * len(segments),
+            segments,
+            [frame_states[start:end] for start, end in segments],
+            [processor] * len(segments),
+        )
+        recovered = [score for segment_scores in results for score in segment_scores]
+    return sorted(recovered, key=lambda score: score.frame_number)
+
+
+# the synthetic recording: probes in the top left corner, the score and
+# song index encoded in row SCORE_ROW of score screen frames
+SYNTHETIC_STATES = {
+    "song_select": (0, 0, 255),
+    "playing": (0, 255, 0),
+    "score": (255, 0, 0),
+}
+SCORE_ROW = 10
+
+
+def synthetic_state_pixels() -> List[StatePixel]:
+    return [
+        StatePixel(state=state, name=f"{state} marker", y=0, x=x, b=b, g=g, r=r)
+        for x, (state, (b, g, r)) in enumerate(SYNTHETIC_STATES.items())
+    ]
+
+
+def write_synthetic_recording(
+    recording_file: Path,
+    songs: int,
+    height: int = 180,
+    width: int = 320,
+    frames_per_state: Tuple[int, int, int] = (30, 120, 30),
+):
+    """
+    songs x (song select, playing, score) screens of noise with the
+    state markers set. Written through a memmap, a frame at a time.
+    """
+    generator = np.random.default_rng(0)
+    total = songs * sum(frames_per_state)
+    frames = np.lib.format.open_memmap(
+        recording_file, mode="w+", dtype=np.uint8, shape=(total, height, width, 3)
+    )
+    frame_number = 0
+    for song in range(songs):
+        for state, count in zip(SYNTHETIC_STATES, frames_per_state):
+            for _ in range(count):
+                frame = generator.integers(0, 256, (height, width, 3), np.uint8)
+                frame[0, :] = 0
+                frame[0, list(SYNTHETIC_STATES).index(state)] = SYNTHETIC_STATES[state]
+                if state == "score":
+                    frame[SCORE_ROW, :7, 0] = (song % 256, 10, 5, 1, 0, 7, 3)
+                    frame[SCORE_ROW, 7, 0] = song
+                frames[frame_number] = frame
+                frame_number += 1
+    frames.flush()
+
+
+def process_synthetic_frame(
+    state: VideoProcessingState,
+    frame_number: int,
+    frame: NDArray,
+    frame_state: Optional[str],
+    song_reference: SongReference,
+) -> Optional[RecoveredScore]:
+    """
+    Stands in for the live state machine: hashes a title zone every
+    frame (as the OCR scheduler would), and reads the score the first
+    time a score screen shows up.
+    """
+    difference_hash(frame[20:100, 40:280])
+    if frame_state != "score" or state.score is not None:
+        return None
+    fgreat, great, good, bad, poor, fast, slow = (
+        int(value) for value in frame[SCORE_ROW, :7, 0]
+    )
+    state.score = Score(fgreat, great, good, bad, poor, fast, slow)
+    titles = sorted(song_reference.by_title)
+    textage_id = None
+    if titles:
+        textage_id = song_reference.by_title[
+            titles[int(frame[SCORE_ROW, 7, 0]) % len(titles)]
+        ]
+    return RecoveredScore(frame_number, state.score, textage_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--songs", type=int, default=40)
+    parser.add_argument("--workers", type=int, nargs="+", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers or sorted(
+        {1, *[2**power for power in range(1, cores.bit_length()) if 2**power <= cores]}
+    )
+    song_reference = build_song_reference(get_all_song_metadata(download=False))
+    with tempfile.TemporaryDirectory() as temporary_path:
+        recording_file = Path(temporary_path) / Path("recording.npy")
+        write_synthetic_recording(recording_file, args.songs)
+        frames = len(open_recording(recording_file))
+        baseline: Optional[float] = None
+        expected: Optional[List[RecoveredScore]] = None
+        print(f"{frames} frames, {args.songs} songs, {cores} cores")
+        for workers in worker_counts:
+            started = time.perf_counter()
+            recovered = backfill_recording(
+                recording_file,
+                synthetic_state_pixels(),
+                process_synthetic_frame,
+                song_reference,
+                workers,
+            )
+            frames_per_second = frames / (time.perf_counter() - started)
+            if baseline is None:
+                baseline = frames_per_second
+                expected = recovered
+            elif recovered != expected:
+                raise RuntimeError(f"{workers} workers recovered different scores")
+            print(
+                f"  {workers:3d} workers {frames_per_second:9.0f} frames/s "
+                f"{frames_per_second / baseline:5.2f}x, {len(recovered)} scores"
+            )
+        # spawned workers get the SongReference pickled through initargs
+        spawned = backfill_recording(
+            recording_file,
+            synthetic_state_pixels(),
+            process_synthetic_frame,
+            song_reference,
+            worker_counts[-1],
+            start_method="spawn",
+        )
+        if spawned != expected:
+            raise RuntimeError("spawned workers recovered different scores")
+        print(f"  spawned workers recovered the same {len(spawned)} scores")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
 import logging
+import argparse
 from datetime import datetime, timezone
-from typing import List, Dict, Callable, Tuple
+from typing import List, Dict, Callable, Tuple, Any
 from local_dataclasses import SongMetadata, Difficulty
+from search_index import build_search_index, build_search_javascript, build_search_box
+from instrumentation import (
+    span,
+    add_instrumentation_arguments,
+    configure_instrumentation,
+)
 
 from download_textage_tables import (
     get_current_version_song_metadata_not_in_infinitas as get_em,
@@ -11,7 +18,7 @@ from download_textage_tables import (
 
 def check_optional_difficulties(
     song: SongMetadata,
-) -> Dict[str, str]:
+) -> Dict[Difficulty, str]:
     optional_difficulties: Dict[Difficulty, str] = {}
     for difficulty in Difficulty:
         if difficulty == Difficulty.UNKNOWN:
@@ -63,7 +70,7 @@ def build_table(table_id: Tuple[str, str], songs: List[SongMetadata]) -> str:
     for song in songs:
         difficulties = check_optional_difficulties(song)
         song_row = (
-            "<tr>"
+            f"<tr data-song='{song.textage_id}'>"
             "<td class='song'>"
             f"<div class='title'>{song.title}</div>"
             f"<div class='genre'>{song.genre}</div>"
@@ -158,11 +165,11 @@ def build_buttons(sorted_tables: List[Tuple[str, str]]) -> str:
     return buttons_table.format(buttons=button_html)
 
 
-def write_html(sorted_tables: Dict[Tuple[str, str], str]):
+def write_html(sorted_tables: Dict[Tuple[str, str], str], search_index: Dict[str, Any]):
     utc_now = datetime.now(tz=timezone.utc).isoformat()
     table_ids: List[Tuple[str, str]] = [table for table in sorted_tables.keys()]
-    javascript = build_javascript(table_ids)
-    buttons = build_buttons(table_ids)
+    javascript = build_javascript(table_ids) + build_search_javascript(search_index)
+    buttons = build_search_box() + build_buttons(table_ids)
 
     css = """
     @media screen and (max-width:376px) {
@@ -193,6 +200,7 @@ def write_html(sorted_tables: Dict[Tuple[str, str], str]):
         td.header { font-size: 0.6em; background-color: #484848; font-weight: bold; color: #ffffff; }
            
         input { min-width: 16ch; margin: 0.6ch;}
+        input#search { width: 90%; padding: 1ch; }
         h3 { font-family: sans-serif; font-weight: bold; }
         }
         @media screen and (min-width:376px) {
@@ -215,6 +223,7 @@ def write_html(sorted_tables: Dict[Tuple[str, str], str]):
         td.dpl { background: #EC98F7; min-width:2ch; font-weight: bold;  font-size: 1.2em; }
         td.header { background-color: #484848; font-weight: bold; color: #ffffff; }
         input { min-width: 16ch; margin: 0.4ch;}
+        input#search { min-width: 40ch; padding: 1ch; }
         h3 { font-family: sans-serif; font-weight: bold; }
     }"""
 
@@ -242,8 +251,9 @@ def write_html(sorted_tables: Dict[Tuple[str, str], str]):
     html = html_template.format(
         utc_now=utc_now, css=css, javascript=javascript, buttons=buttons, tables=tables
     )
-    with open("index.html", "wt") as html_writer:
+    with span("write index.html") as stage, open("index.html", "wt") as html_writer:
         html_writer.write(html)
+        stage.add(records=len(sorted_tables), bytes_written=html_writer.tell())
 
 
 def generate_all_sorted_tables(songs: List[SongMetadata]) -> Dict[Tuple[str, str], str]:
@@ -291,15 +301,25 @@ def generate_all_sorted_tables(songs: List[SongMetadata]) -> Dict[Tuple[str, str
     }
     sorted_tables: Dict[Tuple[str, str], str] = {}
     for table_id, sort_method in tables_and_sort_methods.items():
-        sorted_tables[table_id] = build_table(table_id, sorted(songs, key=sort_method))
+        with span(f"sort {table_id[0]}") as stage:
+            sorted_songs = sorted(songs, key=sort_method)
+            stage.add(records=len(sorted_songs))
+        with span(f"render {table_id[0]}") as stage:
+            sorted_tables[table_id] = build_table(table_id, sorted_songs)
+            stage.add(records=len(sorted_songs))
     return sorted_tables
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Write index.html")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
+    configure_instrumentation(args)
     songs: List[SongMetadata] = [value for key, value in get_em().items()]
     sorted_tables = generate_all_sorted_tables(songs)
-    write_html(sorted_tables)
+    search_index = build_search_index(songs)
+    write_html(sorted_tables, search_index)
 
 
 if __name__ == "__main__":